@@ -1,60 +1,884 @@
+import io
 import json
-import boto3
 import os
-import numpy as np
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
-s3 = boto3.client('s3')
+import coldstart
 
-def heavy_computation():
+startup = coldstart.Startup("heavy")
+
+import backends
+import json_stream
+import metrics
+from result_cache import ResultCache, cache_key
+from result_sink import MONGO_URI, ResultSink, mongo_writer
+from result_store import ResultArrays
+
+s3 = backends.client('s3')
+lambda_client = backends.client("lambda")
+np = None  # numpy, imported by load_numpy() on first use
+
+DEFAULT_MATRIX_SIZE = 1000
+DEFAULT_STATISTICS = ("sum", "mean")
+MEMORY_BUDGET_MB = int(os.environ.get("HEAVY_MEMORY_BUDGET_MB", "256"))
+OUTPUT_BUCKET = "f1p1-output-bucket"
+IO_WORKERS = int(os.environ.get("HEAVY_IO_WORKERS", "4"))
+PANEL_ROWS = 64  # rows per independently seeded block of an input matrix
+
+RESULT_CACHE_ENABLED = os.environ.get("RESULT_CACHE", "on") == "on"
+RESULT_CACHE_PREFIX = os.environ.get("RESULT_CACHE_PREFIX", "cache/")
+RESULT_CACHE_TTL_S = float(os.environ.get("RESULT_CACHE_TTL_S", "86400"))
+RESULT_CACHE_MAX_BYTES = int(os.environ.get("RESULT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+# Jobs estimated above FANOUT_TILE_COST (see estimate_cost) are split into
+# tiles of about that cost, each computed by its own heavy invocation.
+FANOUT_TILE_COST = float(os.environ.get("FANOUT_TILE_COST", "5e10"))
+FANOUT_MAX_TILES = int(os.environ.get("FANOUT_MAX_TILES", "256"))
+FANOUT_PREFIX = os.environ.get("FANOUT_PREFIX", "tiles/")
+
+SUPPORTED_DTYPES = ("float32", "float64")
+SUMMARY_STATISTICS = {"sum", "mean"}
+PRODUCT_STATISTICS = {"min", "max", "std"}
+OUTPUT_FORMATS = ("json", "npy", "npz")
+ARRAY_OUTPUTS = ("row_sums", "product")
+
+result_cache = ResultCache(
+    s3,
+    OUTPUT_BUCKET,
+    prefix=RESULT_CACHE_PREFIX,
+    ttl_s=RESULT_CACHE_TTL_S,
+    max_bytes=RESULT_CACHE_MAX_BYTES
+)
+
+# Optional write-behind copy of every output into Mongo, enabled by MONGO_URI.
+result_sink = ResultSink(mongo_writer()) if MONGO_URI else None
+
+
+def load_numpy():
+    """
+    Imports numpy on first use, so invocations that never compute (cache
+    hits, bad inputs) don't pay for it on a cold start.
+    """
+    global np
+    if np is None:
+        np = coldstart.lazy_import("numpy")
+    return np
+
+
+def resolve_parameters(parameters=None):
+    """
+    Normalizes the `parameters` block of a scenario input.
+
+    Recognized keys (all optional):
+    - matrix_size: side length of the square input matrices
+    - dtype: "float32" or "float64"
+    - seed: integer seed for the generated inputs (drawn at random if absent)
+    - statistics: list of statistics to report, from sum/mean/min/max/std
+    - memory_budget_mb: peak working memory allowed for the product
+    - output_format: "json" (default), or "npy"/"npz" to also store arrays
+    - outputs: arrays to store in binary formats, from row_sums/product
+    - compress: deflate the .npz archive
+    - tiles: split the job across this many heavy invocations (JSON output
+      only); by default large jobs are split by cost, see plan_tiles
+    Raises ValueError on anything it can't honor.
+    """
+    parameters = parameters or {}
+
+    size = int(parameters.get("matrix_size", DEFAULT_MATRIX_SIZE))
+    if size <= 0:
+        raise ValueError(f"matrix_size must be positive, got {size}")
+
+    dtype = parameters.get("dtype", "float64")
+    if dtype not in SUPPORTED_DTYPES:
+        raise ValueError(f"Unsupported dtype: {dtype}")
+
+    statistics = tuple(parameters.get("statistics", DEFAULT_STATISTICS))
+    unknown = set(statistics) - SUMMARY_STATISTICS - PRODUCT_STATISTICS
+    if unknown:
+        raise ValueError(f"Unsupported statistics: {sorted(unknown)}")
+
+    budget_mb = float(parameters.get("memory_budget_mb", MEMORY_BUDGET_MB))
+    if budget_mb <= 0:
+        raise ValueError(f"memory_budget_mb must be positive, got {budget_mb}")
+
+    output_format = parameters.get("output_format", "json")
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unsupported output_format: {output_format}")
+
+    outputs = tuple(parameters.get("outputs", ("row_sums",) if output_format != "json" else ()))
+    unknown = set(outputs) - set(ARRAY_OUTPUTS)
+    if unknown:
+        raise ValueError(f"Unsupported outputs: {sorted(unknown)}")
+
+    tiles = parameters.get("tiles")
+    if tiles is not None and int(tiles) <= 0:
+        raise ValueError(f"tiles must be positive, got {tiles}")
+
+    seed = parameters.get("seed")
+    if seed is None:
+        seed = int.from_bytes(os.urandom(8), "big") >> 1
+
+    return {
+        "matrix_size": size,
+        "dtype": dtype,
+        "seed": int(seed),
+        "statistics": statistics,
+        "memory_budget_mb": budget_mb,
+        "output_format": output_format,
+        "outputs": outputs,
+        "compress": bool(parameters.get("compress", False)),
+        "tiles": None if tiles is None else int(tiles),
+    }
+
+
+def _panel(seed, matrix_id, panel, size, dtype):
+    """
+    Generates rows [panel * PANEL_ROWS, (panel + 1) * PANEL_ROWS) of input
+    matrix `matrix_id` (0 for A, 1 for B). Each panel has its own seed, so any
+    row range can be rebuilt on demand and the inputs don't depend on tiling.
+    """
+    rows = min(PANEL_ROWS, size - panel * PANEL_ROWS)
+    rng = np.random.default_rng([seed, matrix_id, panel])
+    return rng.random((rows, size), dtype=dtype)
+
+
+def _panel_count(size):
+    return (size + PANEL_ROWS - 1) // PANEL_ROWS
+
+
+def _summary_statistics(params):
+    """
+    Exact sum/mean of A @ B without forming the product:
+    sum(A @ B) = colsum(A) . rowsum(B). Holds one panel at a time.
+    """
+    size, dtype, seed = params["matrix_size"], params["dtype"], params["seed"]
+    col_sums = np.zeros(size, dtype=np.float64)
+    row_sums = np.empty(size, dtype=np.float64)
+
+    for p in range(_panel_count(size)):
+        col_sums += _panel(seed, 0, p, size, dtype).sum(axis=0, dtype=np.float64)
+        start = p * PANEL_ROWS
+        b = _panel(seed, 1, p, size, dtype)
+        row_sums[start:start + b.shape[0]] = b.sum(axis=1, dtype=np.float64)
+
+    total = float(np.dot(col_sums, row_sums))
+    return {"sum": total, "mean": total / (size * size)}, 0
+
+
+def _b_row_sums(params):
+    size, dtype, seed = params["matrix_size"], params["dtype"], params["seed"]
+    row_sums = np.empty(size, dtype=np.float64)
+    for p in range(_panel_count(size)):
+        start = p * PANEL_ROWS
+        b = _panel(seed, 1, p, size, dtype)
+        row_sums[start:start + b.shape[0]] = b.sum(axis=1, dtype=np.float64)
+    return row_sums
+
+
+def _row_sum_blocks(params):
+    """
+    Yields rowsum(A @ B) = A @ rowsum(B) one panel of rows at a time,
+    without forming the product.
+    """
+    size, dtype, seed = params["matrix_size"], params["dtype"], params["seed"]
+    row_sums = _b_row_sums(params)
+    for p in range(_panel_count(size)):
+        yield (_panel(seed, 0, p, size, dtype) @ row_sums).astype(dtype)
+
+
+def _tiled_statistics(params, on_block=None, row_panels=None):
+    """
+    Computes A @ B one block of rows at a time, folding each block into running
+    statistics. B stays resident when it fits in half the memory budget;
+    otherwise its panels are regenerated for every row block.
+    `on_block`, if given, is called with each block in row order.
+    `row_panels` restricts the work to a range of A's panels (one fan-out
+    tile); the returned count and m2 let partial results be merged.
+    """
+    size, dtype, seed = params["matrix_size"], params["dtype"], params["seed"]
+    itemsize = np.dtype(dtype).itemsize
+    budget = params["memory_budget_mb"] * 1024 * 1024
+    panels = _panel_count(size)
+
+    b_bytes = size * size * itemsize
+    resident_b = b_bytes <= budget / 2
+    if resident_b:
+        B = np.concatenate([_panel(seed, 1, p, size, dtype) for p in range(panels)])
+        available = budget - b_bytes
+    else:
+        B = None
+        available = budget - PANEL_ROWS * size * itemsize
+
+    # Per row of a block: one row of A, one row of C and a float64 temporary.
+    row_bytes = size * (2 * itemsize + 8)
+    row_panels = row_panels if row_panels is not None else range(panels)
+    block_panels = max(1, min(len(row_panels), int(available // (row_bytes * PANEL_ROWS))))
+
+    count, mean, m2 = 0, 0.0, 0.0
+    total = 0.0
+    minimum, maximum = np.inf, -np.inf
+    tiles = 0
+
+    for first in range(row_panels.start, row_panels.stop, block_panels):
+        block = range(first, min(first + block_panels, row_panels.stop))
+        A = np.concatenate([_panel(seed, 0, p, size, dtype) for p in block])
+
+        if resident_b:
+            C = A @ B
+        else:
+            C = np.zeros((A.shape[0], size), dtype=A.dtype)
+            for p in range(panels):
+                start = p * PANEL_ROWS
+                b = _panel(seed, 1, p, size, dtype)
+                C += A[:, start:start + b.shape[0]] @ b
+        del A
+        if on_block is not None:
+            on_block(C)
+
+        n = C.size
+        block_sum = float(C.sum(dtype=np.float64))
+        block_mean = block_sum / n
+        block_m2 = float(C.var(dtype=np.float64)) * n
+        delta = block_mean - mean
+        mean += delta * n / (count + n)
+        m2 += block_m2 + delta * delta * count * n / (count + n)
+        count += n
+        total += block_sum
+        minimum = min(minimum, float(C.min()))
+        maximum = max(maximum, float(C.max()))
+        tiles += 1
+        del C
+
+    stats = {
+        "sum": total,
+        "mean": total / count,
+        "min": minimum,
+        "max": maximum,
+        "std": (m2 / count) ** 0.5,
+        "count": count,
+        "m2": m2,
+    }
+    return stats, tiles
+
+
+def heavy_computation(parameters=None, on_block=None):
+    """
+    Multiplies two seeded random square matrices and summarizes the product.
+
+    The job is driven by the scenario `parameters` (see resolve_parameters).
+    Sum/mean-only requests take an exact fast path that never forms the
+    product; anything else computes the product in row blocks sized to stay
+    within the memory budget. Passing `on_block` forces the blocked path and
+    hands it every block of the product, in row order.
+    """
     print("🧮 Starting heavy computation...")
-    size = 1000  # Adjust for desired heaviness (e.g., 1000x1000 matrix)
-    
-    A = np.random.rand(size, size)
-    B = np.random.rand(size, size)
-    
-    result = np.dot(A, B)
-    
+    load_numpy()
+    params = resolve_parameters(parameters)
+    size = params["matrix_size"]
+    statistics = params["statistics"]
+
+    if set(statistics) <= SUMMARY_STATISTICS and on_block is None:
+        method = "summary"
+        stats, tiles = _summary_statistics(params)
+    else:
+        method = "tiled"
+        stats, tiles = _tiled_statistics(params, on_block)
+
     computation_summary = {
-        "shape": result.shape,
-        "sum": float(np.sum(result)),
-        "mean": float(np.mean(result))
+        "shape": (size, size),
+        "dtype": params["dtype"],
+        "seed": params["seed"],
+        "method": method,
+        "tiles": tiles,
     }
-    
-    print("✅ Heavy computation done.")
+    for name in statistics:
+        computation_summary[name] = stats[name]
+
+    print(f"✅ Heavy computation done ({method}, {tiles} tiles).")
     return computation_summary
 
-def lambda_handler(event, context):
-    print("🧠 Heavy Lambda Started")
-    print("📥 Event received:", json.dumps(event))
 
-    bucket = event["bucket"]
-    key = event["key"]
+def estimate_cost(parameters=None):
+    """
+    Rough work estimate for a job, in matrix elements touched: generating
+    both inputs is 2n², and anything that needs the product (min/max/std or
+    a stored product array) adds the 2n³ of the matmul. Used to decide
+    whether a job is cheap enough to run inline. Raises ValueError like
+    resolve_parameters.
+    """
+    return _cost(resolve_parameters(parameters))
 
-    response = s3.get_object(Bucket=bucket, Key=key)
-    input_data = json.loads(response['Body'].read())
 
-    print("📄 Input data loaded:", input_data)
+def _cost(params):
+    n = params["matrix_size"]
+    cost = 2 * n * n
+    if set(params["statistics"]) & PRODUCT_STATISTICS or "product" in params["outputs"]:
+        cost += 2 * n ** 3
+    return cost
 
-    computation_result = heavy_computation()
+
+def canonical_parameters(parameters=None):
+    """
+    The result-affecting subset of `parameters` with defaults filled in, used
+    as the cache identity, or None for jobs that don't pin a seed: those ask
+    for a fresh random sample every time and are never cached.
+    """
+    if (parameters or {}).get("seed") is None:
+        return None
+    params = resolve_parameters(parameters)
+    return {
+        "matrix_size": params["matrix_size"],
+        "dtype": params["dtype"],
+        "seed": params["seed"],
+        "statistics": sorted(set(params["statistics"])),
+    }
+
+
+def result_cache_key(parameters=None):
+    """The result cache key for a job, or None when it mustn't be cached."""
+    if not RESULT_CACHE_ENABLED:
+        return None
+    canonical = canonical_parameters(parameters)
+    return cache_key(canonical) if canonical is not None else None
+
+
+def cached_computation(parameters=None):
+    """
+    heavy_computation() behind the result cache.
+    Returns (computation_result, cache_info).
+    """
+    if not RESULT_CACHE_ENABLED:
+        return heavy_computation(parameters), {"enabled": False}
+    key = result_cache_key(parameters)
+    if key is None:
+        return heavy_computation(parameters), {"enabled": True, "hit": False, "skipped": "unseeded"}
+
+    result = result_cache.get(key)
+    if result is not None:
+        print(f"♻️ Cache hit {key[:12]}, skipping computation.")
+        return result, {"enabled": True, "key": key, "hit": True}
+
+    result = heavy_computation(parameters)
+    result_cache.put(key, result)
+    return result, {"enabled": True, "key": key, "hit": False}
+
+
+def load_input(bucket, key, recorder=None):
+    recorder = recorder or metrics.StageRecorder("heavy", key)
+    with recorder.stage("s3_get") as stage:
+        response = s3.get_object(Bucket=bucket, Key=key)
+        stage["bytes"] = response.get("ContentLength")
+
+    # Decoded from the body in chunks: the raw bytes and the full text are
+    # never held at once, and large numeric arrays land in ndarrays.
+    with recorder.stage("json_decode", bytes=response.get("ContentLength")):
+        input_data = json_stream.load(response['Body'].iter_chunks(json_stream.JSON_CHUNK_SIZE))
+    recorder.request_id = input_data.get("request_id")
+    return input_data
+
+
+def result_key(key):
+    return key.replace("scenario_inputs", "results")
+
+
+def build_binary_output(key, input_data):
+    """
+    Computes a job whose output_format is npy/npz. The requested arrays are
+    streamed to the output bucket while they are computed, so the product is
+    never held in memory whole; the returned output_data is a small JSON
+    manifest pointing at them instead of an echo of the input.
+    """
+    parameters = input_data.get("parameters")
+    load_numpy()
+    params = resolve_parameters(parameters)
+    if (parameters or {}).get("seed") is None:
+        # Pin the drawn seed so the arrays and the summary come from the same inputs.
+        parameters = dict(parameters or {}, seed=params["seed"])
+    size, dtype = params["matrix_size"], params["dtype"]
+    output_key = result_key(key)
+    base_key = output_key[:-len(".json")] if output_key.endswith(".json") else output_key
+
+    with ResultArrays(s3, OUTPUT_BUCKET, base_key, params["output_format"], params["compress"]) as arrays:
+        if "row_sums" in params["outputs"]:
+            with arrays.array("row_sums", (size,), dtype) as stream:
+                for block in _row_sum_blocks(params):
+                    stream.write(block)
+        if "product" in params["outputs"]:
+            with arrays.array("product", (size, size), dtype) as stream:
+                computation_result = heavy_computation(parameters, on_block=stream.write)
+        else:
+            computation_result = heavy_computation(parameters)
 
     output_data = {
+        "status": "processed",
+        "original_key": key,
+        "request_id": input_data.get("request_id"),
+        "parameters": input_data.get("parameters"),
+        "processed_at": datetime.utcnow().isoformat(),
+        "computation_result": computation_result,
+        "format": params["output_format"],
+        "arrays": arrays.entries
+    }
+    if arrays.archive is not None:
+        output_data["archive"] = arrays.archive
+    return output_data
+
+
+def build_output(key, input_data, recorder=None):
+    recorder = recorder or metrics.StageRecorder("heavy", key, input_data.get("request_id"))
+    if (input_data.get("parameters") or {}).get("output_format", "json") != "json":
+        with recorder.stage("compute", format="binary"):
+            return build_binary_output(key, input_data)
+
+    with recorder.stage("compute") as stage:
+        computation_result, cache_info = cached_computation(input_data.get("parameters"))
+        stage["cache_hit"] = cache_info.get("hit", False)
+
+    return {
+        "status": "processed",
+        "original_key": key,
+        "original_data": input_data,
+        "processed_at": datetime.utcnow().isoformat(),
+        "computation_result": computation_result,
+        "cache": cache_info
+    }
+
+
+def write_output(key, output_data, recorder=None):
+    recorder = recorder or metrics.StageRecorder("heavy", key)
+    output_key = result_key(key)
+
+    with recorder.stage("encode") as stage:
+        body = json.dumps(output_data, default=json_stream.to_json)
+        stage["bytes"] = len(body)
+
+    with recorder.stage("s3_put", bytes=len(body)):
+        s3.put_object(
+            Bucket=OUTPUT_BUCKET,
+            Key=output_key,
+            Body=body,
+            ContentType="application/json"
+        )
+
+    if result_sink is not None:
+        record = json_stream.to_builtin(dict(output_data, output_key=output_key))
+        result_sink.add(record, size=len(body))
+
+    print(f"✅ Output written to s3://{OUTPUT_BUCKET}/{output_key}")
+    return output_key
+
+
+def plan_tiles(params):
+    """
+    Splits A's row panels into contiguous tiles, one per heavy invocation:
+    params["tiles"] of them if given, otherwise enough to keep each near
+    FANOUT_TILE_COST, at most FANOUT_MAX_TILES. Binary outputs are never
+    split. Returns a list of (first panel, stop panel) pairs.
+    """
+    panels = _panel_count(params["matrix_size"])
+    if params["output_format"] != "json":
+        return [(0, panels)]
+    count = params["tiles"] or -(-_cost(params) // FANOUT_TILE_COST)
+    count = int(max(1, min(count, panels, FANOUT_MAX_TILES)))
+    bounds = [i * panels // count for i in range(count + 1)]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def tile_partial(params, first, stop, b_row_sums=None):
+    """
+    Statistics of rows [first, stop) panels of A @ B, in a form
+    merge_partials can combine: count and sum, plus m2/min/max when the
+    job needs more than sum/mean. Sum/mean-only tiles use rowsum(B), which
+    the coordinator computes once for all of them (see start_fanout);
+    it's only rebuilt here when `b_row_sums` isn't given.
+    """
+    load_numpy()
+    size, dtype, seed = params["matrix_size"], params["dtype"], params["seed"]
+    if set(params["statistics"]) <= SUMMARY_STATISTICS:
+        row_sums = _b_row_sums(params) if b_row_sums is None else b_row_sums
+        total, rows = 0.0, 0
+        for p in range(first, stop):
+            a = _panel(seed, 0, p, size, dtype)
+            total += float((a @ row_sums).sum())
+            rows += a.shape[0]
+        return {"count": rows * size, "sum": total}
+
+    stats, _ = _tiled_statistics(params, row_panels=range(first, stop))
+    return {name: stats[name] for name in ("count", "sum", "m2", "min", "max")}
+
+
+def merge_partials(partials):
+    """Combines tile partials, in order, into sum/mean and, if present, min/max/std."""
+    count, total, mean, m2 = 0, 0.0, 0.0, 0.0
+    minimum, maximum = float("inf"), float("-inf")
+    for part in partials:
+        n = part["count"]
+        total += part["sum"]
+        if "m2" in part:
+            part_mean = part["sum"] / n
+            delta = part_mean - mean
+            mean += delta * n / (count + n)
+            m2 += part["m2"] + delta * delta * count * n / (count + n)
+            minimum = min(minimum, part["min"])
+            maximum = max(maximum, part["max"])
+        count += n
+    stats = {"sum": total, "mean": total / count}
+    if all("m2" in part for part in partials):
+        stats.update({"min": minimum, "max": maximum, "std": (m2 / count) ** 0.5})
+    return stats
+
+
+def _tile_prefix(job):
+    return f"{FANOUT_PREFIX}{job}/"
+
+
+def start_fanout(key, input_data, tiles, recorder=None):
+    """
+    Coordinator side of a fan-out: pins the seed, writes a manifest under
+    FANOUT_PREFIX and async-invokes the heavy function once per tile. The
+    last tile to finish runs the reduce (see process_tile). Sum/mean-only
+    jobs get rowsum(B) computed here once and stored next to the manifest,
+    so each tile only generates its own panels of A. A cached result is
+    written straight away instead.
+    Returns a status entry: "fanned_out" with the tile count and the key
+    the reducer will write, or "success" for a cache hit.
+    """
+    recorder = recorder or metrics.StageRecorder("heavy", key, input_data.get("request_id"))
+    parameters = input_data.get("parameters") or {}
+    params = resolve_parameters(parameters)
+    cache_entry = result_cache_key(parameters)
+    if cache_entry is not None:
+        cached = result_cache.get(cache_entry)
+        if cached is not None:
+            print(f"♻️ Cache hit for {key}, skipping fan-out.")
+            output_key = write_output(key, {
+                "status": "processed",
+                "original_key": key,
+                "original_data": input_data,
+                "processed_at": datetime.utcnow().isoformat(),
+                "computation_result": cached,
+                "cache": {"enabled": True, "hit": True}
+            }, recorder)
+            return {"status": "success", "output_key": output_key}
+
+    pinned = dict(parameters, seed=params["seed"])
+    job = cache_key({"key": key, "request_id": input_data.get("request_id"), "parameters": pinned})[:20]
+    function_name = os.environ.get("HEAVY_FUNCTION_NAME") or os.environ["AWS_LAMBDA_FUNCTION_NAME"]
+
+    with recorder.stage("fanout", tiles=len(tiles)):
+        if set(params["statistics"]) <= SUMMARY_STATISTICS:
+            load_numpy()
+            buffer = io.BytesIO()
+            np.save(buffer, _b_row_sums(params))
+            s3.put_object(Bucket=OUTPUT_BUCKET, Key=_tile_prefix(job) + "b_row_sums.npy",
+                          Body=buffer.getvalue(), ContentType="application/octet-stream")
+        s3.put_object(
+            Bucket=OUTPUT_BUCKET,
+            Key=_tile_prefix(job) + "manifest.json",
+            Body=json.dumps({"key": key, "input_data": input_data, "parameters": pinned, "tiles": tiles},
+                            default=json_stream.to_json),
+            ContentType="application/json"
+        )
+
+        def invoke(index):
+            tile = {"job": job, "index": index, "count": len(tiles), "parameters": pinned, "panels": tiles[index]}
+            lambda_client.invoke(FunctionName=function_name, InvocationType="Event",
+                                 Payload=json.dumps({"tile": tile}))
+
+        with ThreadPoolExecutor(max_workers=max(1, min(IO_WORKERS, len(tiles)))) as pool:
+            list(pool.map(invoke, range(len(tiles))))
+
+    print(f"🧩 Fanned out {key} as job {job} over {len(tiles)} tiles")
+    return {"status": "fanned_out", "job": job, "tiles": len(tiles), "output_key": result_key(key)}
+
+
+def process_tile(tile):
+    """
+    Computes one fan-out tile and stores its partial under the job prefix.
+    A tile that fails stores a failed-NNNNN.json record instead, so the
+    job still finishes (with an error output) rather than waiting forever.
+    Whichever tile sees every tile accounted for afterwards tries to reduce
+    the job (see reduce_tiles). Tiles delivered again after the job has
+    finished are skipped.
+    """
+    job, index = tile["job"], tile["index"]
+    prefix = _tile_prefix(job)
+    recorder = metrics.StageRecorder("heavy", f"{job}/{index}")
+    try:
+        try:
+            s3.head_object(Bucket=OUTPUT_BUCKET, Key=prefix + "manifest.json")
+        except s3.exceptions.ClientError as e:
+            if e.response["Error"]["Code"] not in ("404", "NoSuchKey", "NotFound"):
+                raise
+            print(f"⏭️ Job {job} already finished, skipping tile {index}")
+            return {"status": "skipped", "job": job, "tile": index}
+        try:
+            params = resolve_parameters(tile["parameters"])
+            b_row_sums = None
+            if set(params["statistics"]) <= SUMMARY_STATISTICS:
+                with recorder.stage("tile_get"):
+                    body = s3.get_object(Bucket=OUTPUT_BUCKET, Key=prefix + "b_row_sums.npy")['Body'].read()
+                    b_row_sums = load_numpy().load(io.BytesIO(body))
+            with recorder.stage("tile_compute", panels=tile["panels"]):
+                partial = tile_partial(params, *tile["panels"], b_row_sums=b_row_sums)
+            record_key, record, status = f"{prefix}part-{index:05d}.json", partial, "success"
+        except Exception as e:
+            print(f"❌ Tile {index} of job {job} failed: {e}")
+            record_key, record, status = f"{prefix}failed-{index:05d}.json", {"tile": index, "error": str(e)}, "error"
+        with recorder.stage("tile_put"):
+            s3.put_object(Bucket=OUTPUT_BUCKET, Key=record_key, Body=json.dumps(record), ContentType="application/json")
+        listed = s3.list_objects_v2(Bucket=OUTPUT_BUCKET, Prefix=prefix)
+        landed = sum(1 for obj in listed.get("Contents", [])
+                     if obj["Key"][len(prefix):].startswith(("part-", "failed-")))
+    finally:
+        recorder.flush()
+
+    entry = {"status": status, "job": job, "tile": index, "landed": landed}
+    if landed >= tile["count"]:
+        output_key = reduce_tiles(job)
+        if output_key is not None:
+            entry["output_key"] = output_key
+    return entry
+
+
+def _claim_reduce(job):
+    """Creates the job's reduce marker; False if another invocation already has."""
+    try:
+        s3.put_object(Bucket=OUTPUT_BUCKET, Key=_tile_prefix(job) + "reduce.claim", Body=b"",
+                      IfNoneMatch="*")
+    except s3.exceptions.ClientError as e:
+        if e.response["Error"]["Code"] in ("PreconditionFailed", "ConditionalRequestConflict"):
+            return False
+        raise
+    return True
+
+
+def _remove_tiles(job):
+    """Deletes everything under the job prefix, the manifest and then the claim last."""
+    prefix = _tile_prefix(job)
+    last = {prefix + "manifest.json": 1, prefix + "reduce.claim": 2}
+    keys = [obj["Key"] for obj in s3.list_objects_v2(Bucket=OUTPUT_BUCKET, Prefix=prefix).get("Contents", [])]
+    for key in sorted(keys, key=lambda k: last.get(k, 0)):
+        s3.delete_object(Bucket=OUTPUT_BUCKET, Key=key)
+
+
+def reduce_tiles(job):
+    """
+    Merges every partial of a fan-out job and writes the job's normal
+    output, or an error output listing the failed tiles. Only the
+    invocation that creates the job's reduce marker (an S3 conditional
+    put) reduces, so racing tiles write the output, and the sink record,
+    once. Afterwards the job prefix is deleted. Returns the output key, or
+    None if another invocation reduced the job.
+    """
+    if not _claim_reduce(job):
+        print(f"🧩 Job {job} is already being reduced")
+        return None
+    prefix = _tile_prefix(job)
+    try:
+        try:
+            body = s3.get_object(Bucket=OUTPUT_BUCKET, Key=prefix + "manifest.json")['Body'].read()
+        except s3.exceptions.NoSuchKey:
+            # Finished and cleaned up after this tile listed its peers.
+            s3.delete_object(Bucket=OUTPUT_BUCKET, Key=prefix + "reduce.claim")
+            return None
+        manifest = json.loads(body)
+        key, input_data = manifest["key"], manifest["input_data"]
+        count = len(manifest["tiles"])
+        recorder = metrics.StageRecorder("heavy", key, input_data.get("request_id"))
+        try:
+            output_data = _reduced_output(job, manifest, recorder)
+            output_key = write_output(key, output_data, recorder)
+        finally:
+            recorder.flush()
+    except Exception:
+        # Let a retry of this tile claim the reduce again.
+        s3.delete_object(Bucket=OUTPUT_BUCKET, Key=prefix + "reduce.claim")
+        raise
+
+    print(f"🧩 Reduced {count} tiles of job {job}")
+    _remove_tiles(job)
+    return output_key
+
+
+def _reduced_output(job, manifest, recorder):
+    prefix = _tile_prefix(job)
+    key, input_data = manifest["key"], manifest["input_data"]
+    count = len(manifest["tiles"])
+    failures = [
+        json.loads(s3.get_object(Bucket=OUTPUT_BUCKET, Key=obj["Key"])['Body'].read())
+        for obj in s3.list_objects_v2(Bucket=OUTPUT_BUCKET, Prefix=prefix + "failed-").get("Contents", [])
+    ]
+    if failures:
+        return {
+            "status": "error",
+            "original_key": key,
+            "original_data": input_data,
+            "processed_at": datetime.utcnow().isoformat(),
+            "error": f"{len(failures)} of {count} tiles failed",
+            "failed_tiles": failures,
+        }
+
+    with recorder.stage("reduce", tiles=count):
+        partials = [
+            json.loads(s3.get_object(Bucket=OUTPUT_BUCKET, Key=f"{prefix}part-{i:05d}.json")['Body'].read())
+            for i in range(count)
+        ]
+        stats = merge_partials(partials)
+
+    params = resolve_parameters(manifest["parameters"])
+    size = params["matrix_size"]
+    computation_result = {
+        "shape": (size, size),
+        "dtype": params["dtype"],
+        "seed": params["seed"],
+        "method": "fanout",
+        "tiles": len(partials),
+    }
+    for name in params["statistics"]:
+        computation_result[name] = stats[name]
+    cache_entry = result_cache_key(input_data.get("parameters"))
+    if cache_entry is not None:
+        result_cache.put(cache_entry, computation_result)
+
+    return {
         "status": "processed",
         "original_key": key,
         "original_data": input_data,
         "processed_at": datetime.utcnow().isoformat(),
-        "computation_result": computation_result
+        "computation_result": computation_result,
+        "cache": {"enabled": RESULT_CACHE_ENABLED, "hit": False, "fanout": job}
     }
 
-    output_key = key.replace("scenario_inputs", "results")
-    output_bucket = "f1p1-output-bucket"
 
-    s3.put_object(
-        Bucket=output_bucket,
-        Key=output_key,
-        Body=json.dumps(output_data),
-        ContentType="application/json"
-    )
+def fanout_plan(input_data):
+    """The tile plan for an input, or None when it runs in one invocation."""
+    tiles = plan_tiles(resolve_parameters(input_data.get("parameters")))
+    return tiles if len(tiles) > 1 else None
+
+
+def process_input(key, input_data, recorder=None):
+    """
+    Computes and writes the output for one already loaded input, fanning
+    large jobs out over several invocations. Returns a status entry like
+    start_fanout's: "success" once the output is written, "fanned_out"
+    while the tiles are still running.
+    """
+    tiles = fanout_plan(input_data)
+    if tiles is not None:
+        return start_fanout(key, input_data, tiles, recorder)
+    return {"status": "success", "output_key": write_output(key, build_output(key, input_data, recorder), recorder)}
+
+
+def process_batch(bucket, keys, io_workers=None):
+    """
+    Processes many input keys in one invocation.
+
+    Inputs are prefetched on a bounded thread pool (at most `io_workers`
+    downloads ahead of the compute) and outputs are uploaded on the same pool,
+    so S3 I/O overlaps with computation. A failing key is reported in its
+    status entry and doesn't stop the rest of the batch.
+    Returns one status dict per key, in input order.
+    """
+    io_workers = io_workers or IO_WORKERS
+    statuses = [None] * len(keys)
+    pending = deque()
+    uploads = []
+    remaining = iter(enumerate(keys))
+
+    with ThreadPoolExecutor(max_workers=io_workers) as pool:
+        def prefetch():
+            while len(pending) < io_workers:
+                item = next(remaining, None)
+                if item is None:
+                    return
+                index, key = item
+                recorder = metrics.StageRecorder("heavy", key)
+                pending.append((index, key, recorder, pool.submit(load_input, bucket, key, recorder)))
+
+        prefetch()
+        while pending:
+            index, key, recorder, download = pending.popleft()
+            prefetch()
+            try:
+                input_data = download.result()
+                tiles = fanout_plan(input_data)
+                if tiles is not None:
+                    statuses[index] = {"key": key, **start_fanout(key, input_data, tiles, recorder)}
+                    recorder.flush()
+                    continue
+                output_data = build_output(key, input_data, recorder)
+            except Exception as e:
+                print(f"❌ Failed to process {key}: {e}")
+                statuses[index] = {"key": key, "status": "error", "error": str(e)}
+                recorder.flush()
+                continue
+            uploads.append((index, key, recorder, pool.submit(write_output, key, output_data, recorder)))
+
+        for index, key, recorder, upload in uploads:
+            try:
+                output_key = upload.result()
+            except Exception as e:
+                print(f"❌ Failed to write output for {key}: {e}")
+                statuses[index] = {"key": key, "status": "error", "error": str(e)}
+                continue
+            finally:
+                recorder.flush()
+            statuses[index] = {"key": key, "status": "success", "output_key": output_key}
+
+    return statuses
+
+
+@startup.handler
+def lambda_handler(event, context):
+    print("🧠 Heavy Lambda Started")
+    print("📥 Event received:", json.dumps(event))
+
+    try:
+        return _handle(event)
+    finally:
+        if result_sink is not None:
+            result_sink.flush()
+
+
+def _handle(event):
+    if "tile" in event:
+        return process_tile(event["tile"])
+
+    bucket = event["bucket"]
+
+    if "keys" in event:
+        statuses = process_batch(bucket, event["keys"], event.get("io_workers"))
+        failed = sum(1 for s in statuses if s["status"] == "error")
+        if result_sink is not None:
+            result_sink.flush()
+        print(f"✅ Batch done: {len(statuses) - failed} succeeded, {failed} failed")
+        return {
+            "status": "success" if not failed else "partial_failure",
+            "processed": len(statuses) - failed,
+            "failed": failed,
+            "results": statuses,
+            "cache": result_cache.stats(),
+            "sink": result_sink.stats() if result_sink is not None else None
+        }
+
+    key = event["key"]
+    recorder = metrics.StageRecorder("heavy", key)
+    try:
+        input_data = load_input(bucket, key, recorder)
+
+        print("📄 Input data loaded:", json_stream.describe(input_data))
+
+        entry = process_input(key, input_data, recorder)
+    finally:
+        recorder.flush()
+    return entry
+
+
+if coldstart.COLD_START_MODE == "eager":
+    load_numpy()
+    backends.warm("s3")
 
-    print(f"✅ Output written to s3://{output_bucket}/{output_key}")
-    return {"status": "success"}
+startup.init_done()
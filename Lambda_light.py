@@ -1,12 +1,87 @@
 
 import string
-from typing import List
+from collections import deque
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+FILES = string.ascii_lowercase[:8]
+KNIGHT_DELTAS = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))
+
+# Squares are indexed a1=0, b1=1, ..., h8=63.
+SQUARES = tuple(f"{f}{r}" for r in range(1, 9) for f in FILES)
+SQUARE_INDEX = {square: i for i, square in enumerate(SQUARES)}
+
+
+def _build_knight_tables():
+    moves, bitboards = [], []
+    for i in range(64):
+        x, y = i % 8, i // 8
+        targets = [(y + dy) * 8 + x + dx for dx, dy in KNIGHT_DELTAS if 0 <= x + dx < 8 and 0 <= y + dy < 8]
+        moves.append(tuple(sorted(SQUARES[t] for t in targets)))
+        bitboards.append(sum(1 << t for t in targets))
+    return tuple(moves), tuple(bitboards)
+
+
+# KNIGHT_MOVES[i] is knight_moves(SQUARES[i]); bit t of KNIGHT_BITBOARDS[i]
+# is set when the knight on square i attacks square t.
+KNIGHT_MOVES, KNIGHT_BITBOARDS = _build_knight_tables()
+_knight_distances = None
+
+
+def _square_index(square: str) -> int:
+    index = SQUARE_INDEX.get(square[:2])
+    if index is None:
+        raise ValueError(f"Invalid square: {square}")
+    return index
+
 
 def knight_moves(square: str) -> List[str]:
     """
     Given a square in algebraic notation (e.g. 'e4'), return all valid knight moves
     from that square on an empty 8×8 board.
     """
+    return list(KNIGHT_MOVES[_square_index(square)])
+
+
+def knight_moves_batch(squares: List[str]) -> List[List[str]]:
+    """knight_moves() for every square in `squares`, validating each one."""
+    moves = KNIGHT_MOVES
+    return [list(moves[_square_index(square)]) for square in squares]
+
+
+def knight_distance_table() -> List[bytes]:
+    """
+    64×64 minimum knight-move counts, built once by a breadth-first search
+    from every square: knight_distance_table()[i][j] is the distance from
+    SQUARES[i] to SQUARES[j].
+    """
+    global _knight_distances
+    if _knight_distances is None:
+        neighbours = [[t for t in range(64) if bitboard >> t & 1] for bitboard in KNIGHT_BITBOARDS]
+        table = []
+        for source in range(64):
+            distance = bytearray([255]) * 64
+            distance[source] = 0
+            frontier = [source]
+            while frontier:
+                next_frontier = []
+                for square in frontier:
+                    for target in neighbours[square]:
+                        if distance[target] == 255:
+                            distance[target] = distance[square] + 1
+                            next_frontier.append(target)
+                frontier = next_frontier
+            table.append(bytes(distance))
+        _knight_distances = table
+    return _knight_distances
+
+
+def knight_distance(start: str, end: str) -> int:
+    """Minimum number of knight moves from `start` to `end`, in O(1) after the first call."""
+    return knight_distance_table()[_square_index(start)][_square_index(end)]
+
+
+def _knight_moves_reference(square: str) -> List[str]:
+    """The original per-call implementation, kept as the benchmark baseline."""
     files = {f: i for i, f in enumerate(string.ascii_lowercase[:8], start=1)}
     ranks = {str(i): i for i in range(1, 9)}
     file, rank = square[0], square[1]
@@ -14,24 +89,158 @@ def knight_moves(square: str) -> List[str]:
         raise ValueError(f"Invalid square: {square}")
 
     x, y = files[file], ranks[rank]
-    deltas = [(-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1)]
     moves = []
-
-    for dx, dy in deltas:
+    for dx, dy in KNIGHT_DELTAS:
         nx, ny = x + dx, y + dy
         if 1 <= nx <= 8 and 1 <= ny <= 8:
             file_char = list(files.keys())[list(files.values()).index(nx)]
-            rank_char = str(ny)
-            moves.append(f"{file_char}{rank_char}")
-
+            moves.append(f"{file_char}{ny}")
     return sorted(moves)
 
 
+def benchmark_knight_moves(calls: int = 200000) -> Dict[str, Any]:
+    """Calls per second of the reference, table and batch implementations."""
+    import time
+
+    squares = [SQUARES[i % 64] for i in range(calls)]
+    report = {}
+    for name, run in (
+        ("reference", lambda: [_knight_moves_reference(s) for s in squares]),
+        ("table", lambda: [knight_moves(s) for s in squares]),
+        ("batch", lambda: knight_moves_batch(squares)),
+        ("distance", lambda: [knight_distance(s, "h8") for s in squares]),
+    ):
+        start = time.perf_counter()
+        run()
+        report[name] = calls / (time.perf_counter() - start)
+    return {"calls": calls, "calls_per_s": report}
+
+
+ORBIT_RENDER_POINTS = 5000  # plotted points per star, whatever the step count
+
+
+def _lttb_indices(x, y, n_out):
+    """Largest-Triangle-Three-Buckets selection of n_out indices from a path."""
+    import numpy as np
+
+    n = len(x)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    previous = 0
+    for i in range(n_out - 2):
+        start, stop = edges[i], max(edges[i + 1], edges[i] + 1)
+        nxt_start, nxt_stop = stop, (edges[i + 2] if i + 2 < len(edges) else n)
+        nxt_stop = max(nxt_stop, nxt_start + 1)
+        avg_x, avg_y = x[nxt_start:nxt_stop].mean(), y[nxt_start:nxt_stop].mean()
+        bx, by = x[start:stop], y[start:stop]
+        area = np.abs((x[previous] - avg_x) * (by - y[previous]) - (x[previous] - bx) * (avg_y - y[previous]))
+        previous = start + int(area.argmax())
+        selected[i + 1] = previous
+    return selected
 
 
+def _minmax_indices(x, y, n_out):
+    """Per bucket, the points with the extreme x and y values, in path order."""
+    import numpy as np
+
+    n = len(x)
+    buckets = max(n_out // 4, 1)
+    size = -(-n // buckets)
+    padded = buckets * size
+    picks = [np.array([0, n - 1])]
+    for values in (x, y):
+        grid = np.empty(padded)
+        grid[:n] = values
+        grid[n:] = values[-1]
+        grid = grid.reshape(buckets, size)
+        base = np.arange(buckets) * size
+        picks.append(np.minimum(base + grid.argmin(axis=1), n - 1))
+        picks.append(np.minimum(base + grid.argmax(axis=1), n - 1))
+    return np.unique(np.concatenate(picks))
+
+
+def downsample_path(positions, max_points=ORBIT_RENDER_POINTS, method="lttb"):
+    """
+    Reduces an (N, 2) path to at most about `max_points` points while keeping
+    its shape: "lttb" (Largest-Triangle-Three-Buckets) keeps the visually
+    dominant points, "minmax" keeps each bucket's extreme x and y points.
+    Paths that are already short enough are returned unchanged.
+    """
+    import numpy as np
+
+    positions = np.asarray(positions)
+    if len(positions) <= max_points or max_points < 3:
+        return positions
+    x, y = positions[:, 0], positions[:, 1]
+    if method == "lttb":
+        indices = _lttb_indices(x, y, max_points)
+    elif method == "minmax":
+        indices = _minmax_indices(x, y, max_points)
+    else:
+        raise ValueError(f"Unsupported downsampling method: {method}")
+    return positions[indices]
+
+
+def _draw_orbit(ax, *paths):
+    for path in paths:
+        ax.plot(path[:, 0], path[:, 1], color='orange')
+    ax.plot(0, 0, 'k*', markersize=15, label="Black Hole")
+    ax.set_title("Quantum-Drunk Star Orbit Simulation")
+    ax.axis("equal")
+    ax.set_xlabel("X Position (m)")
+    ax.set_ylabel("Y Position (m)")
+    ax.legend()
+    ax.grid(True)
+
+
+def render_orbit(positions, path, max_points=ORBIT_RENDER_POINTS, method="lttb", dpi=100):
+    """
+    Renders orbit positions to an image file without a display.
+
+    `positions` is an (N, 2) path or an (N, n_stars, 2) ensemble, for example
+    the memory-mapped output of record_orbit. Each star's path is downsampled
+    to `max_points` first, so render time is bounded whatever N is. Draws
+    on a plain Agg canvas rather than through pyplot, so it neither needs
+    nor changes the interactive backend. Returns `path`.
+    """
+    import numpy as np
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    positions = np.asarray(positions)
+    stars = [positions] if positions.ndim == 2 else [positions[:, i] for i in range(positions.shape[1])]
+
+    fig = Figure(figsize=(8, 8))
+    FigureCanvasAgg(fig)
+    _draw_orbit(fig.add_subplot(), *(downsample_path(star, max_points, method) for star in stars))
+    fig.savefig(path, dpi=dpi)
+    return path
+
+
+def _drunken_star_positions(M_black_hole, initial_pos, initial_vel, drunk_noise, dt, steps):
+    """The one-star, step-by-step integration behind simulate_drunken_star_orbit."""
+    # Imported here so importing this module stays cheap for callers that
+    # only need knight_moves/traverse_tree.
+    import numpy as np
+
+    G = 6.67430e-11
+    pos = np.array(initial_pos, dtype=float)
+    vel = np.array(initial_vel, dtype=float)
+    positions = []
+
+    for _ in range(steps):
+        r = np.linalg.norm(pos)
+        direction = pos / r
+        F = -G * M_black_hole / r**2
+        noise = 1 + np.random.normal(0, drunk_noise)
+        acceleration = F * direction * noise
+        vel += acceleration * dt
+        pos += vel * dt
+        positions.append(pos.copy())
+
+    return np.array(positions)
 
-import numpy as np
-import matplotlib.pyplot as plt
 
 def simulate_drunken_star_orbit(
     M_black_hole=8e30,
@@ -39,10 +248,14 @@ def simulate_drunken_star_orbit(
     initial_vel=(0, 29780),
     drunk_noise=0.0001,
     dt=60,
-    steps=5000
+    steps=5000,
+    output_path=None,
+    max_points=ORBIT_RENDER_POINTS
 ):
     """
     Simulates the orbit of a star around a black hole with quantum drunk noise.
+    Shows the plot interactively, or renders it headless to `output_path`
+    (and returns that path) when one is given.
 
     Parameters:
     - M_black_hole: Mass of black hole (kg)
@@ -51,42 +264,366 @@ def simulate_drunken_star_orbit(
     - drunk_noise: Standard deviation of Gaussian noise multiplier
     - dt: Time step in seconds
     - steps: Number of simulation steps
+    - output_path: image file to render to instead of calling plt.show()
+    - max_points: points plotted after downsample_path()
     """
-    G = 6.67430e-11
-    pos = np.array(initial_pos, dtype=float)
-    vel = np.array(initial_vel, dtype=float)
-    positions = []
+    positions = _drunken_star_positions(M_black_hole, initial_pos, initial_vel, drunk_noise, dt, steps)
+    if output_path is not None:
+        return render_orbit(positions, output_path, max_points=max_points)
 
-    for _ in range(steps):
-        r = np.linalg.norm(pos)
-        direction = pos / r
-        F = -G * M_black_hole / r**2
-        noise = 1 + np.random.normal(0, drunk_noise)
-        acceleration = F * direction * noise
-        vel += acceleration * dt
-        pos += vel * dt
-        positions.append(pos.copy())
+    import matplotlib.pyplot as plt
 
-    positions = np.array(positions)
-    plt.figure(figsize=(8, 8))
-    plt.plot(positions[:, 0], positions[:, 1], color='orange')
-    plt.plot(0, 0, 'k*', markersize=15, label="Black Hole")
-    plt.title("Quantum-Drunk Star Orbit Simulation")
-    plt.axis("equal")
-    plt.xlabel("X Position (m)")
-    plt.ylabel("Y Position (m)")
-    plt.legend()
-    plt.grid(True)
+    fig = plt.figure(figsize=(8, 8))
+    _draw_orbit(fig.gca(), downsample_path(positions, max_points))
     plt.show()
 
-simulate_drunken_star_orbit()
+
+ORBIT_NOISE_BLOCK = 1024  # steps of noise drawn per Generator call
+
+
+def _orbit_acceleration(pos, gm, noise, out, r, scratch):
+    """Writes -GM * pos / |pos|^3 * noise into `out` for every star, without allocating."""
+    import numpy as np
+
+    np.hypot(pos[:, 0], pos[:, 1], out=r)
+    np.power(r, 3, out=scratch)
+    np.divide(noise, scratch, out=scratch)
+    scratch *= -gm
+    np.multiply(pos, scratch[:, None], out=out)
 
 
-def traverse_tree(node: Dict[str, Any], visit_fn) -> None:
+class _OrbitEnsemble:
     """
-    Recursively traverse a nested tree represented as dicts with 'children' lists.
-    Calls `visit_fn(node)` for each node.
+    Integrator state for a drunken-star ensemble: positions, velocities,
+    the numpy Generator and running radius statistics. advance() can be
+    called repeatedly, and state()/from_state() round-trip everything needed
+    to resume a run bit-for-bit.
     """
-    visit_fn(node)
-    for child in node.get("children", []):
-        traverse_tree(child, visit_fn)
+
+    def __init__(self, pos, vel, gm, dt, drunk_noise, integrator, rng):
+        import numpy as np
+
+        if integrator not in ("euler", "leapfrog"):
+            raise ValueError(f"Unsupported integrator: {integrator}")
+        self.pos, self.vel = pos, vel
+        self.gm, self.dt, self.drunk_noise = gm, dt, drunk_noise
+        self.integrator = integrator
+        self.rng = rng
+        self.step = 0
+        n_stars = len(pos)
+        self.acc = np.empty_like(pos)
+        self._r = np.empty(n_stars)
+        self._scratch = np.empty(n_stars)
+        self.r_min = np.full(n_stars, np.inf)
+        self.r_max = np.zeros(n_stars)
+        self.r_sum = np.zeros(n_stars)
+        self.energy_start = self.energy()
+        if integrator == "leapfrog":
+            _orbit_acceleration(pos, gm, rng.normal(1.0, drunk_noise, n_stars), self.acc, self._r, self._scratch)
+
+    def energy(self):
+        import numpy as np
+
+        return 0.5 * np.einsum("ij,ij->i", self.vel, self.vel) - self.gm / np.hypot(self.pos[:, 0], self.pos[:, 1])
+
+    def advance(self, steps, out=None, decimate=1):
+        """
+        Runs `steps` more steps. Every `decimate`-th position (counting from
+        step 0 of the whole run) is written to consecutive rows of `out`.
+        """
+        import numpy as np
+
+        pos, vel, acc, r, dt = self.pos, self.vel, self.acc, self._r, self.dt
+        row = 0
+        for block_start in range(0, steps, ORBIT_NOISE_BLOCK):
+            noise = self.rng.normal(1.0, self.drunk_noise, (min(ORBIT_NOISE_BLOCK, steps - block_start), len(pos)))
+            for step_noise in noise:
+                if self.integrator == "euler":
+                    _orbit_acceleration(pos, self.gm, step_noise, acc, r, self._scratch)
+                    acc *= dt
+                    vel += acc
+                    acc[:] = vel
+                    acc *= dt
+                    pos += acc
+                else:
+                    vel += 0.5 * dt * acc
+                    pos += dt * vel
+                    _orbit_acceleration(pos, self.gm, step_noise, acc, r, self._scratch)
+                    vel += 0.5 * dt * acc
+                np.hypot(pos[:, 0], pos[:, 1], out=r)
+                np.minimum(self.r_min, r, out=self.r_min)
+                np.maximum(self.r_max, r, out=self.r_max)
+                self.r_sum += r
+                if out is not None and self.step % decimate == 0:
+                    out[row] = pos
+                    row += 1
+                self.step += 1
+        return row
+
+    def summary(self):
+        import numpy as np
+
+        return {
+            "final_pos": self.pos,
+            "final_vel": self.vel,
+            "r_min": self.r_min,
+            "r_max": self.r_max,
+            "r_mean": self.r_sum / max(self.step, 1),
+            "energy_drift": (self.energy() - self.energy_start) / np.abs(self.energy_start),
+        }
+
+    def state(self):
+        """Arrays and scalars to np.savez for a checkpoint."""
+        import json
+
+        return {
+            "pos": self.pos, "vel": self.vel, "acc": self.acc,
+            "r_min": self.r_min, "r_max": self.r_max, "r_sum": self.r_sum,
+            "energy_start": self.energy_start, "step": self.step,
+            "rng_state": json.dumps(self.rng.bit_generator.state),
+        }
+
+    @classmethod
+    def from_state(cls, state, gm, dt, drunk_noise, integrator):
+        import json
+        import numpy as np
+
+        rng = np.random.default_rng()
+        rng.bit_generator.state = json.loads(str(state["rng_state"]))
+        self = cls.__new__(cls)
+        self.gm, self.dt, self.drunk_noise = gm, dt, drunk_noise
+        self.integrator = integrator
+        self.rng = rng
+        for name in ("pos", "vel", "acc", "r_min", "r_max", "r_sum", "energy_start"):
+            setattr(self, name, np.array(state[name]))
+        self.step = int(state["step"])
+        self._r = np.empty(len(self.pos))
+        self._scratch = np.empty(len(self.pos))
+        return self
+
+
+def _start_ensemble(n_stars, M_black_hole, initial_pos, initial_vel, drunk_noise, dt, seed, integrator):
+    import numpy as np
+
+    G = 6.67430e-11
+    pos = np.array(np.broadcast_to(np.asarray(initial_pos, dtype=float), (n_stars, 2)))
+    vel = np.array(np.broadcast_to(np.asarray(initial_vel, dtype=float), (n_stars, 2)))
+    return _OrbitEnsemble(pos, vel, G * M_black_hole, dt, drunk_noise, integrator, np.random.default_rng(seed))
+
+
+def simulate_orbit_ensemble(
+    n_stars=1000,
+    M_black_hole=8e30,
+    initial_pos=(1.5e11, 0),
+    initial_vel=(0, 29780),
+    drunk_noise=0.0001,
+    dt=60,
+    steps=5000,
+    seed=None,
+    integrator="euler",
+    return_trajectories=False
+):
+    """
+    Advances `n_stars` independent drunken-star orbits together, without plotting.
+
+    Parameters are those of simulate_drunken_star_orbit, plus:
+    - n_stars: ensemble size; initial_pos/initial_vel may be (x, y) pairs
+      shared by every star or (n_stars, 2) arrays
+    - seed: seed for the numpy Generator; noise is drawn ORBIT_NOISE_BLOCK
+      steps at a time, so a seed reproduces the ensemble exactly
+    - integrator: "euler" is the semi-implicit update of
+      simulate_drunken_star_orbit; "leapfrog" (kick-drift-kick) is
+      second-order symplectic and keeps energy bounded over long runs
+    - return_trajectories: also return every position as a preallocated
+      (steps, n_stars, 2) array
+
+    Returns a dict of per-star arrays: final_pos, final_vel, r_min, r_max,
+    r_mean and energy_drift (relative change in specific orbital energy).
+    """
+    import numpy as np
+
+    ensemble = _start_ensemble(n_stars, M_black_hole, initial_pos, initial_vel, drunk_noise, dt, seed, integrator)
+    trajectories = np.empty((steps, n_stars, 2)) if return_trajectories else None
+    ensemble.advance(steps, out=trajectories)
+    result = ensemble.summary()
+    if trajectories is not None:
+        result["trajectories"] = trajectories
+    return result
+
+
+def record_orbit(
+    path,
+    steps,
+    n_stars=1,
+    M_black_hole=8e30,
+    initial_pos=(1.5e11, 0),
+    initial_vel=(0, 29780),
+    drunk_noise=0.0001,
+    dt=60,
+    seed=None,
+    integrator="euler",
+    decimate=1,
+    chunk_steps=65536,
+    resume=True
+):
+    """
+    Runs an orbit ensemble out of core, streaming positions to disk.
+
+    Every `decimate`-th position goes into `path`, a memory-mapped .npy of
+    shape (ceil(steps / decimate), n_stars, 2) that np.load(path,
+    mmap_mode="r") can read back lazily. After each `chunk_steps` steps the
+    file is flushed and the integrator state (positions, velocities,
+    running statistics and Generator state) is written atomically to
+    `path + ".ckpt.npz"`. With `resume`, a run that finds a checkpoint
+    continues from it; since the noise stream is restored too, the result
+    is identical to an uninterrupted run. Resuming with arguments that
+    differ from the checkpointed run's raises ValueError. The checkpoint is
+    removed once the run completes.
+
+    Returns the same summary dict as simulate_orbit_ensemble.
+    """
+    import json
+    import os
+    import numpy as np
+
+    if decimate < 1 or chunk_steps < 1:
+        raise ValueError("decimate and chunk_steps must be positive")
+    checkpoint = path + ".ckpt.npz"
+    rows = -(-steps // decimate)
+    # Everything that shapes the trajectory; a checkpoint only resumes the run it was written by.
+    run = {
+        "steps": steps, "n_stars": n_stars, "M_black_hole": M_black_hole,
+        "initial_pos": np.asarray(initial_pos, dtype=float).tolist(),
+        "initial_vel": np.asarray(initial_vel, dtype=float).tolist(),
+        "drunk_noise": drunk_noise, "dt": dt, "seed": seed, "integrator": integrator, "decimate": decimate,
+    }
+    run = json.loads(json.dumps(run))
+
+    if resume and os.path.exists(checkpoint) and os.path.exists(path):
+        with np.load(checkpoint) as state:
+            stored = json.loads(str(state["run"])) if "run" in state else {}
+            changed = sorted(name for name in run if stored.get(name) != run[name])
+            if changed:
+                raise ValueError(f"Checkpoint {checkpoint} belongs to a run with different {', '.join(changed)}")
+            ensemble = _OrbitEnsemble.from_state(state, 6.67430e-11 * M_black_hole, dt, drunk_noise, integrator)
+        out = np.lib.format.open_memmap(path, mode="r+")
+        if out.shape != (rows, len(ensemble.pos), 2):
+            raise ValueError(f"{path} has shape {out.shape}, expected {(rows, len(ensemble.pos), 2)}")
+    else:
+        ensemble = _start_ensemble(n_stars, M_black_hole, initial_pos, initial_vel, drunk_noise, dt, seed, integrator)
+        out = np.lib.format.open_memmap(path, mode="w+", dtype=np.float64, shape=(rows, n_stars, 2))
+
+    while ensemble.step < steps:
+        row = -(-ensemble.step // decimate)
+        ensemble.advance(min(chunk_steps, steps - ensemble.step), out=out[row:], decimate=decimate)
+        out.flush()
+        tmp = checkpoint + ".tmp.npz"
+        np.savez(tmp, run=json.dumps(run), **ensemble.state())
+        os.replace(tmp, checkpoint)
+
+    del out
+    if os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    return ensemble.summary()
+
+
+def benchmark_orbit_ensemble(n_stars=1000, steps=2000, seed=0, reference_stars=10):
+    """
+    Star-steps per second of the ensemble engine, for one star and for
+    `n_stars`, against the original per-star loop of
+    simulate_drunken_star_orbit. That loop costs the same per star, so it
+    is timed over `reference_stars` stars only. "speedup" compares the
+    full ensemble with it.
+    """
+    import time
+
+    report = {}
+    for n in (1, n_stars):
+        start = time.perf_counter()
+        simulate_orbit_ensemble(n_stars=n, steps=steps, seed=seed)
+        elapsed = time.perf_counter() - start
+        report[f"stars_{n}"] = {"seconds": elapsed, "star_steps_per_s": n * steps / elapsed}
+
+    start = time.perf_counter()
+    for _ in range(reference_stars):
+        _drunken_star_positions(8e30, (1.5e11, 0), (0, 29780), 0.0001, 60, steps)
+    elapsed = time.perf_counter() - start
+    report["per_star_loop"] = {"stars": reference_stars, "seconds": elapsed,
+                               "star_steps_per_s": reference_stars * steps / elapsed}
+    report["speedup"] = report[f"stars_{n_stars}"]["star_steps_per_s"] / report["per_star_loop"]["star_steps_per_s"]
+    return report
+
+
+# Return these from a traverse_tree visitor to skip the node's children or
+# to end the traversal. Unique objects, so no value a visitor happens to
+# return (e.g. a node's name) can be mistaken for one.
+PRUNE = object()
+STOP = object()
+
+
+def iter_tree(
+    node: Dict[str, Any],
+    order: str = "dfs",
+    prune: Optional[Callable[[Dict[str, Any], int], bool]] = None,
+    max_depth: Optional[int] = None,
+    with_path: bool = False
+) -> Iterator[Any]:
+    """
+    Lazily yields the nodes of a nested tree of dicts with 'children' lists,
+    using an explicit deque instead of recursion, so depth is only limited
+    by memory.
+
+    Parameters:
+    - order: "dfs" (pre-order, the order traverse_tree has always used) or "bfs"
+    - prune: called as prune(node, depth) after a node is yielded; a true
+      result skips its children
+    - max_depth: don't descend below this depth (the root is depth 0)
+    - with_path: yield (node, depth, path) tuples, where path holds the
+      child indices leading from the root to the node
+    Stop early by breaking out of the loop; nothing past the current
+    frontier has been touched.
+    """
+    if order not in ("dfs", "bfs"):
+        raise ValueError(f"Unsupported order: {order}")
+    pending = deque([(node, 0, ())])
+    take = pending.pop if order == "dfs" else pending.popleft
+
+    while pending:
+        current, depth, path = take()
+        yield (current, depth, path) if with_path else current
+        if prune is not None and prune(current, depth):
+            continue
+        if max_depth is not None and depth >= max_depth:
+            continue
+        children = current.get("children") or ()
+        indexed = enumerate(children)
+        if order == "dfs":
+            indexed = reversed(list(indexed))
+        for i, child in indexed:
+            pending.append((child, depth + 1, path + (i,) if with_path else ()))
+
+
+def traverse_tree(node: Dict[str, Any], visit_fn, order: str = "dfs") -> None:
+    """
+    Traverse a nested tree represented as dicts with 'children' lists.
+    Calls `visit_fn(node)` for each node, depth-first unless `order` is "bfs".
+    If visit_fn returns PRUNE the node's children are skipped; if it returns
+    STOP the traversal ends. Iterative, so deep trees don't hit the
+    recursion limit.
+    """
+    pruned = [False]
+
+    def prune(current, depth):
+        # Called for the node visit_fn just saw, before its children are queued.
+        result, pruned[0] = pruned[0], False
+        return result
+
+    for current in iter_tree(node, order, prune=prune):
+        signal = visit_fn(current)
+        if signal is STOP:
+            return
+        pruned[0] = signal is PRUNE
+
+
+if __name__ == "__main__":
+    simulate_drunken_star_orbit()
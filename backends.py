@@ -0,0 +1,456 @@
+import abc
+import io
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# "aws" talks to real AWS through boto3. "memory" keeps everything in this
+# process; "filesystem" stores objects under LOCAL_S3_ROOT so separate
+# processes can share them.
+BACKEND = os.environ.get("PIPELINE_BACKEND", "aws")
+LOCAL_S3_ROOT = os.environ.get("LOCAL_S3_ROOT", ".local_s3")
+LOCAL_LAMBDA_WORKERS = int(os.environ.get("LOCAL_LAMBDA_WORKERS", "8"))
+
+_lock = threading.Lock()
+_clients = {}
+_functions = {}
+
+
+class LocalClientError(Exception):
+    """Mirrors the shape of botocore's ClientError closely enough for callers."""
+
+    code = "InternalError"
+
+    def __init__(self, message, operation=None):
+        super().__init__(message)
+        self.response = {"Error": {"Code": self.code, "Message": message}}
+        self.operation_name = operation
+
+
+class NoSuchKey(LocalClientError):
+    code = "NoSuchKey"
+
+
+class NoSuchUpload(LocalClientError):
+    code = "NoSuchUpload"
+
+
+class ResourceNotFoundException(LocalClientError):
+    code = "ResourceNotFoundException"
+
+
+class PreconditionFailed(LocalClientError):
+    code = "PreconditionFailed"
+
+
+class _Exceptions:
+    """Lets `client.exceptions.NoSuchKey` work the same against local backends."""
+
+    ClientError = LocalClientError
+    NoSuchKey = NoSuchKey
+    NoSuchUpload = NoSuchUpload
+    ResourceNotFoundException = ResourceNotFoundException
+
+
+class StreamingBody:
+    """
+    Minimal stand-in for botocore's StreamingBody: read(amt), iter_chunks()
+    and close() over a file-like object limited to `length` bytes.
+    """
+
+    def __init__(self, raw, length):
+        self._raw = raw
+        self._remaining = length
+
+    def read(self, amt=None):
+        if amt is None or amt > self._remaining:
+            amt = self._remaining
+        data = self._raw.read(amt)
+        self._remaining -= len(data)
+        return data
+
+    def iter_chunks(self, chunk_size=1024 * 1024):
+        while True:
+            chunk = self.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+    def close(self):
+        self._raw.close()
+
+
+def _parse_range(range_header, size):
+    """Parses a single `bytes=start-end` range into (start, stop) offsets."""
+    unit, _, spec = range_header.partition("=")
+    start, _, end = spec.partition("-")
+    if unit != "bytes" or "," in spec:
+        raise LocalClientError(f"Unsupported Range: {range_header}")
+    if not start:
+        start, stop = max(0, size - int(end)), size
+    else:
+        start = int(start)
+        stop = size if not end else min(size, int(end) + 1)
+    return start, stop
+
+
+def _chunks(body, chunk_size=1024 * 1024):
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+    if isinstance(body, (bytes, bytearray, memoryview)):
+        yield bytes(body)
+        return
+    while True:
+        chunk = body.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+
+class LocalS3(abc.ABC):
+    """
+    The subset of the S3 client API the pipeline uses: get/put/head/delete/
+    copy/list plus multipart uploads. Subclasses decide where bytes live.
+    """
+
+    exceptions = _Exceptions
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._create_lock = threading.Lock()
+        self._content_types = {}
+        self._uploads = {}
+
+    # Storage primitives
+    @abc.abstractmethod
+    def _open(self, bucket, key):
+        """Returns (readable binary file, size); raises NoSuchKey if absent."""
+
+    @abc.abstractmethod
+    def _store(self, bucket, key, chunks):
+        """Writes the byte chunks as the object's whole content, replacing it."""
+
+    @abc.abstractmethod
+    def _remove(self, bucket, key):
+        """Deletes the object; a missing object is not an error."""
+
+    @abc.abstractmethod
+    def _scan(self, bucket, prefix):
+        """Iterates (key, size) for the bucket's objects whose key starts with prefix."""
+
+    # Client API
+    def get_object(self, Bucket, Key, Range=None, **kwargs):
+        raw, size = self._open(Bucket, Key)
+        start, stop = 0, size
+        if Range:
+            start, stop = _parse_range(Range, size)
+            raw.seek(start)
+        response = {
+            "Body": StreamingBody(raw, stop - start),
+            "ContentLength": stop - start,
+            "ContentType": self._content_types.get((Bucket, Key), "binary/octet-stream"),
+        }
+        if Range:
+            response["ContentRange"] = f"bytes {start}-{stop - 1}/{size}"
+        return response
+
+    def head_object(self, Bucket, Key, **kwargs):
+        raw, size = self._open(Bucket, Key)
+        raw.close()
+        return {
+            "ContentLength": size,
+            "ContentType": self._content_types.get((Bucket, Key), "binary/octet-stream"),
+        }
+
+    def put_object(self, Bucket, Key, Body=b"", ContentType=None, IfNoneMatch=None, **kwargs):
+        if IfNoneMatch == "*":
+            # Conditional create: only one of several racing writers wins.
+            with self._create_lock:
+                try:
+                    self._open(Bucket, Key)[0].close()
+                except NoSuchKey:
+                    self._store(Bucket, Key, _chunks(Body))
+                else:
+                    raise PreconditionFailed(f"s3://{Bucket}/{Key} already exists", "PutObject")
+        else:
+            self._store(Bucket, Key, _chunks(Body))
+        with self._lock:
+            self._content_types[(Bucket, Key)] = ContentType or "binary/octet-stream"
+        return {"ETag": uuid.uuid4().hex}
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        self._remove(Bucket, Key)
+        with self._lock:
+            self._content_types.pop((Bucket, Key), None)
+        return {}
+
+    def copy_object(self, Bucket, Key, CopySource, **kwargs):
+        raw, _ = self._open(CopySource["Bucket"], CopySource["Key"])
+        with raw:
+            self._store(Bucket, Key, _chunks(raw))
+        with self._lock:
+            self._content_types[(Bucket, Key)] = self._content_types.get(
+                (CopySource["Bucket"], CopySource["Key"]), "binary/octet-stream"
+            )
+        return {"CopyObjectResult": {"ETag": uuid.uuid4().hex}}
+
+    def list_objects_v2(self, Bucket, Prefix="", **kwargs):
+        contents = [{"Key": key, "Size": size} for key, size in sorted(self._scan(Bucket, Prefix))]
+        return {"Contents": contents, "KeyCount": len(contents), "IsTruncated": False}
+
+    def create_multipart_upload(self, Bucket, Key, ContentType=None, **kwargs):
+        upload_id = uuid.uuid4().hex
+        with self._lock:
+            self._uploads[upload_id] = (Bucket, Key, ContentType)
+        return {"Bucket": Bucket, "Key": Key, "UploadId": upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body, **kwargs):
+        if UploadId not in self._uploads:
+            raise NoSuchUpload(f"No such upload: {UploadId}", "UploadPart")
+        self._store(".multipart", f"{UploadId}/{PartNumber}", _chunks(Body))
+        return {"ETag": f"{UploadId}-{PartNumber}"}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload, **kwargs):
+        with self._lock:
+            upload = self._uploads.pop(UploadId, None)
+        if upload is None:
+            raise NoSuchUpload(f"No such upload: {UploadId}", "CompleteMultipartUpload")
+
+        part_numbers = [part["PartNumber"] for part in MultipartUpload["Parts"]]
+
+        def parts():
+            for number in part_numbers:
+                raw, _ = self._open(".multipart", f"{UploadId}/{number}")
+                with raw:
+                    yield from _chunks(raw)
+
+        self._store(Bucket, Key, parts())
+        for number in part_numbers:
+            self._remove(".multipart", f"{UploadId}/{number}")
+        with self._lock:
+            self._content_types[(Bucket, Key)] = upload[2] or "binary/octet-stream"
+        return {"Bucket": Bucket, "Key": Key}
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId, **kwargs):
+        with self._lock:
+            self._uploads.pop(UploadId, None)
+        for key, _ in list(self._scan(".multipart", f"{UploadId}/")):
+            self._remove(".multipart", key)
+        return {}
+
+
+class MemoryS3(LocalS3):
+    """Objects live in a dict for the lifetime of the process."""
+
+    def __init__(self):
+        super().__init__()
+        self._objects = {}
+
+    def _open(self, bucket, key):
+        try:
+            data = self._objects[(bucket, key)]
+        except KeyError:
+            raise NoSuchKey(f"s3://{bucket}/{key} does not exist", "GetObject") from None
+        return io.BytesIO(data), len(data)
+
+    def _store(self, bucket, key, chunks):
+        data = b"".join(chunks)
+        with self._lock:
+            self._objects[(bucket, key)] = data
+
+    def _remove(self, bucket, key):
+        with self._lock:
+            self._objects.pop((bucket, key), None)
+
+    def _scan(self, bucket, prefix):
+        with self._lock:
+            items = list(self._objects.items())
+        return [(k, len(v)) for (b, k), v in items if b == bucket and k.startswith(prefix)]
+
+
+class FilesystemS3(LocalS3):
+    """Objects are files under `root/<bucket>/<key>`; writes are atomic renames."""
+
+    def __init__(self, root=None):
+        super().__init__()
+        self.root = os.path.abspath(root or LOCAL_S3_ROOT)
+
+    def _path(self, bucket, key):
+        path = os.path.abspath(os.path.join(self.root, bucket, key))
+        if not path.startswith(os.path.join(self.root, bucket) + os.sep):
+            raise LocalClientError(f"Key escapes bucket: {key}")
+        return path
+
+    def _open(self, bucket, key):
+        path = self._path(bucket, key)
+        try:
+            return open(path, "rb"), os.path.getsize(path)
+        except FileNotFoundError:
+            raise NoSuchKey(f"s3://{bucket}/{key} does not exist", "GetObject") from None
+
+    def _store(self, bucket, key, chunks):
+        path = self._path(bucket, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp, "wb") as f:
+            for chunk in chunks:
+                f.write(chunk)
+        os.replace(tmp, path)
+
+    def _remove(self, bucket, key):
+        try:
+            os.remove(self._path(bucket, key))
+        except FileNotFoundError:
+            pass
+
+    def _scan(self, bucket, prefix):
+        base = os.path.join(self.root, bucket)
+        for directory, _, files in os.walk(base):
+            for name in files:
+                if name.endswith(".tmp"):
+                    continue
+                path = os.path.join(directory, name)
+                key = os.path.relpath(path, base).replace(os.sep, "/")
+                if key.startswith(prefix):
+                    yield key, os.path.getsize(path)
+
+    def clear(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+
+class LocalContext:
+    """The parts of the Lambda context object handlers may touch."""
+
+    def __init__(self, function_name, timeout_s=900):
+        self.function_name = function_name
+        self.aws_request_id = str(uuid.uuid4())
+        self._deadline = time.time() + timeout_s
+
+    def get_remaining_time_in_millis(self):
+        return max(0, int((self._deadline - time.time()) * 1000))
+
+
+class LocalLambda:
+    """
+    In-process Lambda invoker. Handlers registered with register_function()
+    run synchronously for RequestResponse and on a thread pool for Event.
+    """
+
+    exceptions = _Exceptions
+
+    def __init__(self, workers=None):
+        self._pool = ThreadPoolExecutor(max_workers=workers or LOCAL_LAMBDA_WORKERS)
+        self._pending = []
+        self._pending_lock = threading.Lock()
+        self.errors = []
+
+    def _run(self, name, payload):
+        handler = _functions[name]
+        try:
+            return handler(payload, LocalContext(name))
+        except Exception as e:
+            print(f"❌ Local invocation of {name} failed: {e}")
+            self.errors.append((name, e))
+            raise
+
+    def invoke(self, FunctionName, InvocationType="RequestResponse", Payload=b"{}", **kwargs):
+        if FunctionName not in _functions:
+            raise ResourceNotFoundException(f"Function not found: {FunctionName}", "Invoke")
+        payload = json.loads(Payload or "{}")
+
+        if InvocationType == "Event":
+            future = self._pool.submit(self._run, FunctionName, payload)
+            with self._pending_lock:
+                self._pending.append(future)
+            return {"StatusCode": 202, "Payload": StreamingBody(io.BytesIO(b""), 0)}
+
+        response = {"StatusCode": 200}
+        try:
+            result = self._run(FunctionName, payload)
+        except Exception as e:
+            response["FunctionError"] = "Unhandled"
+            result = {"errorMessage": str(e), "errorType": type(e).__name__}
+        body = json.dumps(result).encode("utf-8")
+        response["Payload"] = StreamingBody(io.BytesIO(body), len(body))
+        return response
+
+    def wait(self, timeout=None):
+        """Blocks until every async invocation (including ones they start) is done."""
+        while True:
+            with self._pending_lock:
+                pending, self._pending = self._pending, []
+            if not pending:
+                return
+            for future in pending:
+                try:
+                    future.result(timeout=timeout)
+                except Exception:
+                    pass
+
+
+def register_function(name, handler):
+    """Makes `handler(event, context)` invocable as `name` on the local backend."""
+    _functions[name] = handler
+
+
+def configure(backend, root=None):
+    """
+    Switches the backend every client() proxy resolves to: "aws", "memory"
+    or "filesystem" (stored under `root`, default LOCAL_S3_ROOT).
+    """
+    global BACKEND, LOCAL_S3_ROOT
+    if backend not in ("aws", "memory", "filesystem"):
+        raise ValueError(f"Unknown backend: {backend}")
+    with _lock:
+        BACKEND = backend
+        if root is not None:
+            LOCAL_S3_ROOT = root
+        _clients.clear()
+
+
+def is_local():
+    return BACKEND != "aws"
+
+
+def _resolve(service):
+    with _lock:
+        key = (BACKEND, service)
+        if key not in _clients:
+            if BACKEND == "aws":
+                import boto3
+                _clients[key] = boto3.client(service)
+            elif service == "s3":
+                _clients[key] = MemoryS3() if BACKEND == "memory" else FilesystemS3(LOCAL_S3_ROOT)
+            elif service == "lambda":
+                _clients[key] = LocalLambda()
+            else:
+                raise ValueError(f"No local stand-in for service: {service}")
+        return _clients[key]
+
+
+def warm(*services):
+    """Creates the clients for `services` now instead of on first use."""
+    for service in services:
+        _resolve(service)
+
+
+class _ClientProxy:
+    """Resolves the real client on first use, and again after configure()."""
+
+    def __init__(self, service):
+        self._service = service
+
+    def __getattr__(self, name):
+        return getattr(_resolve(self._service), name)
+
+
+def client(service):
+    """
+    Drop-in for `boto3.client(service)` at module level. The returned proxy
+    creates the underlying client lazily, honoring PIPELINE_BACKEND/configure().
+    """
+    return _ClientProxy(service)
@@ -0,0 +1,159 @@
+import functools
+import importlib
+import json
+import os
+import sys
+import time
+
+# "lazy" defers heavy imports and client creation to the first invocation
+# that needs them; "eager" does them during init (useful with provisioned
+# concurrency, where init time is paid ahead of traffic).
+COLD_START_MODE = os.environ.get("COLD_START_MODE", "lazy")
+
+import_times_ms = {}
+
+
+def lazy_import(name):
+    """
+    Imports `name` on first use and records how long the import took.
+    Goes through importlib even when the module is already in sys.modules:
+    importlib holds that module's own lock while it initializes, so a
+    caller racing a first import waits for it to finish. No lock of ours
+    is held around the import, so the module may lazy_import others while
+    it loads.
+    """
+    first = name not in sys.modules
+    start = time.perf_counter()
+    module = importlib.import_module(name)
+    if first:
+        import_times_ms.setdefault(name, (time.perf_counter() - start) * 1000)
+    return module
+
+
+class Startup:
+    """
+    Separates a handler module's init time from its handler time.
+
+    Create one at the top of the module, call init_done() at the bottom and
+    decorate the handler with handler(). Every invocation logs one JSON line
+    with the init duration, any lazy imports that happened during the call
+    and the handler duration; the first invocation is flagged as cold.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.init_started = time.perf_counter()
+        self.init_ms = None
+        self.invocations = 0
+        self.last = None
+
+    def init_done(self):
+        self.init_ms = (time.perf_counter() - self.init_started) * 1000
+
+    def handler(self, fn):
+        @functools.wraps(fn)
+        def wrapper(event, context):
+            cold = self.invocations == 0
+            self.invocations += 1
+            imports_before = dict(import_times_ms)
+            start = time.perf_counter()
+            try:
+                return fn(event, context)
+            finally:
+                lazy = {k: v for k, v in import_times_ms.items() if k not in imports_before}
+                self.last = {
+                    "function": self.name,
+                    "cold_start": cold,
+                    "mode": COLD_START_MODE,
+                    "init_ms": self.init_ms if cold else 0.0,
+                    "lazy_import_ms": lazy,
+                    "handler_ms": (time.perf_counter() - start) * 1000,
+                }
+                print(json.dumps({"startup": self.last}))
+        return wrapper
+
+
+_BENCH_SCRIPT = """
+import json, sys, time
+import backends
+backends.configure("memory")
+setup = {setup!r}
+exec(setup)
+started = time.perf_counter()
+import {module} as target
+imported = time.perf_counter()
+records = []
+for _ in range({invocations}):
+    target.lambda_handler(event, None)
+    records.append(dict(target.startup.last))
+print("BENCH" + json.dumps({{"import_ms": (imported - started) * 1000, "records": records}}))
+"""
+
+_BENCH_CASES = {
+    "Lambda_heavy": '''
+import os
+os.environ["RESULT_CACHE"] = "off"
+s3 = backends.client("s3")
+s3.put_object(Bucket="bench", Key="scenario_inputs/bench.json",
+              Body=json.dumps({"parameters": {"matrix_size": 200, "seed": 1}}))
+event = {"bucket": "bench", "key": "scenario_inputs/bench.json"}
+''',
+    "l7": '''
+import os
+os.environ["RESULT_CACHE"] = "off"
+os.environ["HEAVY_FUNCTION_NAME"] = "bench-heavy"
+backends.register_function("bench-heavy", lambda event, context: None)
+s3 = backends.client("s3")
+s3.put_object(Bucket="bench", Key="scenario_inputs/bench.json",
+              Body=json.dumps({"parameters": {"matrix_size": 200, "seed": 1}}))
+event = {"Records": [{"s3": {"bucket": {"name": "bench"}, "object": {"key": "scenario_inputs/bench.json"}}}]}
+''',
+}
+
+
+def _median(values):
+    ordered = sorted(values)
+    mid = len(ordered) // 2
+    return ordered[mid] if len(ordered) % 2 else (ordered[mid - 1] + ordered[mid]) / 2
+
+
+def benchmark(module, runs=5, invocations=5, mode="lazy"):
+    """
+    Measures cold vs warm starts of `module` ("Lambda_heavy" or "l7") on the
+    in-memory backend. Each run is a fresh interpreter that imports the
+    module and invokes its handler `invocations` times; the first invocation
+    is the cold one. Returns median timings in milliseconds.
+    """
+    import subprocess
+
+    script = _BENCH_SCRIPT.format(setup=_BENCH_CASES[module], module=module, invocations=invocations)
+    env = dict(os.environ, COLD_START_MODE=mode)
+    cold_import, cold_init, cold_handler, warm_handler = [], [], [], []
+    for _ in range(runs):
+        out = subprocess.run(
+            [sys.executable, "-c", script],
+            capture_output=True, text=True, check=True, env=env,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout
+        data = json.loads(next(line[5:] for line in out.splitlines() if line.startswith("BENCH")))
+        first, rest = data["records"][0], data["records"][1:]
+        cold_import.append(data["import_ms"])
+        cold_init.append(first["init_ms"])
+        cold_handler.append(first["handler_ms"])
+        warm_handler.extend(r["handler_ms"] for r in rest)
+
+    return {
+        "module": module,
+        "mode": mode,
+        "runs": runs,
+        "import_ms": _median(cold_import),
+        "init_ms": _median(cold_init),
+        "cold_handler_ms": _median(cold_handler),
+        "warm_handler_ms": _median(warm_handler) if warm_handler else None,
+    }
+
+
+if __name__ == "__main__":
+    for module in ("l7", "Lambda_heavy"):
+        for mode in ("lazy", "eager"):
+            print(json.dumps(benchmark(module, mode=mode)))
@@ -1,5 +1,200 @@
+import asyncio
+import copy
+import functools
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from bson import json_util
+from pymongo import ASCENDING, MongoClient
 from pymongo.database import Database
-from typing import Any, List, Dict
+from pymongo.errors import BulkWriteError
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+try:
+    from pymongo import AsyncMongoClient
+    from pymongo.asynchronous.database import AsyncDatabase
+except ImportError:  # pymongo < 4.10 has no native asyncio API
+    AsyncMongoClient = None
+    AsyncDatabase = None
+
+MONGO_URI = os.environ.get("MONGO_URI", "mongodb://localhost:27017")
+MONGO_MAX_POOL_SIZE = int(os.environ.get("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_TIMEOUT_MS = int(os.environ.get("MONGO_TIMEOUT_MS", "5000"))
+
+_clients: Dict[Tuple, Any] = {}
+_clients_lock = threading.Lock()
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def get_client(
+    uri: str = None,
+    max_pool_size: int = None,
+    min_pool_size: int = 0,
+    timeout_ms: int = None,
+    socket_timeout_ms: int = None,
+    asynchronous: bool = False
+) -> Any:
+    """
+    Returns a process-wide pooled client, creating it on first use.
+    - uri: Mongo connection string (defaults to MONGO_URI)
+    - max_pool_size / min_pool_size: connections kept per server; as in
+      pymongo, max_pool_size=0 means no limit (None uses MONGO_MAX_POOL_SIZE)
+    - timeout_ms: server selection, connect and pool wait-queue timeout
+      (None uses MONGO_TIMEOUT_MS)
+    - socket_timeout_ms: per-operation socket timeout (None waits indefinitely)
+    - asynchronous: return an AsyncMongoClient for the *_async helpers
+    Calls with the same settings share one client and therefore one pool;
+    close_clients() shuts them all down.
+    """
+    uri = uri or MONGO_URI
+    max_pool_size = MONGO_MAX_POOL_SIZE if max_pool_size is None else max_pool_size
+    timeout_ms = MONGO_TIMEOUT_MS if timeout_ms is None else timeout_ms
+    key = (uri, max_pool_size, min_pool_size, timeout_ms, socket_timeout_ms, asynchronous)
+
+    with _clients_lock:
+        if key not in _clients:
+            if asynchronous and AsyncMongoClient is None:
+                raise RuntimeError("pymongo >= 4.10 is required for asynchronous clients")
+            client_class = AsyncMongoClient if asynchronous else MongoClient
+            _clients[key] = client_class(
+                uri,
+                maxPoolSize=max_pool_size,
+                minPoolSize=min_pool_size,
+                serverSelectionTimeoutMS=timeout_ms,
+                connectTimeoutMS=timeout_ms,
+                waitQueueTimeoutMS=timeout_ms,
+                socketTimeoutMS=socket_timeout_ms,
+            )
+        return _clients[key]
+
+
+def close_clients() -> None:
+    """Closes the sync clients created by get_client()."""
+    with _clients_lock:
+        clients = [key for key in _clients if not key[-1]]
+        for key in clients:
+            _clients.pop(key).close()
+
+
+async def close_clients_async() -> None:
+    """Closes every client created by get_client(), sync and async."""
+    close_clients()
+    with _clients_lock:
+        clients = list(_clients.values())
+        _clients.clear()
+    for client in clients:
+        await client.close()
+
+
+class QueryCache:
+    """
+    TTL + LRU cache of find_documents() results, keyed on database,
+    collection, canonicalized query and limit. Writes made through this
+    module bump the collection's generation, which drops its entries and
+    stops reads that were already in flight from storing stale results.
+    """
+
+    def __init__(self, max_entries: int = 256, ttl_s: float = 30.0):
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self._entries = OrderedDict()  # key -> (expires_at, documents)
+        self._generations = {}  # (db name, collection) -> write count
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def make_key(db: Database, collection_name: str, query: Dict[str, Any], limit: int) -> Tuple:
+        # Top-level filter keys are order-insensitive; nested values are kept
+        # verbatim because embedded-document matches depend on field order.
+        canonical = tuple(sorted((k, json_util.dumps(v)) for k, v in (query or {}).items()))
+        return (db.name, collection_name, canonical, limit)
+
+    def generation(self, db: Database, collection_name: str) -> int:
+        with self._lock:
+            return self._generations.get((db.name, collection_name), 0)
+
+    def get(self, key: Tuple) -> Optional[List[Dict[str, Any]]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return copy.deepcopy(entry[1])
+
+    def put(self, key: Tuple, documents: List[Dict[str, Any]], generation: int) -> None:
+        with self._lock:
+            if self._generations.get(key[:2], 0) != generation:
+                return
+            self._entries[key] = (time.monotonic() + self.ttl_s, copy.deepcopy(documents))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, db: Database, collection_name: str) -> None:
+        scope = (db.name, collection_name)
+        with self._lock:
+            self._generations[scope] = self._generations.get(scope, 0) + 1
+            stale = [key for key in self._entries if key[:2] == scope]
+            for key in stale:
+                del self._entries[key]
+            self.invalidations += len(stale)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+                "entries": len(self._entries),
+            }
+
+
+_query_cache: Optional[QueryCache] = None
+
+
+def enable_query_cache(max_entries: int = 256, ttl_s: float = 30.0) -> QueryCache:
+    """
+    Turns on read-through caching for find_documents() and returns the cache.
+    Only writes made through this module invalidate it; writes from other
+    clients show up once entries expire after `ttl_s`.
+    """
+    global _query_cache
+    _query_cache = QueryCache(max_entries, ttl_s)
+    return _query_cache
+
+
+def disable_query_cache() -> None:
+    global _query_cache
+    _query_cache = None
+
+
+def query_cache_stats() -> Optional[Dict[str, int]]:
+    """Hit/miss/eviction counters of the active query cache, or None if disabled."""
+    return _query_cache.stats() if _query_cache is not None else None
+
+
+def _invalidate(db: Database, collection_name: str) -> None:
+    if _query_cache is not None:
+        _query_cache.invalidate(db, collection_name)
 
 def insert_document(db: Database, collection_name: str, document: Dict[str, Any]) -> Any:
     """
@@ -12,6 +207,8 @@ def insert_document(db: Database, collection_name: str, document: Dict[str, Any]
         return result.inserted_id
     except Exception as e:
         raise ConnectionError(f"Failed to insert document into '{collection_name}': {e}")
+    finally:
+        _invalidate(db, collection_name)
 
 def insert_documents(db: Database, collection_name: str, documents: List[Dict[str, Any]]) -> List[Any]:
     """
@@ -24,24 +221,387 @@ def insert_documents(db: Database, collection_name: str, documents: List[Dict[st
         return result.inserted_ids
     except Exception as e:
         raise ConnectionError(f"Failed to insert documents into '{collection_name}': {e}")
+    finally:
+        _invalidate(db, collection_name)
 
 def find_documents(
     db: Database,
     collection_name: str,
     query: Dict[str, Any] = None,
-    limit: int = 0
+    limit: int = 0,
+    use_cache: bool = True
 ) -> List[Dict[str, Any]]:
     """
     Retrieves documents matching `query` from the specified collection.
     - query: Mongo filter dict (defaults to {} for all documents)
     - limit: max number of documents to return (0 means no limit)
+    - use_cache: serve from the query cache when enable_query_cache() is on
     Returns a list of document dicts.
     Raises ConnectionError on failure.
     """
+    cache = _query_cache if use_cache else None
+    if cache is not None:
+        key = QueryCache.make_key(db, collection_name, query, limit)
+        generation = cache.generation(db, collection_name)
+        documents = cache.get(key)
+        if documents is not None:
+            return documents
+
+    try:
+        cursor = db[collection_name].find(query or {})
+        if limit > 0:
+            cursor = cursor.limit(limit)
+        documents = list(cursor)
+    except Exception as e:
+        raise ConnectionError(f"Failed to retrieve documents from '{collection_name}': {e}")
+
+    if cache is not None:
+        cache.put(key, documents, generation)
+    return documents
+
+
+def _page_filter(query: Dict[str, Any], sort: List[Tuple[str, int]], last: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Keyset condition selecting documents strictly after `last` in `sort` order:
+    (k1 > v1) or (k1 == v1 and k2 > v2) or ... with > flipped for descending keys.
+    """
+    clauses = []
+    for i, (field, direction) in enumerate(sort):
+        clause = {f: last[f] for f, _ in sort[:i]}
+        clause[field] = {"$gt" if direction == ASCENDING else "$lt": last[field]}
+        clauses.append(clause)
+    after = clauses[0] if len(clauses) == 1 else {"$or": clauses}
+    return {"$and": [query, after]} if query else after
+
+
+def iter_documents(
+    db: Database,
+    collection_name: str,
+    query: Dict[str, Any] = None,
+    projection: Dict[str, Any] = None,
+    sort: List[Tuple[str, int]] = None,
+    batch_size: int = 1000,
+    limit: int = 0,
+    resume_after: Any = None
+) -> Iterator[Dict[str, Any]]:
+    """
+    Lazily yields documents matching `query`, fetching `batch_size` at a time.
+    - query: Mongo filter dict (defaults to {} for all documents)
+    - projection: Mongo projection dict (defaults to whole documents)
+    - sort: list of (field, ASCENDING/DESCENDING); _id is appended as a tiebreaker
+    - batch_size: documents fetched per round trip
+    - limit: max number of documents to yield (0 means no limit)
+    - resume_after: last document yielded by a previous run, or its _id;
+      iteration continues right after it. Sort keys the projection left out
+      are looked up by _id, so that document must still exist.
+    Each page is its own keyset query on the sort keys rather than one
+    long-lived cursor, so a failed or interrupted scan can pick up where it
+    stopped and no server cursor is left open between pages. Sort fields must
+    be present on every document.
+    Raises ConnectionError on failure.
+    """
+    if batch_size <= 0:
+        raise ValueError(f"batch_size must be positive, got {batch_size}")
+
+    query = query or {}
+    sort = list(sort or [])
+    if "_id" not in (field for field, _ in sort):
+        sort.append(("_id", ASCENDING))
+
+    # Sort keys are needed to build the next page's filter, so they are always
+    # fetched and stripped before yielding if the projection left them out.
+    fetch_projection, hidden = projection, []
+    if projection:
+        fetch_projection = dict(projection)
+        inclusion = any(v for k, v in projection.items() if k != "_id")
+        for field, _ in sort:
+            default = 1 if field == "_id" or not inclusion else 0
+            if not projection.get(field, default):
+                if inclusion:
+                    fetch_projection[field] = 1
+                else:
+                    fetch_projection.pop(field)
+                hidden.append(field)
+
+    last = resume_after
+    if last is not None and not isinstance(last, dict):
+        last = {"_id": last}
+    if last is not None and any(field not in last for field, _ in sort):
+        last = _resume_keys(db, collection_name, sort, last)
+    yielded = 0
+
+    while True:
+        page_size = batch_size if limit <= 0 else min(batch_size, limit - yielded)
+        if page_size <= 0:
+            return
+        page_query = _page_filter(query, sort, last) if last is not None else query
+        try:
+            page = list(
+                db[collection_name]
+                .find(page_query, fetch_projection)
+                .sort(sort)
+                .limit(page_size)
+            )
+        except Exception as e:
+            raise ConnectionError(f"Failed to retrieve documents from '{collection_name}': {e}")
+
+        for document in page:
+            last = {field: document[field] for field, _ in sort}
+            for field in hidden:
+                document.pop(field, None)
+            yield document
+        yielded += len(page)
+        if len(page) < page_size:
+            return
+
+
+def _resume_keys(db: Database, collection_name: str, sort: List[Tuple[str, int]], last: Dict[str, Any]) -> Dict[str, Any]:
+    """The sort-key values of the resume document, fetching any it lacks by _id."""
+    if "_id" not in last:
+        raise ValueError("resume_after must include _id or every sort key")
+    fields = [field for field, _ in sort]
+    try:
+        stored = db[collection_name].find_one({"_id": last["_id"]}, {field: 1 for field in fields})
+    except Exception as e:
+        raise ConnectionError(f"Failed to retrieve documents from '{collection_name}': {e}")
+    if stored is None:
+        raise ValueError(f"Cannot resume after _id {last['_id']!r}: no such document in '{collection_name}'")
+    missing = [field for field in fields if field not in last and field not in stored]
+    if missing:
+        raise ValueError(f"Cannot resume after _id {last['_id']!r}: it has no {', '.join(missing)}")
+    return {field: last[field] if field in last else stored[field] for field in fields}
+
+
+def _chunks(documents: Iterable[Dict[str, Any]], size: int) -> Iterator[List[Dict[str, Any]]]:
+    chunk = []
+    for document in documents:
+        chunk.append(document)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def bulk_insert(
+    db: Database,
+    collection_name: str,
+    documents: Iterable[Dict[str, Any]],
+    chunk_size: int = 1000,
+    collect_ids: bool = False
+) -> Dict[str, Any]:
+    """
+    Inserts documents from any iterable in unordered batches of `chunk_size`,
+    holding at most one batch in memory.
+    - collect_ids: also return every inserted _id (costs memory on huge loads)
+    A duplicate key or validation error only fails that document; the rest of
+    its batch and later batches still go in. Returns a dict with
+    inserted_count, failed_count, batches, failures (index into `documents`,
+    code, errmsg) and, if requested, inserted_ids.
+    Raises ConnectionError on any other failure.
+    """
+    if chunk_size <= 0:
+        raise ValueError(f"chunk_size must be positive, got {chunk_size}")
+
+    report = {"inserted_count": 0, "failed_count": 0, "batches": 0, "failures": []}
+    if collect_ids:
+        report["inserted_ids"] = []
+
+    offset = 0
+    for chunk in _chunks(documents, chunk_size):
+        failed_indexes = set()
+        try:
+            result = db[collection_name].insert_many(chunk, ordered=False)
+            report["inserted_count"] += len(result.inserted_ids)
+        except BulkWriteError as e:
+            details = e.details or {}
+            report["inserted_count"] += details.get("nInserted", 0)
+            for error in details.get("writeErrors", []):
+                failed_indexes.add(error["index"])
+                report["failures"].append({
+                    "index": offset + error["index"],
+                    "code": error.get("code"),
+                    "errmsg": error.get("errmsg"),
+                })
+            report["failed_count"] += len(details.get("writeErrors", []))
+        except Exception as e:
+            raise ConnectionError(
+                f"Failed to insert documents into '{collection_name}' "
+                f"after {report['inserted_count']} inserted: {e}"
+            )
+        finally:
+            _invalidate(db, collection_name)
+
+        if collect_ids:
+            # insert_many assigns _id in place on documents that lack one.
+            report["inserted_ids"].extend(
+                doc["_id"] for i, doc in enumerate(chunk) if i not in failed_indexes
+            )
+        report["batches"] += 1
+        offset += len(chunk)
+
+    return report
+
+
+def _is_async(db: Any) -> bool:
+    return AsyncDatabase is not None and isinstance(db, AsyncDatabase)
+
+
+async def _run_sync(fn, *args, **kwargs) -> Any:
+    """
+    Runs a sync helper on a shared thread pool sized like the connection pool,
+    so plain Database objects can still be used concurrently from a loop.
+    """
+    global _executor
+    with _clients_lock:
+        if _executor is None:
+            # An unbounded pool (0) gets the executor's default size.
+            _executor = ThreadPoolExecutor(max_workers=MONGO_MAX_POOL_SIZE or None)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(fn, *args, **kwargs))
+
+
+async def insert_document_async(db: Any, collection_name: str, document: Dict[str, Any]) -> Any:
+    """
+    Async counterpart of insert_document(). `db` may be an AsyncDatabase
+    (native asyncio driver) or a sync Database (run on a thread pool).
+    Raises ConnectionError if insertion fails.
+    """
+    if not _is_async(db):
+        return await _run_sync(insert_document, db, collection_name, document)
+    try:
+        result = await db[collection_name].insert_one(document)
+        return result.inserted_id
+    except Exception as e:
+        raise ConnectionError(f"Failed to insert document into '{collection_name}': {e}")
+    finally:
+        _invalidate(db, collection_name)
+
+
+async def insert_documents_async(db: Any, collection_name: str, documents: List[Dict[str, Any]]) -> List[Any]:
+    """
+    Async counterpart of insert_documents(); see insert_document_async().
+    Raises ConnectionError if insertion fails.
+    """
+    if not _is_async(db):
+        return await _run_sync(insert_documents, db, collection_name, documents)
+    try:
+        result = await db[collection_name].insert_many(documents)
+        return result.inserted_ids
+    except Exception as e:
+        raise ConnectionError(f"Failed to insert documents into '{collection_name}': {e}")
+    finally:
+        _invalidate(db, collection_name)
+
+
+async def find_documents_async(
+    db: Any,
+    collection_name: str,
+    query: Dict[str, Any] = None,
+    limit: int = 0,
+    use_cache: bool = True
+) -> List[Dict[str, Any]]:
+    """
+    Async counterpart of find_documents(), sharing its query cache; see
+    insert_document_async() for the accepted `db` types.
+    Raises ConnectionError on failure.
+    """
+    if not _is_async(db):
+        return await _run_sync(find_documents, db, collection_name, query, limit, use_cache)
+
+    cache = _query_cache if use_cache else None
+    if cache is not None:
+        key = QueryCache.make_key(db, collection_name, query, limit)
+        generation = cache.generation(db, collection_name)
+        documents = cache.get(key)
+        if documents is not None:
+            return documents
+
     try:
         cursor = db[collection_name].find(query or {})
         if limit > 0:
             cursor = cursor.limit(limit)
-        return list(cursor)
+        documents = await cursor.to_list(None)
     except Exception as e:
         raise ConnectionError(f"Failed to retrieve documents from '{collection_name}': {e}")
+
+    if cache is not None:
+        cache.put(key, documents, generation)
+    return documents
+
+
+def benchmark(operations: int = 200, latency_ms: float = 5.0, uri: str = None) -> Dict[str, Any]:
+    """
+    Times `operations` inserts and finds done one after another with the
+    sync helpers against the same work gathered concurrently with the async
+    ones. Uses a real server when `uri` is given; otherwise an in-memory
+    mongomock database that sleeps `latency_ms` per call to stand in for
+    the network round trip.
+    """
+    if uri:
+        sync_db = get_client(uri)["benchmark"]
+        async_db = get_client(uri, asynchronous=True)["benchmark"]
+    else:
+        import mongomock
+
+        sync_db = async_db = _LatencyDatabase(mongomock.MongoClient()["benchmark"], latency_ms / 1000)
+
+    async def run_async(n):
+        await asyncio.gather(*(insert_document_async(async_db, "bench_async", {"i": i}) for i in range(n)))
+        await asyncio.gather(*(find_documents_async(async_db, "bench_async", {"i": i}) for i in range(n)))
+
+    start = time.perf_counter()
+    for i in range(operations):
+        insert_document(sync_db, "bench_sync", {"i": i})
+    for i in range(operations):
+        find_documents(sync_db, "bench_sync", {"i": i})
+    sync_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    asyncio.run(run_async(operations))
+    async_s = time.perf_counter() - start
+
+    return {
+        "operations": operations * 2,
+        "backend": "mongodb" if uri else f"mongomock+{latency_ms}ms",
+        "sync_s": sync_s,
+        "async_s": async_s,
+        "sync_ops_per_s": operations * 2 / sync_s,
+        "async_ops_per_s": operations * 2 / async_s,
+        "speedup": sync_s / async_s,
+    }
+
+
+class _LatencyDatabase:
+    """Wraps a Database so each collection call sleeps first, like a round trip."""
+
+    def __init__(self, db: Any, latency_s: float):
+        self._db = db
+        self._latency_s = latency_s
+        self.name = db.name
+
+    def __getitem__(self, collection_name: str) -> Any:
+        return _LatencyCollection(self._db[collection_name], self._latency_s)
+
+
+class _LatencyCollection:
+    def __init__(self, collection: Any, latency_s: float):
+        self._collection = collection
+        self._latency_s = latency_s
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self._collection, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            time.sleep(self._latency_s)
+            return attr(*args, **kwargs)
+        return call
+
+
+if __name__ == "__main__":
+    import json
+    import sys
+
+    print(json.dumps(benchmark(uri=sys.argv[1] if len(sys.argv) > 1 else None), indent=2))
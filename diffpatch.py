@@ -0,0 +1,435 @@
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+PATCH_WORKERS = int(os.environ.get("PATCH_WORKERS", "8"))
+PATCH_FUZZ = int(os.environ.get("PATCH_FUZZ", "2"))  # context lines a hunk may drop to apply
+
+_HUNK_HEADER = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+
+
+class PatchError(Exception):
+    pass
+
+
+class Hunk:
+    """
+    One @@ hunk. `lines` holds (tag, text) pairs with tag " ", "-" or "+"
+    and the text without its newline.
+    """
+
+    __slots__ = ("old_start", "old_len", "new_start", "new_len", "lines", "new_eof_newline")
+
+    def __init__(self, old_start, old_len, new_start, new_len):
+        self.old_start = old_start
+        self.old_len = old_len
+        self.new_start = new_start
+        self.new_len = new_len
+        self.lines = []
+        self.new_eof_newline = True
+
+    def old_lines(self):
+        return [text for tag, text in self.lines if tag != "+"]
+
+    def new_lines(self):
+        return [text for tag, text in self.lines if tag != "-"]
+
+
+class FilePatch:
+    """The hunks of one file in a diff, in file order."""
+
+    __slots__ = ("old_path", "new_path", "hunks", "is_new", "is_deleted", "is_binary")
+
+    def __init__(self, old_path=None, new_path=None):
+        self.old_path = old_path
+        self.new_path = new_path
+        self.hunks = []
+        self.is_new = False
+        self.is_deleted = False
+        self.is_binary = False
+
+    @property
+    def path(self):
+        return self.old_path if self.is_deleted else self.new_path or self.old_path
+
+    def stats(self):
+        added = sum(1 for hunk in self.hunks for tag, _ in hunk.lines if tag == "+")
+        removed = sum(1 for hunk in self.hunks for tag, _ in hunk.lines if tag == "-")
+        return added, removed
+
+
+def split_lines(text):
+    """The lines of a whole file without newlines; only LF and CRLF end a line."""
+    lines = text.split("\n")
+    if lines[-1] == "":
+        lines.pop()
+    if "\r" in text:
+        lines = [line[:-1] if line.endswith("\r") else line for line in lines]
+    return lines
+
+
+def iter_lines(text):
+    """Yields the lines of `text` without newlines, one slice at a time."""
+    start = 0
+    end = len(text)
+    while start < end:
+        stop = text.find("\n", start)
+        if stop < 0:
+            yield text[start:]
+            return
+        yield text[start:stop - 1] if stop > start and text[stop - 1] == "\r" else text[start:stop]
+        start = stop + 1
+
+
+def _strip_prefix(path):
+    if path == "/dev/null":
+        return None
+    path = path.split("\t", 1)[0]
+    if path[:2] in ("a/", "b/"):
+        return path[2:]
+    return path
+
+
+def parse_diff(lines):
+    """
+    Incrementally parses a unified diff (git or plain) into FilePatch
+    objects, yielding each file as soon as its last hunk has been read.
+    `lines` is any iterable of lines (a file object, or iter_lines(text)),
+    so the diff is never held in memory as a second copy. The preamble
+    before the first file (e.g. a format-patch mail header) is skipped.
+    """
+    current = None
+    hunk = None
+    old_left = new_left = 0
+    last_tag = None
+
+    for line in lines:
+        line = line.rstrip("\r\n")
+        if hunk is not None and (old_left > 0 or new_left > 0):
+            tag = line[:1] or " "  # some tools strip the space from empty context lines
+            if tag in " -+":
+                hunk.lines.append((tag, line[1:]))
+                if tag != "+":
+                    old_left -= 1
+                if tag != "-":
+                    new_left -= 1
+                last_tag = tag
+                continue
+            if line.startswith("\\"):
+                continue
+            raise PatchError(f"Malformed hunk in {current.path}: {line[:80]!r}")
+
+        if line.startswith("\\"):
+            # Marks the line before it; only the new side matters for output.
+            if hunk is not None and last_tag != "-":
+                hunk.new_eof_newline = False
+            continue
+
+        if line.startswith("diff --git "):
+            if current is not None:
+                yield current
+            parts = line[len("diff --git "):].split(" b/", 1)
+            current = FilePatch(_strip_prefix(parts[0]), parts[1] if len(parts) > 1 else None)
+            hunk = None
+        elif line.startswith("--- ") and (current is None or current.hunks or hunk is not None):
+            if current is not None:
+                yield current
+            current = FilePatch(_strip_prefix(line[4:]))
+            current.is_new = current.old_path is None
+            hunk = None
+        elif line.startswith("--- ") and current is not None:
+            current.old_path = _strip_prefix(line[4:])
+            current.is_new = current.old_path is None
+        elif line.startswith("+++ ") and current is not None:
+            current.new_path = _strip_prefix(line[4:])
+            current.is_deleted = current.new_path is None
+        elif line.startswith("@@") and current is not None:
+            match = _HUNK_HEADER.match(line)
+            if match is None:
+                raise PatchError(f"Bad hunk header in {current.path}: {line[:80]!r}")
+            old_start, old_len, new_start, new_len = match.groups()
+            old_left = 1 if old_len is None else int(old_len)
+            new_left = 1 if new_len is None else int(new_len)
+            hunk = Hunk(int(old_start), old_left, int(new_start), new_left)
+            current.hunks.append(hunk)
+            last_tag = None
+        elif current is not None:
+            if line.startswith("new file mode"):
+                current.is_new = True
+            elif line.startswith("deleted file mode"):
+                current.is_deleted = True
+            elif line.startswith("rename from "):
+                current.old_path = line[len("rename from "):]
+            elif line.startswith("rename to "):
+                current.new_path = line[len("rename to "):]
+            elif line.startswith("Binary files") or line.startswith("GIT binary patch"):
+                current.is_binary = True
+
+    if current is not None:
+        yield current
+
+
+def _context_run(lines, reverse=False):
+    """Number of context lines at the start (or end) of a hunk."""
+    count = 0
+    for tag, _ in (reversed(lines) if reverse else lines):
+        if tag != " ":
+            break
+        count += 1
+    return count
+
+
+def _locate(base, index, hunk, expected, fuzz):
+    """
+    Finds where a hunk's pre-image occurs in `base`, preferring the position
+    closest to `expected`. The expected position is tried first; otherwise
+    candidates come from the base line index (built on first need), keyed
+    on the pre-image line that occurs least often in the base. Each fuzz
+    level ignores one more context line at both ends, as patch(1) does.
+    Returns (position of the full pre-image, fuzz, ignored leading lines,
+    ignored trailing lines) or None.
+    """
+    old = hunk.old_lines()
+    if not old:
+        return max(0, min(expected, len(base))), 0, 0, 0
+    if base[expected:expected + len(old)] == old:
+        return expected, 0, 0, 0
+    if not index:
+        for i, line in enumerate(base):
+            index.setdefault(line, []).append(i)
+    leading, trailing = _context_run(hunk.lines), _context_run(hunk.lines, reverse=True)
+    for level in range(fuzz + 1):
+        head, tail = min(level, leading), min(level, trailing)
+        if level and head < level and tail < level:
+            break  # no more context to drop
+        lines = old[head:len(old) - tail]
+        if not lines:
+            break
+        anchor = min(range(len(lines)), key=lambda j: len(index.get(lines[j], ())))
+        starts = sorted(
+            (p - anchor for p in index.get(lines[anchor], ()) if p >= anchor),
+            key=lambda p: abs(p - head - expected)
+        )
+        for start in starts:
+            if base[start:start + len(lines)] == lines:
+                return start - head, level, head, tail
+    return None
+
+
+def apply_hunks(base, hunks, fuzz=None):
+    """
+    Applies `hunks` to `base` (a list of lines) and returns (new lines,
+    report). Each hunk is placed near its header line shifted by the offset
+    of the hunks before it; if its exact pre-image isn't there, up to
+    `fuzz` context lines are ignored at each end. The report lists each
+    hunk's offset, the largest fuzz used and whether the last hunk reached
+    the end of the base. Raises PatchError if a hunk can't be placed or
+    overlaps the previous one.
+    """
+    fuzz = PATCH_FUZZ if fuzz is None else fuzz
+    index = {}  # base line -> positions, filled by _locate if a hunk has moved
+
+    out = []
+    copied = 0  # base lines consumed so far
+    offset = 0
+    report = {"offsets": [], "fuzz": 0}
+    for number, hunk in enumerate(hunks, 1):
+        old_len = len(hunk.old_lines())
+        # A zero-length pre-image is anchored after line old_start, not at it.
+        header = hunk.old_start - 1 if old_len else hunk.old_start
+        found = _locate(base, index, hunk, header + offset, fuzz)
+        if found is None:
+            raise PatchError(f"Hunk #{number} (line {hunk.old_start}) doesn't match the base")
+        position, level, head, tail = found
+        if position + head < copied:
+            raise PatchError(f"Hunk #{number} overlaps the previous hunk")
+        # Ignored context stays as the base has it.
+        new = hunk.new_lines()
+        out.extend(base[copied:position + head])
+        out.extend(new[head:len(new) - tail])
+        copied = position + old_len - tail
+        offset = position - header
+        report["offsets"].append(offset)
+        report["fuzz"] = max(report["fuzz"], level)
+    report["reaches_eof"] = copied == len(base)
+    out.extend(base[copied:])
+    return out, report
+
+
+def apply_file_patch(patch, base_text=None, fuzz=None):
+    """
+    Reconstructs the new content of one file. Returns a dict with the
+    filename, the code and a status: "new", "deleted", "binary",
+    "applied", or "partial" when no base was available and the code is
+    only the post-images of the hunks.
+    """
+    result = {"filename": patch.path, "hunks": len(patch.hunks)}
+    if patch.is_binary:
+        return {**result, "status": "binary", "code": None}
+    if patch.is_deleted:
+        return {**result, "status": "deleted", "code": ""}
+
+    eof_newline = not patch.hunks or patch.hunks[-1].new_eof_newline
+    if patch.is_new or (base_text is None and patch.hunks and patch.hunks[0].old_len == 0):
+        lines = [line for hunk in patch.hunks for line in hunk.new_lines()]
+        status = "new"
+    elif base_text is None:
+        lines = []
+        for hunk in patch.hunks:
+            if lines:
+                lines.append("")
+            lines.extend(hunk.new_lines())
+        status = "partial"
+    else:
+        lines, report = apply_hunks(split_lines(base_text), patch.hunks, fuzz)
+        if not report.pop("reaches_eof"):
+            eof_newline = base_text.endswith("\n")
+        result.update(report)
+        status = "applied"
+
+    code = "\n".join(lines)
+    if lines and eof_newline:
+        code += "\n"
+    return {**result, "status": status, "code": code}
+
+
+def apply_diff(diff, load_base=None, workers=None, fuzz=None):
+    """
+    Parses `diff` (text or an iterable of lines) and rebuilds every file it
+    touches. `load_base(path)` returns the base text of a file or None;
+    base loading and patching run on a thread pool of `workers`, starting
+    as soon as each file has been parsed. Results keep diff order; a file
+    whose hunks don't apply gets status "failed" and an "error".
+    """
+    lines = iter_lines(diff) if isinstance(diff, str) else diff
+
+    def rebuild(patch):
+        try:
+            base = None
+            if load_base is not None and not patch.is_new and patch.old_path:
+                base = load_base(patch.old_path)
+            return apply_file_patch(patch, base, fuzz)
+        except PatchError as e:
+            return {"filename": patch.path, "hunks": len(patch.hunks), "status": "failed",
+                    "code": None, "error": str(e)}
+
+    with ThreadPoolExecutor(max_workers=workers or PATCH_WORKERS) as pool:
+        futures = [(patch, pool.submit(rebuild, patch)) for patch in parse_diff(lines)]
+        return [(patch, future.result()) for patch, future in futures]
+
+
+def directory_loader(root):
+    """
+    load_base for files checked out under `root`; missing files give None.
+    Paths come from the diff, so any that resolve outside `root` (absolute,
+    "..", or through a symlink) raise PatchError instead of being read.
+    """
+    root = os.path.realpath(root)
+
+    def load(path):
+        full = os.path.realpath(os.path.join(root, path))
+        if os.path.commonpath([root, full]) != root:
+            raise PatchError(f"Path escapes the base directory: {path}")
+        if not os.path.isfile(full):
+            return None
+        with open(full, encoding="utf-8", errors="replace") as f:
+            return f.read()
+    return load
+
+
+def subject(diff):
+    """The Subject: of a format-patch preamble, if the diff has one."""
+    for line in iter_lines(diff[:8192]):
+        if line.startswith("diff ") or line.startswith("--- "):
+            return None
+        if line.startswith("Subject: "):
+            return re.sub(r"^(\[[^\]]*\]\s*)+", "", line[len("Subject: "):]).strip() or None
+    return None
+
+
+def summarize(results, title=None):
+    """One sentence describing what a diff does, from its per-file results."""
+    added = sum(patch.stats()[0] for patch, _ in results)
+    removed = sum(patch.stats()[1] for patch, _ in results)
+    counts = {}
+    for _, result in results:
+        counts[result["status"]] = counts.get(result["status"], 0) + 1
+    names = [result["filename"] for _, result in results]
+    shown = ", ".join(names[:3]) + (f" and {len(names) - 3} more" if len(names) > 3 else "")
+    what = f"touches {len(names)} file{'s' if len(names) != 1 else ''} ({shown}), +{added}/-{removed} lines"
+    details = []
+    if counts.get("new"):
+        details.append(f"{counts['new']} new")
+    if counts.get("deleted"):
+        details.append(f"{counts['deleted']} deleted")
+    if counts.get("partial"):
+        details.append(f"{counts['partial']} without a base")
+    if counts.get("failed"):
+        details.append(f"{counts['failed']} failed to apply")
+    if details:
+        what += f"; {', '.join(details)}"
+    return f"{title.rstrip('.')}: {what}." if title else f"This PR {what}."
+
+
+def make_synthetic_diff(files=100, lines=2000, hunk_every=100, seed=0):
+    """
+    Builds {path: base text} and a unified diff that edits every file
+    every `hunk_every` lines (one line changed, one inserted per hunk).
+    """
+    import random
+
+    rng = random.Random(seed)
+    bases, diff = {}, []
+    for f in range(files):
+        path = f"pkg/module_{f}.py"
+        base = [f"value_{f}_{i} = {rng.randint(0, 10**6)}" for i in range(lines)]
+        bases[path] = "\n".join(base) + "\n"
+        diff.append(f"diff --git a/{path} b/{path}")
+        diff.append(f"--- a/{path}")
+        diff.append(f"+++ b/{path}")
+        added = 0
+        for start in range(3, lines - 4, hunk_every):
+            old = base[start - 3:start + 4]
+            diff.append(f"@@ -{start - 2},7 +{start - 2 + added},8 @@")
+            diff.extend(" " + line for line in old[:3])
+            diff.append("-" + old[3])
+            diff.append("+" + old[3] + "  # changed")
+            diff.append("+# inserted")
+            diff.extend(" " + line for line in old[4:])
+            added += 1
+    return bases, "\n".join(diff) + "\n"
+
+
+def benchmark(files=200, lines=5000, hunk_every=50, workers=None):
+    """
+    Throughput of apply_diff on a synthetic diff, then the peak traced
+    memory of a second run (tracing slows it down, so it isn't timed).
+    """
+    import time
+    import tracemalloc
+
+    bases, diff = make_synthetic_diff(files, lines, hunk_every)
+    start = time.perf_counter()
+    results = apply_diff(diff, bases.get, workers=workers)
+    elapsed = time.perf_counter() - start
+    applied = sum(1 for _, result in results if result["status"] == "applied")
+    del results
+
+    tracemalloc.start()
+    apply_diff(diff, bases.get, workers=workers)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "files": files,
+        "diff_mb": len(diff) / 1e6,
+        "applied": applied,
+        "seconds": elapsed,
+        "diff_mb_per_s": len(diff) / 1e6 / elapsed,
+        "peak_traced_mb": peak / 1e6,
+    }
+
+
+if __name__ == "__main__":
+    import json
+
+    print(json.dumps(benchmark()))
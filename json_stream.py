@@ -0,0 +1,414 @@
+import codecs
+import json
+import os
+import re
+from json.decoder import JSONDecodeError, scanstring
+
+JSON_CHUNK_SIZE = int(os.environ.get("JSON_CHUNK_KB", "256")) * 1024
+# Numeric arrays with at least this many elements are decoded into ndarrays.
+ARRAY_MIN_ITEMS = int(os.environ.get("JSON_ARRAY_MIN_ITEMS", "1024"))
+LOG_SUMMARY_CHARS = int(os.environ.get("LOG_SUMMARY_CHARS", "1024"))
+
+_WS = re.compile(r"[ \t\n\r]*")
+_NUMERIC_RUN = re.compile(r"[-+0-9.eE, \t\n\r]*")
+_NUMBER_CHARS = re.compile(r"[-+0-9.eE]*")
+# A comma-separated run of numbers exactly as the JSON grammar allows them.
+# (?=(...))\1 matches like an atomic group (possessive quantifiers and (?>...)
+# need Python 3.11): a number, once matched, is never re-split, so a bad
+# token fails the match in linear time instead of backtracking through the run.
+_NUMBER = r"-?(?:0|[1-9][0-9]*)(?:\.[0-9]+)?(?:[eE][-+]?[0-9]+)?"
+_NUMBER_LIST = re.compile(
+    rf"[ \t\n\r]*(?=({_NUMBER}))\1(?:(?=([ \t\n\r]*,[ \t\n\r]*{_NUMBER}))\2)*[ \t\n\r]*"
+)
+_INT64_MIN, _INT64_MAX = -2 ** 63, 2 ** 63 - 1
+_EXACT_FLOAT_INT = 2 ** 53  # integers from here on may not survive a float64
+_decoder = json.JSONDecoder()
+
+
+class _Stream:
+    """
+    A text window over a stream of byte chunks. `buf[pos:]` is the
+    unconsumed text; fill() drops the consumed prefix and reads more.
+    """
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._utf8 = codecs.getincrementaldecoder("utf-8")()
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+        self.bytes_read = 0
+
+    def fill(self):
+        """
+        Reads at least one more chunk, and at least as much text as is left
+        unconsumed, so retrying a token that spans chunks stays linear.
+        Returns False once the stream is exhausted.
+        """
+        if self.eof:
+            return False
+        pieces = [self.buf[self.pos:]]
+        have, want = len(pieces[0]), 2 * len(pieces[0]) + 1
+        while have < want:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                pieces.append(self._utf8.decode(b"", final=True))
+                self.eof = True
+                break
+            self.bytes_read += len(chunk)
+            text = self._utf8.decode(chunk)
+            pieces.append(text)
+            have += len(text)
+        self.buf = "".join(pieces)
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """The next non-whitespace character, or "" at the end of input."""
+        while True:
+            self.pos = _WS.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf) or not self.fill():
+                return self.buf[self.pos:self.pos + 1]
+
+    def error(self, message):
+        return JSONDecodeError(message, self.buf, self.pos)
+
+
+def _numeric(value):
+    """
+    (ndarray, largest integer magnitude in it) for a rectangular array of
+    numbers, or None if `value` isn't one or an ndarray couldn't hold it
+    exactly: int64 needs every element to be an integer inside int64's
+    range (the bounds themselves excluded), float64 needs every integer
+    element to be below 2**53. Booleans aren't numbers here.
+    """
+    import numpy as np
+
+    if isinstance(value, np.ndarray):  # built by these same rules
+        return value, int(np.abs(value).max()) if value.dtype.kind == "i" and value.size else 0
+    if not value:
+        return None
+    if isinstance(value[0], (list, np.ndarray)):
+        rows = []
+        for row in value:
+            row = _numeric(row) if isinstance(row, (list, np.ndarray)) else None
+            if row is None or (rows and row[0].shape != rows[0][0].shape):
+                return None
+            rows.append(row)
+        largest = max(row[1] for row in rows)
+        if all(row[0].dtype.kind == "i" for row in rows):
+            return np.stack([row[0] for row in rows]), largest
+        if largest >= _EXACT_FLOAT_INT:
+            return None
+        return np.stack([row[0] for row in rows]).astype(np.float64, copy=False), largest
+
+    low = high = 0
+    integral = True
+    for item in value:
+        kind = type(item)
+        if kind is int:
+            low, high = min(low, item), max(high, item)
+        elif kind is float:
+            integral = False
+        else:
+            return None
+    largest = max(-low, high)
+    if integral:
+        if low <= _INT64_MIN or high >= _INT64_MAX:
+            return None
+        return np.array(value, dtype=np.int64), largest
+    if largest >= _EXACT_FLOAT_INT:
+        return None
+    return np.array(value, dtype=np.float64), largest
+
+
+def _as_array(items):
+    """`items` as an ndarray if it qualifies (see load), otherwise `items` itself."""
+    import numpy as np
+
+    first = items[0] if items else None
+    if isinstance(first, list):
+        total = len(items) * len(first)
+    elif isinstance(first, np.ndarray):
+        total = len(items) * first.size
+    elif isinstance(first, (int, float)):
+        total = len(items)
+    else:
+        return items
+    if total < ARRAY_MIN_ITEMS:
+        return items
+    converted = _numeric(items)
+    return items if converted is None else converted[0]
+
+
+def _arrays(value):
+    """Converts qualifying arrays inside an already decoded value, in place."""
+    if isinstance(value, dict):
+        for key, item in value.items():
+            if isinstance(item, (dict, list)):
+                value[key] = _arrays(item)
+        return value
+    for i, item in enumerate(value):
+        if isinstance(item, (dict, list)):
+            value[i] = _arrays(item)
+    return _as_array(value)
+
+
+def _float_tokens(text):
+    """A bool per comma-separated number in `text`: does it have a fraction or exponent?"""
+    import numpy as np
+
+    chars = np.frombuffer(text.encode("ascii"), dtype=np.uint8)
+    marks = (chars == ord(".")) | (chars == ord("e")) | (chars == ord("E"))
+    starts = np.concatenate(([0], np.flatnonzero(chars == ord(",")) + 1))
+    return np.logical_or.reduceat(marks, starts)
+
+
+def _parse_numbers(s, start, stop):
+    """
+    Parses the numbers in s.buf[start:stop] (comma-separated, with no
+    trailing comma). Returns an int64 ndarray if they are all integers, a
+    float64 ndarray if none are, and otherwise the text itself, so each
+    number keeps its own type until the array's fate is known. Integers
+    that int64 can't hold come back as an exact list.
+    """
+    import numpy as np
+
+    text = s.buf[start:stop]
+    if _NUMBER_LIST.fullmatch(text) is None:
+        try:
+            json.loads(f"[{text}]")
+        except JSONDecodeError as e:
+            raise JSONDecodeError(e.msg, s.buf, start + e.pos - 1) from None
+        raise s.error("Invalid number")
+    floats = _float_tokens(text)
+    if floats.all():
+        return np.fromstring(text, dtype=np.float64, sep=",")
+    if floats.any():
+        return text
+    values = np.fromstring(text, dtype=np.int64, sep=",")
+    # fromstring saturates at the int64 bounds instead of failing.
+    if int(values.max()) == _INT64_MAX or int(values.min()) == _INT64_MIN:
+        return json.loads(f"[{text}]")
+    return values
+
+
+def _part_size(part):
+    return part.count(",") + 1 if isinstance(part, str) else len(part)
+
+
+def _join_numbers(parts, whole):
+    """
+    Assembles the parts of a run of numbers: one ndarray if the run is the
+    `whole` array and it qualifies (see load), else an exact list.
+    """
+    import numpy as np
+
+    if not parts:
+        return []
+    if whole and sum(map(_part_size, parts)) >= ARRAY_MIN_ITEMS and not any(isinstance(p, list) for p in parts):
+        if all(isinstance(p, np.ndarray) and p.dtype.kind == "i" for p in parts):
+            return np.concatenate(parts) if len(parts) > 1 else parts[0]
+        arrays, largest = [], 0
+        for part in parts:
+            if isinstance(part, str):
+                floats = _float_tokens(part)
+                part = np.fromstring(part, dtype=np.float64, sep=",")
+                integers = part[~floats]
+            else:
+                integers = part if part.dtype.kind == "i" else ()
+            if len(integers):
+                largest = max(largest, float(np.abs(integers).max()))
+            arrays.append(part)
+        if largest < _EXACT_FLOAT_INT:
+            return np.concatenate(arrays).astype(np.float64, copy=False)
+
+    values = []
+    for part in parts:
+        if isinstance(part, str):
+            values.extend(json.loads(f"[{part}]"))
+        else:
+            values.extend(part if isinstance(part, list) else part.tolist())
+    return values
+
+
+def _numbers(s):
+    """
+    Consumes the leading run of plain numbers of an array, a window at a
+    time, without building Python objects for them. Returns (parts, done):
+    done is True if the run reached "]", otherwise s.pos is left at the
+    first element that isn't a plain number.
+    """
+    parts = []
+    while True:
+        end = _NUMERIC_RUN.match(s.buf, s.pos).end()
+        if end == len(s.buf) and not s.eof:
+            cut = s.buf.rfind(",", s.pos, end)
+            if cut > s.pos:
+                parts.append(_parse_numbers(s, s.pos, cut))
+                s.pos = cut + 1
+            s.fill()
+            continue
+        if end < len(s.buf) and s.buf[end] == "]":
+            if s.buf[s.pos:end].strip():
+                parts.append(_parse_numbers(s, s.pos, end))
+            elif parts:
+                raise s.error("Trailing comma in array")
+            s.pos = end + 1
+            return parts, True
+        cut = s.buf.rfind(",", s.pos, end)
+        if cut > s.pos:
+            parts.append(_parse_numbers(s, s.pos, cut))
+            s.pos = cut + 1
+        return parts, False
+
+
+def _string(s):
+    while True:
+        try:
+            text, s.pos = scanstring(s.buf, s.pos + 1)
+            return text
+        except JSONDecodeError:
+            if not s.fill():
+                raise
+
+
+def _object(s):
+    s.pos += 1
+    obj = {}
+    if s.peek() == "}":
+        s.pos += 1
+        return obj
+    while True:
+        if s.peek() != '"':
+            raise s.error("Expecting property name enclosed in double quotes")
+        key = _string(s)
+        if s.peek() != ":":
+            raise s.error("Expecting ':' delimiter")
+        s.pos += 1
+        obj[key] = _value(s)
+        c = s.peek()
+        if c == "}":
+            s.pos += 1
+            return obj
+        if c != ",":
+            raise s.error("Expecting ',' delimiter")
+        s.pos += 1
+
+
+def _array(s):
+    s.pos += 1
+    if s.peek() == "]":
+        s.pos += 1
+        return []
+    items = []
+    if s.peek() in "-0123456789":
+        parts, done = _numbers(s)
+        if done:
+            return _join_numbers(parts, whole=True)
+        items = _join_numbers(parts, whole=False)
+    while True:
+        items.append(_value(s))
+        c = s.peek()
+        if c == "]":
+            s.pos += 1
+            return _as_array(items)
+        if c != ",":
+            raise s.error("Expecting ',' delimiter")
+        s.pos += 1
+
+
+def _value(s):
+    c = s.peek()
+    if not c:
+        raise s.error("Expecting value")
+    # Anything complete in the window goes through the C decoder; only
+    # containers larger than the window are walked here.
+    while True:
+        start = s.pos
+        try:
+            value, end = _decoder.raw_decode(s.buf, start)
+        except JSONDecodeError:
+            if s.eof:
+                raise
+            if c in "[{":
+                break
+            s.fill()
+            continue
+        if c in "-0123456789" and not s.eof and _NUMBER_CHARS.match(s.buf, end).end() == len(s.buf):
+            s.fill()  # the number may continue in the next chunk
+            continue
+        s.pos = end
+        if isinstance(value, (dict, list)) and end - start >= 2 * ARRAY_MIN_ITEMS:
+            value = _arrays(value)
+        return value
+    return _object(s) if c == "{" else _array(s)
+
+
+def load(chunks):
+    """
+    Decodes one JSON document from an iterable of byte chunks (e.g. an S3
+    body's iter_chunks()), holding only a window of the text at a time.
+    An array of at least ARRAY_MIN_ITEMS numbers, or a rectangular nest
+    of such arrays, comes back as an ndarray: int64 if every number is an
+    integer, float64 otherwise, and a plain list whenever that dtype can't
+    hold every value exactly (see _numeric). Long runs of numbers are
+    parsed straight into them without creating Python numbers.
+    Everything else, including every number outside such an array,
+    decodes exactly as json.loads would, wherever the chunks split.
+    Raises json.JSONDecodeError on malformed input.
+    """
+    s = _Stream(chunks)
+    value = _value(s)
+    if s.peek():
+        raise s.error("Extra data")
+    return value
+
+
+def to_json(obj):
+    """json.dumps `default` hook for values produced by load()."""
+    if hasattr(obj, "tolist"):
+        return obj.tolist()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def to_builtin(value):
+    """A copy of `value` with ndarrays turned back into lists (for BSON and friends)."""
+    if isinstance(value, dict):
+        return {key: to_builtin(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [to_builtin(item) for item in value]
+    if hasattr(value, "tolist") and hasattr(value, "dtype"):
+        return value.tolist()
+    return value
+
+
+def _summary(value, depth):
+    if hasattr(value, "dtype") and hasattr(value, "shape"):
+        return f"<ndarray {value.dtype} {tuple(value.shape)}>"
+    if isinstance(value, dict):
+        if depth >= 4:
+            return f"<dict of {len(value)} keys>"
+        summary = {key: _summary(item, depth + 1) for key, item in list(value.items())[:20]}
+        if len(value) > 20:
+            summary["..."] = f"{len(value) - 20} more keys"
+        return summary
+    if isinstance(value, list):
+        if depth >= 4 or len(value) > 8:
+            head = [_summary(item, depth + 1) for item in value[:3]] if depth < 4 else []
+            return head + [f"... {len(value)} items"]
+        return [_summary(item, depth + 1) for item in value]
+    if isinstance(value, str) and len(value) > 80:
+        return f"{value[:60]}... ({len(value)} chars)"
+    return value
+
+
+def describe(value, limit=None):
+    """
+    A log-friendly JSON summary of a decoded input, at most `limit`
+    characters: arrays are shown by dtype and shape, long lists and strings
+    are elided, and only the first levels of nesting are expanded.
+    """
+    limit = limit or LOG_SUMMARY_CHARS
+    text = json.dumps(_summary(value, 0), default=str)
+    return text if len(text) <= limit else text[:limit - 3] + "..."
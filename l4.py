@@ -4,7 +4,7 @@
 import random
 import pytest
 
-from your_module import simulate_monty_hall
+from monty_hall import exact_win_rate, simulate_monty_hall
 
 def test_simulate_monty_hall_stay_reproducible():
     random.seed(123)
@@ -25,3 +25,19 @@ def test_simulate_monty_hall_zero_trials():
 def test_simulate_monty_hall_invalid_strategy():
     with pytest.raises(ValueError):
         simulate_monty_hall(trials=100, strategy="random_choice")
+
+def test_simulate_monty_hall_many_doors():
+    random.seed(123)
+    wins = simulate_monty_hall(trials=100000, strategy="switch", n_doors=10, opened=8)
+    assert abs(wins / 100000 - exact_win_rate("switch", n_doors=10, opened=8)) < 0.01
+
+def test_simulate_monty_hall_confidence_interval():
+    wins, (low, high) = simulate_monty_hall(trials=10000, strategy="stay", seed=1, confidence=0.99)
+    assert low < wins / 10000 < high
+    assert low < 1/3 < high
+
+def test_simulate_monty_hall_seeded_runs_match():
+    random.seed(7)
+    first = simulate_monty_hall(trials=5000, strategy="switch")
+    random.seed(7)
+    assert simulate_monty_hall(trials=5000, strategy="switch") == first
@@ -2,58 +2,216 @@
 
 
 
+
 import json
-import boto3
 import os
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote_plus
 
-def lambda_handler(event, context):
-    print("=" * 40)
-    print("📦 Lambda LIGHT invoked")
-    print("🔍 Raw event:\n", json.dumps(event, indent=2))
+import coldstart
 
-    try:
-        record = event['Records'][0]
-        bucket = record['s3']['bucket']['name']
-        key = record['s3']['object']['key']
-        print(f"🧾 File uploaded: s3://{bucket}/{key}")
-    except Exception as e:
-        print("❌ Failed to parse S3 event")
-        print(str(e))
-        return {"error": "bad_event_format"}
+startup = coldstart.Startup("light")
 
-    if not key.endswith(".json"):
-        print("⚠️ Skipping non-JSON file.")
-        return {"status": "skipped", "reason": "non-json file"}
+import backends
+import metrics
 
-    try:
-        heavy_fn = os.environ.get("HEAVY_FUNCTION_NAME")
-        if not heavy_fn:
-            print("❌ HEAVY_FUNCTION_NAME not set")
-            return {"error": "missing_env"}
+lambda_client = backends.client("lambda")
+s3 = backends.client("s3")
+
+DISPATCH_BATCH_SIZE = int(os.environ.get("DISPATCH_BATCH_SIZE", "10"))
+DISPATCH_WORKERS = int(os.environ.get("DISPATCH_WORKERS", "8"))
+# Jobs whose estimated cost (Lambda_heavy.estimate_cost) is at most
+# INLINE_MAX_COST run here instead of in the heavy function; 0 disables.
+INLINE_MAX_COST = float(os.environ.get("INLINE_MAX_COST", "4e6"))
+INLINE_PEEK_BYTES = int(os.environ.get("INLINE_PEEK_BYTES", str(64 * 1024)))
+
+
+def parse_records(event):
+    """
+    Extracts (bucket, key) pairs from every record of an S3 notification.
+    Keys arrive URL-encoded in notifications and are decoded here.
+    Raises KeyError/TypeError if the event isn't an S3 notification.
+    """
+    return [
+        (record['s3']['bucket']['name'], unquote_plus(record['s3']['object']['key']))
+        for record in event['Records']
+    ]
 
-        print(f"🚀 Invoking heavy lambda: {heavy_fn}")
-        lambda_client = boto3.client("lambda")
+
+def make_batches(objects, batch_size):
+    """
+    Groups (bucket, key) pairs into per-bucket batches of at most
+    `batch_size` keys, preserving upload order within each bucket.
+    """
+    by_bucket = {}
+    for bucket, key in objects:
+        by_bucket.setdefault(bucket, []).append(key)
+
+    batches = []
+    for bucket, keys in by_bucket.items():
+        for i in range(0, len(keys), batch_size):
+            batches.append((bucket, keys[i:i + batch_size]))
+    return batches
+
+
+def invoke_batch(heavy_fn, bucket, keys, recorder=None):
+    recorder = recorder or metrics.StageRecorder("light")
+    if len(keys) == 1:
+        payload = {"bucket": bucket, "key": keys[0]}
+    else:
+        payload = {"bucket": bucket, "keys": keys}
+    body = json.dumps(payload)
+
+    with recorder.stage("dispatch", keys=keys, bytes=len(body)):
         response = lambda_client.invoke(
             FunctionName=heavy_fn,
             InvocationType="Event",  # async
-            Payload=json.dumps({"bucket": bucket, "key": key})
+            Payload=body
         )
+    return response["StatusCode"]
 
-        print("✅ Invocation complete. StatusCode:", response['StatusCode'])
-        return {
-            "status": "triggered",
-            "bucket": bucket,
-            "key": key,
-            "invoke_status": response["StatusCode"]
-        }
 
+def peek_input(bucket, key, recorder):
+    """
+    Reads at most INLINE_PEEK_BYTES of an input with a ranged GET. Returns
+    the decoded input if the whole object fit, None if it's bigger.
+    """
+    with recorder.stage("peek") as stage:
+        response = s3.get_object(Bucket=bucket, Key=key, Range=f"bytes=0-{INLINE_PEEK_BYTES - 1}")
+        body = response['Body'].read()
+        stage["bytes"] = len(body)
+    total = int(response.get("ContentRange", f"/{len(body)}").rsplit("/", 1)[1])
+    if total > len(body):
+        return None
+    return json.loads(body)
+
+
+def run_inline(bucket, key):
+    """
+    Runs a cheap job through Lambda_heavy's compute/output path in this
+    invocation. Returns its result entry, or None when the job should be
+    dispatched: too big to peek, above INLINE_MAX_COST, split into tiles
+    (the heavy function coordinates fan-outs), or anything that went wrong
+    here (the heavy function then handles and reports it).
+    """
+    recorder = metrics.StageRecorder("light", key)
+    try:
+        input_data = peek_input(bucket, key, recorder)
+        if input_data is None:
+            return None
+        recorder.request_id = input_data.get("request_id")
+        heavy = coldstart.lazy_import("Lambda_heavy")
+        cost = heavy.estimate_cost(input_data.get("parameters"))
+        if cost > INLINE_MAX_COST or heavy.fanout_plan(input_data) is not None:
+            return None
+        entry = heavy.process_input(key, input_data, recorder)
+        return {"bucket": bucket, "key": key, "status": "inline", "cost": cost, "output_key": entry["output_key"]}
     except Exception as e:
-        print("❌ Failed to invoke heavy lambda")
-        print(str(e))
-        return {"error": "invoke_failed"}
+        print(f"⚠️ Inline run of {key} failed, dispatching instead: {e}")
+        return None
+    finally:
+        recorder.flush()
 
 
+@startup.handler
+def lambda_handler(event, context):
+    print("=" * 40)
+    print("📦 Lambda LIGHT invoked")
+    print("🔍 Raw event:\n", json.dumps(event, indent=2))
 
+    recorder = metrics.StageRecorder("light")
+    try:
+        return _dispatch(event, recorder)
+    finally:
+        recorder.flush()
+
+
+def _dispatch(event, recorder):
+    try:
+        with recorder.stage("event_parse") as stage:
+            objects = parse_records(event)
+            stage["records"] = len(objects)
+    except Exception as e:
+        print("❌ Failed to parse S3 event")
+        print(str(e))
+        return {"error": "bad_event_format"}
+
+    results = []
+    to_dispatch = []
+    for bucket, key in objects:
+        print(f"🧾 File uploaded: s3://{bucket}/{key}")
+        if key.endswith(".json"):
+            to_dispatch.append((bucket, key))
+        else:
+            print(f"⚠️ Skipping non-JSON file: {key}")
+            results.append({"bucket": bucket, "key": key, "status": "skipped", "reason": "non-json file"})
+
+    if not to_dispatch:
+        return {"status": "skipped", "reason": "non-json file", "results": results}
+
+    inline = 0
+    if INLINE_MAX_COST > 0:
+        with ThreadPoolExecutor(max_workers=max(1, min(DISPATCH_WORKERS, len(to_dispatch)))) as pool:
+            routed = list(zip(to_dispatch, pool.map(lambda obj: run_inline(*obj), to_dispatch)))
+        to_dispatch = [obj for obj, entry in routed if entry is None]
+        results.extend(entry for _, entry in routed if entry is not None)
+        inline = len(routed) - len(to_dispatch)
+        if inline:
+            heavy = coldstart.lazy_import("Lambda_heavy")
+            if heavy.result_sink is not None:
+                heavy.result_sink.flush()
+            print(f"⚡ Ran {inline} small jobs inline")
+        if not to_dispatch:
+            return {"status": "completed", "dispatched": 0, "inline": inline, "failed": 0, "results": results}
+
+    heavy_fn = os.environ.get("HEAVY_FUNCTION_NAME")
+    if not heavy_fn:
+        print("❌ HEAVY_FUNCTION_NAME not set")
+        return {"error": "missing_env"}
+
+    batches = make_batches(to_dispatch, max(1, DISPATCH_BATCH_SIZE))
+    print(f"🚀 Invoking heavy lambda {heavy_fn}: {len(to_dispatch)} keys in {len(batches)} batches")
+
+    with ThreadPoolExecutor(max_workers=max(1, min(DISPATCH_WORKERS, len(batches)))) as pool:
+        futures = [(bucket, keys, pool.submit(invoke_batch, heavy_fn, bucket, keys, recorder)) for bucket, keys in batches]
+
+        failed = 0
+        for bucket, keys, future in futures:
+            try:
+                status_code = future.result()
+                entries = [{"bucket": bucket, "key": key, "status": "triggered", "invoke_status": status_code} for key in keys]
+            except Exception as e:
+                print(f"❌ Failed to invoke heavy lambda for {len(keys)} keys in {bucket}")
+                print(str(e))
+                failed += len(keys)
+                entries = [{"bucket": bucket, "key": key, "status": "error", "error": "invoke_failed"} for key in keys]
+            results.extend(entries)
+
+    print(f"✅ Invocations complete. {len(to_dispatch) - failed} dispatched, {failed} failed")
+    return {
+        "status": "triggered" if not failed else "partial_failure",
+        "dispatched": len(to_dispatch) - failed,
+        "inline": inline,
+        "failed": failed,
+        "results": results
+    }
+
+
+if coldstart.COLD_START_MODE == "eager":
+    backends.warm("lambda", "s3")
+
+startup.init_done()
+
+
+
+
+
+try:
+    from langchain_core.tools import tool
+except ImportError:
+    # Without LangChain installed analyze_pr stays a plain function.
+    def tool(fn):
+        return fn
 
 
 @tool
@@ -67,4 +225,19 @@ def analyze_pr(diff_input: str) -> str:
           – "code": the cleaned, runnable Python source for that file
     Input: diff_input (raw unified-diff text)
     Output: JSON string as specified above
+
+    Base sources are read from PR_BASE_DIR (default: the working
+    directory). New files are rebuilt from the diff alone. Files that
+    couldn't be fully patched (no base to apply to, or hunks that don't
+    match it) are left out of "files" and counted in the summary.
     """
+    import diffpatch
+
+    results = diffpatch.apply_diff(diff_input, diffpatch.directory_loader(os.environ.get("PR_BASE_DIR", ".")))
+    files = [
+        {"filename": result["filename"], "code": result["code"]}
+        for _, result in results
+        if result["filename"].endswith(".py") and result["status"] in ("applied", "new")
+    ]
+    summary = diffpatch.summarize(results, diffpatch.subject(diff_input))
+    return json.dumps({"summary": summary, "files": files})
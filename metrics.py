@@ -0,0 +1,161 @@
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+# "json" prints one flat JSON object per stage, "emf" wraps the same fields
+# in CloudWatch Embedded Metric Format, "off" disables emission.
+METRICS_FORMAT = os.environ.get("METRICS_FORMAT", "json")
+METRICS_NAMESPACE = os.environ.get("METRICS_NAMESPACE", "AWSxAgent/Pipeline")
+METRIC_NAME = "pipeline_stage"
+
+
+class StageRecorder:
+    """
+    Times the stages of one unit of work (an invocation or a job) and emits
+    them together on flush(), tagged with `function`, the S3 `key` and the
+    job's `request_id` (which is often only known after the input is read).
+    """
+
+    def __init__(self, function, key=None, request_id=None):
+        self.function = function
+        self.key = key
+        self.request_id = request_id
+        self.records = []
+
+    @contextmanager
+    def stage(self, name, started=None, **fields):
+        """
+        Times the enclosed block as stage `name`. The yielded dict can be
+        updated with extra fields such as `bytes`. `started` (a
+        time.perf_counter() value) backdates the stage's start, e.g. to
+        when a job was scheduled rather than when it got a worker.
+        """
+        record = {"stage": name, **fields}
+        start = time.perf_counter() if started is None else started
+        try:
+            yield record
+        finally:
+            record["duration_ms"] = (time.perf_counter() - start) * 1000
+            self.records.append(record)
+
+    def durations(self):
+        return {record["stage"]: record["duration_ms"] for record in self.records}
+
+    def flush(self):
+        for record in self.records:
+            emit({
+                "function": self.function,
+                "request_id": self.request_id,
+                "key": self.key,
+                **record,
+            })
+        self.records = []
+
+
+def format_record(record, fmt=None):
+    fmt = fmt or METRICS_FORMAT
+    line = {"metric": METRIC_NAME, "timestamp": int(time.time() * 1000), **record}
+    if fmt == "emf":
+        metrics = [{"Name": "duration_ms", "Unit": "Milliseconds"}]
+        if "bytes" in record:
+            metrics.append({"Name": "bytes", "Unit": "Bytes"})
+        line["_aws"] = {
+            "Timestamp": line["timestamp"],
+            "CloudWatchMetrics": [{
+                "Namespace": METRICS_NAMESPACE,
+                "Dimensions": [["function", "stage"]],
+                "Metrics": metrics,
+            }],
+        }
+    return json.dumps(line, default=str)
+
+
+def emit(record):
+    if METRICS_FORMAT != "off":
+        print(format_record(record))
+
+
+def read_records(lines):
+    """
+    Yields the stage records found in log lines, in either format. Anything
+    before the first "{" on a line (log prefixes) is ignored, as are lines
+    that aren't stage records.
+    """
+    for line in lines:
+        start = line.find("{")
+        if start < 0:
+            continue
+        try:
+            record = json.loads(line[start:])
+        except ValueError:
+            continue
+        if isinstance(record, dict) and record.get("metric") == METRIC_NAME:
+            yield record
+
+
+def percentile(values, q):
+    """Linearly interpolated q-th percentile (0-100) of `values`."""
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    position = (len(ordered) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def summarize_latencies(values):
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "mean": sum(values) / len(values),
+        "min": min(values),
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": max(values),
+    }
+
+
+def summarize(records):
+    """
+    Aggregates stage records into per function/stage latency summaries (ms)
+    and byte totals, plus a per-request breakdown. Stages recorded without a
+    request_id (e.g. the light dispatcher's) are attributed through the S3
+    key they handled.
+    """
+    records = list(records)
+    request_for_key = {r["key"]: r["request_id"] for r in records if r.get("key") and r.get("request_id")}
+
+    durations, byte_totals, requests = {}, {}, {}
+    for r in records:
+        name = f"{r.get('function')}.{r['stage']}"
+        durations.setdefault(name, []).append(r["duration_ms"])
+        if "bytes" in r:
+            byte_totals[name] = byte_totals.get(name, 0) + r["bytes"]
+
+        keys = r.get("keys") or ([r["key"]] if r.get("key") else [])
+        request_ids = {r.get("request_id")} if r.get("request_id") else {request_for_key.get(k) for k in keys}
+        for request_id in request_ids - {None}:
+            stages = requests.setdefault(request_id, {})
+            stages[name] = stages.get(name, 0.0) + r["duration_ms"]
+
+    stages = {}
+    for name, values in sorted(durations.items()):
+        stages[name] = summarize_latencies(values)
+        if name in byte_totals:
+            stages[name]["bytes_total"] = byte_totals[name]
+    return {"records": len(records), "stages_ms": stages, "requests": requests}
+
+
+if __name__ == "__main__":
+    # python metrics.py [logfile ...]  (reads stdin without arguments)
+    paths = sys.argv[1:]
+    if paths:
+        lines = (line for path in paths for line in open(path))
+    else:
+        lines = sys.stdin
+    print(json.dumps(summarize(read_records(lines)), indent=2))
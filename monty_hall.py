@@ -0,0 +1,108 @@
+import random
+from statistics import NormalDist
+from typing import Any, Dict, Optional, Tuple, Union
+
+import numpy as np
+
+STRATEGIES = ("stay", "switch")
+BATCH_SIZE = 1_000_000  # trials drawn per NumPy call
+
+
+def exact_win_rate(strategy: str, n_doors: int = 3, opened: int = 1) -> float:
+    """
+    Closed-form win probability. Staying wins 1/n; switching wins when the
+    first pick was wrong ((n-1)/n) and the uniformly chosen switch target,
+    one of the n-1-k doors still closed, is the car.
+    """
+    _validate(1, strategy, n_doors, opened)
+    if strategy == "stay":
+        return 1 / n_doors
+    return (n_doors - 1) / (n_doors * (n_doors - 1 - opened))
+
+
+def _validate(trials: int, strategy: str, n_doors: int, opened: int) -> None:
+    if trials <= 0:
+        raise ValueError(f"trials must be positive, got {trials}")
+    if strategy not in STRATEGIES:
+        raise ValueError(f"Unknown strategy {strategy!r}; expected one of {STRATEGIES}")
+    if n_doors < 3:
+        raise ValueError(f"Need at least 3 doors, got {n_doors}")
+    if not 1 <= opened <= n_doors - 2:
+        raise ValueError(f"The host must open between 1 and {n_doors - 2} doors, got {opened}")
+
+
+def wilson_interval(wins: int, trials: int, confidence: float = 0.95) -> Tuple[float, float]:
+    """Wilson score interval for a win rate of wins/trials."""
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    p = wins / trials
+    denominator = 1 + z * z / trials
+    centre = (p + z * z / (2 * trials)) / denominator
+    margin = z * ((p * (1 - p) + z * z / (4 * trials)) / trials) ** 0.5 / denominator
+    return centre - margin, centre + margin
+
+
+def simulate_monty_hall(
+    trials: int,
+    strategy: str,
+    n_doors: int = 3,
+    opened: int = 1,
+    seed: Optional[int] = None,
+    confidence: Optional[float] = None
+) -> Union[int, Tuple[int, Tuple[float, float]]]:
+    """
+    Simulates the Monty Hall game and returns the number of wins.
+
+    Parameters:
+    - trials: number of games, must be positive
+    - strategy: "stay" or "switch"
+    - n_doors: doors in the game (3 for the classic version)
+    - opened: goat doors the host opens, neither the car nor the pick
+    - seed: seed for the NumPy generator; without one it is drawn from the
+      `random` module, so random.seed() makes runs reproducible
+    - confidence: also return the Wilson interval for the win rate at this
+      confidence level, as (wins, (low, high))
+
+    Games are simulated in batches of BATCH_SIZE with vectorized draws of
+    the car and the first pick. The host's choice never needs to be
+    materialized: after k goats are opened the switch target is uniform over
+    the n-1-k other closed doors, exactly one of which hides the car when
+    the first pick was wrong.
+    """
+    _validate(trials, strategy, n_doors, opened)
+    rng = np.random.default_rng(random.getrandbits(64) if seed is None else seed)
+
+    wins = 0
+    for start in range(0, trials, BATCH_SIZE):
+        size = min(BATCH_SIZE, trials - start)
+        car = rng.integers(n_doors, size=size)
+        pick = rng.integers(n_doors, size=size)
+        if strategy == "stay":
+            wins += int(np.count_nonzero(car == pick))
+        else:
+            target = rng.integers(n_doors - 1 - opened, size=size)
+            wins += int(np.count_nonzero((car != pick) & (target == 0)))
+
+    if confidence is not None:
+        return wins, wilson_interval(wins, trials, confidence)
+    return wins
+
+
+def benchmark(trials: int = 10_000_000, n_doors: int = 3, opened: int = 1) -> Dict[str, Any]:
+    """Trials per second for each strategy."""
+    import time
+
+    report = {"trials": trials, "n_doors": n_doors, "opened": opened}
+    for strategy in STRATEGIES:
+        start = time.perf_counter()
+        wins = simulate_monty_hall(trials, strategy, n_doors, opened, seed=0)
+        elapsed = time.perf_counter() - start
+        report[strategy] = {
+            "win_rate": wins / trials,
+            "exact": exact_win_rate(strategy, n_doors, opened),
+            "trials_per_s": trials / elapsed,
+        }
+    return report
+
+
+if __name__ == "__main__":
+    print(benchmark())
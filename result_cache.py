@@ -0,0 +1,158 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+
+def cache_key(obj):
+    """SHA-256 of the canonical JSON form of `obj` (sorted keys, no spaces)."""
+    canonical = json.dumps(obj, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """
+    Two-tier cache of JSON-serializable results.
+
+    Entries live in a bounded in-process LRU (survives across warm
+    invocations) and, when `s3`/`bucket` are given, under `prefix` in S3 so
+    other containers can reuse them. Both tiers honor `ttl_s`; the in-process
+    tier evicts least recently used entries once it holds more than
+    `max_bytes` of serialized results.
+
+    `max_bytes` only bounds the in-process tier. An expired S3 entry is
+    deleted when it is read, but entries that are never read again stay;
+    give the bucket a lifecycle rule that expires objects under `prefix`
+    after `ttl_s` to bound it.
+
+    The cache is best-effort: an S3 error on get, put or invalidate (e.g.
+    AccessDenied for a missing key without s3:ListBucket) is logged,
+    counted in `errors` and treated as a miss, never raised.
+    """
+
+    def __init__(self, s3=None, bucket=None, prefix="cache/", ttl_s=86400, max_bytes=64 * 1024 * 1024):
+        self.s3 = s3
+        self.bucket = bucket
+        self.prefix = prefix
+        self.ttl_s = ttl_s
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (created_at, serialized bytes)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.errors = 0
+
+    def _expired(self, created_at):
+        return self.ttl_s is not None and time.time() - created_at > self.ttl_s
+
+    def _remember(self, key, created_at, data):
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= len(self._entries.pop(key)[1])
+            if len(data) > self.max_bytes:
+                return
+            self._entries[key] = (created_at, data)
+            self._bytes += len(data)
+            while self._bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+                self.evictions += 1
+
+    def _forget(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._bytes -= len(entry[1])
+
+    def _get_local(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if self._expired(entry[0]):
+                self._entries.pop(key)
+                self._bytes -= len(entry[1])
+                self.expirations += 1
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def _failed(self, action, key, error):
+        with self._lock:
+            self.errors += 1
+        print(f"⚠️ Result cache {action} of {key[:12]} failed, ignoring: {error}")
+
+    def _get_remote(self, key):
+        if self.s3 is None:
+            return None
+        try:
+            response = self.s3.get_object(Bucket=self.bucket, Key=self.prefix + key + ".json")
+            stored = json.loads(response['Body'].read())
+        except self.s3.exceptions.NoSuchKey:
+            return None
+        except Exception as e:
+            self._failed("read", key, e)
+            return None
+        if self._expired(stored["created_at"]):
+            with self._lock:
+                self.expirations += 1
+            self._delete_remote(key)
+            return None
+        data = json.dumps(stored["result"]).encode("utf-8")
+        self._remember(key, stored["created_at"], data)
+        return data
+
+    def get(self, key):
+        """Returns the cached result for `key`, or None on a miss."""
+        data = self._get_local(key)
+        if data is None:
+            data = self._get_remote(key)
+        with self._lock:
+            if data is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(data)
+
+    def put(self, key, result):
+        created_at = time.time()
+        data = json.dumps(result).encode("utf-8")
+        self._remember(key, created_at, data)
+        if self.s3 is None:
+            return
+        try:
+            self.s3.put_object(
+                Bucket=self.bucket,
+                Key=self.prefix + key + ".json",
+                Body=json.dumps({"created_at": created_at, "result": result}),
+                ContentType="application/json"
+            )
+        except Exception as e:
+            self._failed("write", key, e)
+
+    def _delete_remote(self, key):
+        try:
+            self.s3.delete_object(Bucket=self.bucket, Key=self.prefix + key + ".json")
+        except Exception as e:
+            self._failed("delete", key, e)
+
+    def invalidate(self, key):
+        self._forget(key)
+        if self.s3 is not None:
+            self._delete_remote(key)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "errors": self.errors,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+            }
@@ -0,0 +1,104 @@
+import os
+import threading
+import time
+
+import metrics
+
+MONGO_URI = os.environ.get("MONGO_URI")
+MONGO_DB = os.environ.get("MONGO_DB", "pipeline")
+MONGO_RESULTS_COLLECTION = os.environ.get("MONGO_RESULTS_COLLECTION", "results")
+RESULT_SINK_MAX_RECORDS = int(os.environ.get("RESULT_SINK_MAX_RECORDS", "100"))
+RESULT_SINK_MAX_BYTES = int(os.environ.get("RESULT_SINK_MAX_BYTES", str(4 * 1024 * 1024)))
+RESULT_SINK_MAX_AGE_S = float(os.environ.get("RESULT_SINK_MAX_AGE_S", "5"))
+
+
+def mongo_writer(uri=None, db_name=None, collection_name=None):
+    """
+    Returns a write_batch(records) callable that inserts into Mongo through
+    database.insert_documents, on the process-wide pooled client from
+    database.get_client. The client is fetched on the first flush, so
+    pymongo stays out of the cold start when nothing is written.
+    """
+    uri = uri or MONGO_URI
+    db_name = db_name or MONGO_DB
+    collection_name = collection_name or MONGO_RESULTS_COLLECTION
+
+    def write_batch(records):
+        import database
+
+        database.insert_documents(database.get_client(uri)[db_name], collection_name, records)
+
+    return write_batch
+
+
+class ResultSink:
+    """
+    Write-behind buffer for result records.
+
+    add() queues a record and flushes once the buffer holds `max_records`
+    records, `max_bytes` bytes, or its oldest record is `max_age_s` old.
+    Handlers must call flush() before returning; nothing flushes in the
+    background because a frozen Lambda container can't run timers.
+    A failed flush is logged and counted, not raised: the S3 output is the
+    system of record and the sink only makes results queryable.
+    """
+
+    def __init__(self, write_batch, max_records=None, max_bytes=None, max_age_s=None):
+        self.write_batch = write_batch
+        self.max_records = max_records or RESULT_SINK_MAX_RECORDS
+        self.max_bytes = max_bytes or RESULT_SINK_MAX_BYTES
+        self.max_age_s = max_age_s if max_age_s is not None else RESULT_SINK_MAX_AGE_S
+        self._records = []
+        self._bytes = 0
+        self._oldest = None
+        self._lock = threading.Lock()
+        self.flushes = 0
+        self.written = 0
+        self.failed = 0
+
+    def add(self, record, size=0):
+        with self._lock:
+            self._records.append(record)
+            self._bytes += size
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            due = (
+                len(self._records) >= self.max_records
+                or self._bytes >= self.max_bytes
+                or time.monotonic() - self._oldest >= self.max_age_s
+            )
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            records, size = self._records, self._bytes
+            self._records, self._bytes, self._oldest = [], 0, None
+        if not records:
+            return 0
+
+        recorder = metrics.StageRecorder("heavy")
+        try:
+            with recorder.stage("sink_flush", records=len(records), bytes=size):
+                self.write_batch(records)
+        except Exception as e:
+            print(f"❌ Result sink flush of {len(records)} records failed: {e}")
+            with self._lock:
+                self.failed += len(records)
+            return 0
+        finally:
+            recorder.flush()
+
+        with self._lock:
+            self.flushes += 1
+            self.written += len(records)
+        return len(records)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "buffered": len(self._records),
+                "flushes": self.flushes,
+                "written": self.written,
+                "failed": self.failed,
+            }
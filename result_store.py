@@ -0,0 +1,219 @@
+import json
+import os
+import zipfile
+from contextlib import contextmanager
+
+PART_SIZE = int(os.environ.get("RESULT_PART_SIZE_MB", "8")) * 1024 * 1024  # S3 minimum is 5 MiB
+
+
+class MultipartWriter:
+    """
+    Write-only file object that streams to S3 in `part_size` parts.
+
+    Objects smaller than one part go up with a single put_object; larger
+    ones use a multipart upload, so at most one part is buffered in memory.
+    Use as a context manager: the upload is completed on a clean exit and
+    aborted if the block raises.
+    """
+
+    def __init__(self, s3, bucket, key, content_type="application/octet-stream", part_size=None):
+        self.s3 = s3
+        self.bucket = bucket
+        self.key = key
+        self.content_type = content_type
+        self.part_size = part_size or PART_SIZE
+        self.bytes_written = 0
+        self._buffer = bytearray()
+        self._upload_id = None
+        self._parts = []
+        self.closed = False
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._buffer += data
+        self.bytes_written += len(data)
+        while len(self._buffer) >= self.part_size:
+            self._upload_part(bytes(self._buffer[:self.part_size]))
+            del self._buffer[:self.part_size]
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def _upload_part(self, data):
+        if self._upload_id is None:
+            self._upload_id = self.s3.create_multipart_upload(
+                Bucket=self.bucket, Key=self.key, ContentType=self.content_type
+            )["UploadId"]
+        number = len(self._parts) + 1
+        response = self.s3.upload_part(
+            Bucket=self.bucket, Key=self.key, UploadId=self._upload_id,
+            PartNumber=number, Body=data
+        )
+        self._parts.append({"PartNumber": number, "ETag": response["ETag"]})
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self._upload_id is None:
+            self.s3.put_object(
+                Bucket=self.bucket, Key=self.key, Body=bytes(self._buffer),
+                ContentType=self.content_type
+            )
+        else:
+            if self._buffer:
+                self._upload_part(bytes(self._buffer))
+            self.s3.complete_multipart_upload(
+                Bucket=self.bucket, Key=self.key, UploadId=self._upload_id,
+                MultipartUpload={"Parts": self._parts}
+            )
+        self._buffer = bytearray()
+
+    def abort(self):
+        self.closed = True
+        if self._upload_id is not None:
+            self.s3.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id)
+        self._buffer = bytearray()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class NpyStream:
+    """
+    Writes one .npy array to `fileobj` block by block: the header goes out
+    first, then each C-ordered block of leading-axis rows as it is produced.
+    """
+
+    def __init__(self, fileobj, shape, dtype):
+        import numpy as np
+
+        self.fileobj = fileobj
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.rows_written = 0
+        np.lib.format.write_array_header_1_0(fileobj, {
+            "descr": np.lib.format.dtype_to_descr(self.dtype),
+            "fortran_order": False,
+            "shape": self.shape,
+        })
+
+    def write(self, block):
+        import numpy as np
+
+        block = np.ascontiguousarray(block, dtype=self.dtype)
+        if block.shape[1:] != self.shape[1:]:
+            raise ValueError(f"Block shape {block.shape} doesn't fit array shape {self.shape}")
+        self.fileobj.write(memoryview(block).cast("B"))
+        self.rows_written += block.shape[0] if block.ndim else 1
+
+    def finish(self):
+        expected = self.shape[0] if self.shape else 1
+        if self.rows_written != expected:
+            raise ValueError(f"Wrote {self.rows_written} rows, expected {expected}")
+
+
+class ResultArrays:
+    """
+    Streams the arrays of one result to S3 and collects their manifest entries.
+
+    - output_format "npy": each array is its own memory-mappable
+      `<base_key>/<name>.npy` object
+    - output_format "npz": all arrays go into one `<base_key>.npz`, deflated
+      if `compress` is set
+    Open arrays one at a time with array(); push row blocks into the
+    returned NpyStream as they are produced. .npy entries carry their own
+    size in "bytes"; an .npz's size is only known for the whole archive,
+    which close() records in `archive`.
+    """
+
+    def __init__(self, s3, bucket, base_key, output_format="npy", compress=False):
+        if output_format not in ("npy", "npz"):
+            raise ValueError(f"Unsupported output_format: {output_format}")
+        self.s3 = s3
+        self.bucket = bucket
+        self.base_key = base_key
+        self.output_format = output_format
+        self.compress = compress
+        self.entries = {}
+        self.archive = None
+        self._writer = None
+        self._archive = None
+        if output_format == "npz":
+            self._writer = MultipartWriter(s3, bucket, f"{base_key}.npz")
+            compression = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+            self._archive = zipfile.ZipFile(self._writer, "w", compression=compression)
+
+    @contextmanager
+    def array(self, name, shape, dtype):
+        if self._archive is not None:
+            with self._archive.open(f"{name}.npy", "w", force_zip64=True) as member:
+                stream = NpyStream(member, shape, dtype)
+                yield stream
+                stream.finish()
+            self.entries[name] = {"key": self._writer.key, "member": f"{name}.npy",
+                                  "shape": list(stream.shape), "dtype": str(stream.dtype)}
+            return
+
+        key = f"{self.base_key}/{name}.npy"
+        with MultipartWriter(self.s3, self.bucket, key) as writer:
+            stream = NpyStream(writer, shape, dtype)
+            yield stream
+            stream.finish()
+        self.entries[name] = {"key": key, "shape": list(stream.shape), "dtype": str(stream.dtype),
+                              "bytes": writer.bytes_written}
+
+    def close(self):
+        if self._archive is not None:
+            self._archive.close()
+            self._writer.close()
+            self.archive = {"key": self._writer.key, "bytes": self._writer.bytes_written}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        elif self._writer is not None:
+            self._writer.abort()
+
+
+def load_arrays(s3, bucket, manifest_key, directory, mmap=True):
+    """
+    Downloads the arrays listed in a result manifest into `directory` and
+    opens them. .npy arrays are memory-mapped read-only when `mmap` is set,
+    so only the pages a reader touches are loaded. Returns {name: array}.
+    """
+    import numpy as np
+
+    manifest = json.loads(s3.get_object(Bucket=bucket, Key=manifest_key)["Body"].read())
+    os.makedirs(directory, exist_ok=True)
+
+    downloaded = {}
+    arrays = {}
+    for name, entry in manifest["arrays"].items():
+        key = entry["key"]
+        if key not in downloaded:
+            path = os.path.join(directory, os.path.basename(key))
+            body = s3.get_object(Bucket=bucket, Key=key)["Body"]
+            with open(path, "wb") as f:
+                for chunk in body.iter_chunks(1024 * 1024):
+                    f.write(chunk)
+            downloaded[key] = path
+        path = downloaded[key]
+        if "member" in entry:
+            with np.load(path) as archive:
+                arrays[name] = archive[entry["member"][:-4]]
+        else:
+            arrays[name] = np.load(path, mmap_mode="r" if mmap else None)
+    return arrays
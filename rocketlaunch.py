@@ -1,5 +1,7 @@
 import math
 from typing import Dict, Any
+import numpy as np
+from numpy.typing import ArrayLike
 from pymongo import MongoClient, errors
 
 def simulate_rocket_launch(thrust: float, mass: float, burn_time: float, dt: float = 0.1) -> float:
@@ -23,3 +25,274 @@ def simulate_rocket_launch(thrust: float, mass: float, burn_time: float, dt: flo
     if velocity > 0:
         altitude += (velocity**2) / (2 * g)
     return altitude
+
+
+def simulate_rocket_launch_batch(
+    thrust: ArrayLike,
+    mass: ArrayLike,
+    burn_time: ArrayLike,
+    dt: float = 0.1,
+    method: str = "closed"
+) -> np.ndarray:
+    """
+    Evaluates simulate_rocket_launch for whole arrays of parameters at once.
+    Returns an array of maximum altitudes (in meters) with the broadcast
+    shape of the inputs.
+
+    Parameters:
+    - thrust, mass, burn_time: scalars or arrays, broadcast against each other
+    - dt: simulation time step in seconds (shared by every evaluation)
+    - method: "closed" uses the exact sum of the Euler steps; "step" runs the
+      same Euler loop vectorized across the batch (useful as a cross-check,
+      costs one pass per step of the longest burn)
+    """
+    g = 9.81
+    thrust, mass, burn_time = np.broadcast_arrays(
+        np.asarray(thrust, dtype=float), np.asarray(mass, dtype=float), np.asarray(burn_time, dtype=float)
+    )
+    acceleration = thrust / mass - g
+    # Same step count as range(int(burn_time / dt)): truncate, never negative.
+    steps = np.maximum(np.trunc(burn_time / dt), 0)
+
+    if method == "closed":
+        # After n Euler steps: v = n*a*dt and h = a*dt^2 * n(n+1)/2.
+        velocity = steps * acceleration * dt
+        altitude = acceleration * dt * dt * steps * (steps + 1) / 2
+    elif method == "step":
+        velocity = np.zeros_like(acceleration)
+        altitude = np.zeros_like(acceleration)
+        for i in range(int(steps.max(initial=0))):
+            active = steps > i
+            velocity += np.where(active, acceleration * dt, 0.0)
+            altitude += np.where(active, velocity * dt, 0.0)
+    else:
+        raise ValueError(f"Unknown method: {method}")
+
+    coast = np.where(velocity > 0, velocity**2 / (2 * g), 0.0)
+    return altitude + coast
+
+
+G0 = 9.81  # gravity (m/s²)
+RHO0 = 1.225  # sea-level air density (kg/m³)
+SCALE_HEIGHT = 8500.0  # exponential atmosphere scale height (m)
+
+# Dormand-Prince 5(4) tableau: nodes, stage weights, 5th-order solution
+# weights and (5th - 4th order) error weights.
+_DP_C = (0.0, 1 / 5, 3 / 10, 4 / 5, 8 / 9, 1.0, 1.0)
+_DP_A = (
+    (),
+    (1 / 5,),
+    (3 / 40, 9 / 40),
+    (44 / 45, -56 / 15, 32 / 9),
+    (19372 / 6561, -25360 / 2187, 64448 / 6561, -212 / 729),
+    (9017 / 3168, -355 / 33, 46732 / 5247, 49 / 176, -5103 / 18656),
+    (35 / 384, 0.0, 500 / 1113, 125 / 192, -2187 / 6784, 11 / 84),
+)
+_DP_B = (35 / 384, 0.0, 500 / 1113, 125 / 192, -2187 / 6784, 11 / 84, 0.0)
+_DP_E = (71 / 57600, 0.0, -71 / 16695, 71 / 1920, -17253 / 339200, 22 / 525, -1 / 40)
+
+
+def _flight_acceleration(t, altitude, velocity, thrust, dry_mass, propellant_mass, burn_time, drag_area):
+    """Net vertical acceleration of the variable-mass, drag-aware model."""
+    if t < burn_time:
+        mass = dry_mass + propellant_mass * (1 - t / burn_time)
+        force = thrust
+    else:
+        mass = dry_mass
+        force = 0.0
+    if drag_area:
+        density = RHO0 * math.exp(-max(altitude, 0.0) / SCALE_HEIGHT)
+        force -= 0.5 * density * drag_area * velocity * abs(velocity)
+    acceleration = force / mass - G0
+    if altitude <= 0.0 and velocity <= 0.0 and acceleration < 0.0:
+        return 0.0  # sitting on the pad until thrust exceeds weight
+    return acceleration
+
+
+def _dp_step(t, y, h, args):
+    """One Dormand-Prince step from state y = (altitude, velocity)."""
+    k = []
+    for c, row in zip(_DP_C, _DP_A):
+        alt = y[0] + h * sum(a * ki[0] for a, ki in zip(row, k))
+        vel = y[1] + h * sum(a * ki[1] for a, ki in zip(row, k))
+        k.append((vel, _flight_acceleration(t + c * h, alt, vel, *args)))
+    new = (y[0] + h * sum(b * ki[0] for b, ki in zip(_DP_B, k)),
+           y[1] + h * sum(b * ki[1] for b, ki in zip(_DP_B, k)))
+    err = (h * sum(e * ki[0] for e, ki in zip(_DP_E, k)),
+           h * sum(e * ki[1] for e, ki in zip(_DP_E, k)))
+    return new, err
+
+
+class _Trajectory:
+    """Time/altitude/velocity samples in preallocated arrays that double when full."""
+
+    def __init__(self, capacity=1024):
+        self.size = 0
+        self.data = np.empty((3, capacity))
+
+    def append(self, t, altitude, velocity):
+        if self.size == self.data.shape[1]:
+            grown = np.empty((3, 2 * self.size))
+            grown[:, :self.size] = self.data
+            self.data = grown
+        self.data[:, self.size] = (t, altitude, velocity)
+        self.size += 1
+
+    def arrays(self):
+        return {name: self.data[i, :self.size] for i, name in enumerate(("time", "altitude", "velocity"))}
+
+
+def simulate_rocket_flight(
+    thrust: float,
+    dry_mass: float,
+    propellant_mass: float,
+    burn_time: float,
+    drag_coefficient: float = 0.0,
+    area: float = 0.0,
+    rtol: float = 1e-6,
+    atol: float = 1e-6,
+    max_steps: int = 100000,
+    record_trajectory: bool = False
+) -> Dict[str, Any]:
+    """
+    Simulates a vertical launch with propellant burn-off and altitude-dependent
+    drag, integrated to apogee with an adaptive Dormand-Prince 5(4) method.
+    Returns a dict with max_altitude (m), apogee_time (s), steps and
+    rejected_steps, plus a "trajectory" dict of time/altitude/velocity arrays
+    (one sample per accepted step) when record_trajectory is set.
+
+    Parameters:
+    - thrust: constant thrust force in newtons while propellant lasts
+    - dry_mass: mass without propellant in kilograms
+    - propellant_mass: propellant burnt at a constant rate over burn_time
+    - burn_time: duration of thrust in seconds
+    - drag_coefficient, area: drag is 0.5 * rho(h) * Cd * A * v|v| with an
+      exponential atmosphere rho(h) = 1.225 * exp(-h / 8500)
+    - rtol, atol: per-step error tolerance on altitude and velocity
+    - max_steps: safety cap on accepted + rejected steps
+    - record_trajectory: also return the sampled path
+    With zero drag and zero propellant this is the continuous-time version
+    of simulate_rocket_launch's model, without its Euler error.
+    """
+    if dry_mass <= 0 or propellant_mass < 0 or burn_time < 0:
+        raise ValueError("dry_mass must be positive; propellant_mass and burn_time non-negative")
+
+    args = (thrust, dry_mass, propellant_mass, burn_time, drag_coefficient * area)
+    trajectory = _Trajectory() if record_trajectory else None
+    t, y = 0.0, (0.0, 0.0)
+    if trajectory is not None:
+        trajectory.append(t, *y)
+
+    h = min(burn_time, 1.0) / 100 if burn_time > 0 else 0.01
+    steps = rejected = 0
+    burning = burn_time > 0
+    while steps + rejected < max_steps:
+        # Never step across burnout: the thrust discontinuity would wreck the error estimate.
+        step = min(h, burn_time - t) if burning else h
+        new, err = _dp_step(t, y, step, args)
+        scale = max(abs(e) / (atol + rtol * max(abs(a), abs(b))) for e, a, b in zip(err, y, new))
+        if scale > 1.0:
+            rejected += 1
+            h = step * max(0.2, 0.9 * scale ** -0.2)
+            continue
+
+        if not burning and new[1] < 0.0 and y[1] >= 0.0:
+            # Apogee inside this step: Newton on the step length for v = 0.
+            s = step * y[1] / (y[1] - new[1])
+            for _ in range(4):
+                point, _ = _dp_step(t, y, s, args)
+                s -= point[1] / _flight_acceleration(t + s, point[0], point[1], *args)
+            new, step = _dp_step(t, y, s, args)[0], s
+
+        t, y = t + step, new
+        steps += 1
+        if trajectory is not None:
+            trajectory.append(t, *y)
+        if burning and t >= burn_time:
+            burning = False
+        elif not burning and y[1] <= 0.0:
+            break
+        h = step * min(5.0, 0.9 * max(scale, 1e-10) ** -0.2)
+    else:
+        raise RuntimeError(f"No apogee within {max_steps} steps")
+
+    result = {"max_altitude": y[0], "apogee_time": t, "steps": steps, "rejected_steps": rejected}
+    if trajectory is not None:
+        result["trajectory"] = trajectory.arrays()
+    return result
+
+
+def _euler_flight(thrust, dry_mass, propellant_mass, burn_time, drag_area, dt):
+    """Fixed-step explicit Euler on the same model, for benchmarking only."""
+    args = (thrust, dry_mass, propellant_mass, burn_time, drag_area)
+    t, altitude, velocity, steps = 0.0, 0.0, 0.0, 0
+    while t < burn_time or velocity > 0.0:
+        acceleration = _flight_acceleration(t, altitude, velocity, *args)
+        velocity += acceleration * dt
+        altitude += velocity * dt
+        t += dt
+        steps += 1
+    return altitude, steps
+
+
+def benchmark_flight(tolerance: float = 1e-6) -> Dict[str, Any]:
+    """
+    Compares adaptive integration of a drag-aware, variable-mass launch with
+    fixed-step Euler: steps needed and error against a tight-tolerance
+    reference, for a few Euler step sizes.
+    """
+    import time
+
+    case = dict(thrust=3.0e4, dry_mass=400.0, propellant_mass=600.0, burn_time=25.0,
+                drag_coefficient=0.4, area=0.3)
+    reference = simulate_rocket_flight(**case, rtol=1e-12, atol=1e-12)["max_altitude"]
+
+    start = time.perf_counter()
+    adaptive = simulate_rocket_flight(**case, rtol=tolerance, atol=tolerance)
+    report = {
+        "reference_altitude": reference,
+        "adaptive": {
+            "steps": adaptive["steps"] + adaptive["rejected_steps"],
+            "error": abs(adaptive["max_altitude"] - reference),
+            "seconds": time.perf_counter() - start,
+        },
+    }
+    for dt in (0.1, 0.01, 0.001):
+        start = time.perf_counter()
+        altitude, steps = _euler_flight(case["thrust"], case["dry_mass"], case["propellant_mass"],
+                                        case["burn_time"], case["drag_coefficient"] * case["area"], dt)
+        report[f"euler_dt_{dt}"] = {"steps": steps, "error": abs(altitude - reference),
+                                    "seconds": time.perf_counter() - start}
+    return report
+
+
+def benchmark(n: int = 20000, dt: float = 0.1, seed: int = 0) -> Dict[str, Any]:
+    """
+    Times the scalar loop against both batch methods on `n` random
+    (thrust, mass, burn_time) triples and checks they agree.
+    """
+    import time
+
+    rng = np.random.default_rng(seed)
+    thrust = rng.uniform(5e3, 5e4, n)
+    mass = rng.uniform(100, 1000, n)
+    burn_time = rng.uniform(1, 30, n)
+
+    start = time.perf_counter()
+    scalar = np.array([simulate_rocket_launch(t, m, b, dt) for t, m, b in zip(thrust, mass, burn_time)])
+    scalar_s = time.perf_counter() - start
+
+    report = {"n": n, "scalar_s": scalar_s}
+    for method in ("closed", "step"):
+        start = time.perf_counter()
+        batch = simulate_rocket_launch_batch(thrust, mass, burn_time, dt, method=method)
+        elapsed = time.perf_counter() - start
+        report[f"{method}_s"] = elapsed
+        report[f"{method}_speedup"] = scalar_s / elapsed
+        report[f"{method}_max_rel_error"] = float(np.max(np.abs(batch - scalar) / np.maximum(np.abs(scalar), 1.0)))
+    return report
+
+
+if __name__ == "__main__":
+    print(benchmark())
+    print(benchmark_flight())
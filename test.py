@@ -1,17 +1,38 @@
+import argparse
 import json
-import boto3
+import os
 import time
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
+import backends
+import metrics
+
 INPUT_BUCKET = "f1p1-input-bucket"
 OUTPUT_BUCKET = "f1p1-output-bucket"
 LIGHT_LAMBDA_NAME = "lambda-light-function-name"  # Replace with actual name
+HEAVY_LAMBDA_NAME = os.environ.get("HEAVY_FUNCTION_NAME", "lambda-heavy-function-name")
 RESULT_WAIT_TIMEOUT = 60  # seconds
-POLL_INTERVAL = 5  # seconds
+POLL_INTERVAL = 5  # seconds, upper bound for the backoff below
+POLL_INITIAL_INTERVAL = 0.05  # seconds
+POLL_BACKOFF = 1.5
+
+s3 = backends.client("s3")
+lambda_client = backends.client("lambda")
+
 
-s3 = boto3.client("s3")
-lambda_client = boto3.client("lambda")
+def register_local_functions():
+    """
+    Wires the light and heavy handlers into the local Lambda backend so the
+    whole pipeline runs in-process (PIPELINE_BACKEND=memory or filesystem).
+    """
+    import l7
+    import Lambda_heavy
+
+    os.environ.setdefault("HEAVY_FUNCTION_NAME", HEAVY_LAMBDA_NAME)
+    backends.register_function(LIGHT_LAMBDA_NAME, l7.lambda_handler)
+    backends.register_function(HEAVY_LAMBDA_NAME, Lambda_heavy.lambda_handler)
 
 
 def generate_input_payload(matrix_size=1000):
@@ -25,18 +46,20 @@ def generate_input_payload(matrix_size=1000):
     }
 
 
-def upload_input_file(payload, key):
+def upload_input_file(payload, key, verbose=True):
     s3.put_object(
         Bucket=INPUT_BUCKET,
         Key=key,
         Body=json.dumps(payload),
         ContentType="application/json"
     )
-    print(f"✅ Uploaded input to s3://{INPUT_BUCKET}/{key}")
+    if verbose:
+        print(f"✅ Uploaded input to s3://{INPUT_BUCKET}/{key}")
 
 
-def invoke_light_lambda(bucket, key):
-    print("🚀 Triggering LIGHT lambda manually (instead of S3 event)...")
+def invoke_light_lambda(bucket, key, verbose=True):
+    if verbose:
+        print("🚀 Triggering LIGHT lambda manually (instead of S3 event)...")
     response = lambda_client.invoke(
         FunctionName=LIGHT_LAMBDA_NAME,
         InvocationType="Event",  # async
@@ -49,28 +72,155 @@ def invoke_light_lambda(bucket, key):
             }]
         })
     )
-    print(f"✅ Lambda invocation status: {response['StatusCode']}")
+    if verbose:
+        print(f"✅ Lambda invocation status: {response['StatusCode']}")
 
 
-def poll_for_result(output_key):
-    print("⏳ Waiting for result...")
+def poll_for_result(output_key, timeout=RESULT_WAIT_TIMEOUT, verbose=True):
+    """
+    Waits for `output_key` to appear in the output bucket, polling with
+    exponential backoff from POLL_INITIAL_INTERVAL up to POLL_INTERVAL.
+    Returns the decoded result, or None on timeout.
+    """
+    if verbose:
+        print("⏳ Waiting for result...")
     start = time.time()
-    while time.time() - start < RESULT_WAIT_TIMEOUT:
+    interval = POLL_INITIAL_INTERVAL
+    while time.time() - start < timeout:
         try:
             response = s3.get_object(Bucket=OUTPUT_BUCKET, Key=output_key)
             result = json.loads(response['Body'].read())
-            print("🎉 Result retrieved:")
-            print(json.dumps(result, indent=2))
-            return
+            if verbose:
+                print("🎉 Result retrieved:")
+                print(json.dumps(result, indent=2))
+            return result
         except s3.exceptions.NoSuchKey:
-            print("🔄 Not ready yet, retrying...")
-            time.sleep(POLL_INTERVAL)
+            if verbose:
+                print("🔄 Not ready yet, retrying...")
+            remaining = timeout - (time.time() - start)
+            time.sleep(max(0, min(interval, remaining)))
+            interval = min(interval * POLL_BACKOFF, POLL_INTERVAL)
+
+    if verbose:
+        print("❌ Timeout: No result available after wait period.")
+    return None
+
+
+def run_job(matrix_size, timeout=RESULT_WAIT_TIMEOUT, scheduled=None):
+    """
+    Submits one job end to end and times each stage.
+    Returns a dict with per-stage durations in seconds and the outcome.
+    `scheduled` is the time.perf_counter() value the job was due to start
+    at; end_to_end is then measured from it, so time spent waiting for a
+    free worker counts (and is also reported as the queued stage).
+    """
+    input_key = f"scenario_inputs/load_job_{uuid.uuid4().hex}.json"
+    output_key = input_key.replace("scenario_inputs", "results")
+    payload = generate_input_payload(matrix_size)
+
+    recorder = metrics.StageRecorder("client", input_key, payload["request_id"])
+    if scheduled is not None:
+        with recorder.stage("queued", started=scheduled):
+            pass
+    try:
+        with recorder.stage("end_to_end", started=scheduled):
+            with recorder.stage("upload"):
+                upload_input_file(payload, input_key, verbose=False)
+            with recorder.stage("invoke"):
+                invoke_light_lambda(INPUT_BUCKET, input_key, verbose=False)
+            with recorder.stage("wait_for_result"):
+                result = poll_for_result(output_key, timeout=timeout, verbose=False)
+    except Exception as e:
+        status, error = "error", str(e)
+    else:
+        status, error = ("success" if result is not None else "timeout"), None
+
+    timings = {stage: ms / 1000 for stage, ms in recorder.durations().items()}
+    recorder.flush()
+    outcome = {"request_id": payload["request_id"], "status": status, "timings": timings}
+    if error:
+        outcome["error"] = error
+    return outcome
+
+
+def run_load_test(jobs, concurrency=10, rate=None, matrix_size=1000, timeout=RESULT_WAIT_TIMEOUT):
+    """
+    Submits `jobs` jobs and reports latency percentiles and throughput.
+
+    - concurrency: max jobs in flight at once
+    - rate: if set, jobs are started open-loop at this many per second
+      (still capped by `concurrency`); otherwise as fast as slots free up.
+      Latencies then run from each job's scheduled start, so jobs queued
+      behind a saturated pool aren't reported as fast.
+    Returns a JSON-serializable report.
+    """
+    print(f"🚀 Load test: {jobs} jobs, concurrency={concurrency}, rate={rate or 'unbounded'}")
+    outcomes = []
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = []
+        for i in range(jobs):
+            scheduled = None
+            if rate:
+                scheduled = start + i / rate
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            futures.append(pool.submit(run_job, matrix_size, timeout, scheduled))
+        for future in futures:
+            outcomes.append(future.result())
+    elapsed = time.perf_counter() - start
+
+    succeeded = [o for o in outcomes if o["status"] == "success"]
+    stages = {}
+    for outcome in succeeded:
+        for stage, seconds in outcome["timings"].items():
+            stages.setdefault(stage, []).append(seconds)
+
+    report = {
+        "jobs": jobs,
+        "succeeded": len(succeeded),
+        "timed_out": sum(1 for o in outcomes if o["status"] == "timeout"),
+        "failed": sum(1 for o in outcomes if o["status"] == "error"),
+        "concurrency": concurrency,
+        "rate": rate,
+        "matrix_size": matrix_size,
+        "backend": backends.BACKEND,
+        "duration_s": elapsed,
+        "throughput_jobs_per_s": len(succeeded) / elapsed if elapsed else None,
+        "latency_s": {stage: metrics.summarize_latencies(values) for stage, values in stages.items()},
+    }
+    print(f"✅ Load test done: {report['succeeded']}/{jobs} succeeded in {elapsed:.2f}s")
+    return report
+
 
-    print("❌ Timeout: No result available after wait period.")
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Submit jobs to the light/heavy pipeline.")
+    parser.add_argument("--jobs", type=int, default=1, help="number of jobs; >1 runs a load test")
+    parser.add_argument("--concurrency", type=int, default=10, help="max jobs in flight")
+    parser.add_argument("--rate", type=float, default=None, help="jobs started per second")
+    parser.add_argument("--matrix-size", type=int, default=1000)
+    parser.add_argument("--timeout", type=float, default=RESULT_WAIT_TIMEOUT, help="per-job result timeout (s)")
+    parser.add_argument("--report", default=None, help="write the JSON report here instead of stdout")
+    return parser.parse_args(argv)
 
 
-def main():
-    matrix_size = 1000
+def main(argv=None):
+    args = parse_args(argv)
+    if backends.is_local():
+        register_local_functions()
+
+    if args.jobs > 1 or args.report:
+        report = run_load_test(args.jobs, args.concurrency, args.rate, args.matrix_size, args.timeout)
+        if args.report:
+            with open(args.report, "w") as f:
+                json.dump(report, f, indent=2)
+            print(f"📝 Report written to {args.report}")
+        else:
+            print(json.dumps(report, indent=2))
+        return
+
+    matrix_size = args.matrix_size
     input_key = f"scenario_inputs/test_job_{uuid.uuid4().hex[:6]}.json"
     output_key = input_key.replace("scenario_inputs", "results")
 
@@ -80,7 +230,1170 @@ def main():
 
     invoke_light_lambda(INPUT_BUCKET, input_key)
 
-    poll_for_result(output_key)
+    poll_for_result(output_key, args.timeout)
+
+
+# Unit tests for the pipeline, run with `python -m pytest -q test.py`. They
+# use the in-memory backend and never touch AWS.
+
+def local_heavy(monkeypatch):
+    """Lambda_heavy on a fresh in-memory backend, with the result cache off."""
+    backends.configure("memory")
+    import Lambda_heavy
+
+    monkeypatch.setattr(Lambda_heavy, "RESULT_CACHE_ENABLED", False)
+    monkeypatch.setattr(Lambda_heavy, "result_sink", None)
+    return Lambda_heavy
+
+
+def direct_product(heavy, size, seed, dtype="float64"):
+    """A @ B built in one go from the same seeded panels the engine uses."""
+    heavy.load_numpy()
+    panels = range(heavy._panel_count(size))
+    A = heavy.np.concatenate([heavy._panel(seed, 0, p, size, dtype) for p in panels])
+    B = heavy.np.concatenate([heavy._panel(seed, 1, p, size, dtype) for p in panels])
+    return A.astype("float64") @ B.astype("float64")
+
+
+def test_summary_statistics_match_direct_product(monkeypatch):
+    heavy = local_heavy(monkeypatch)
+    C = direct_product(heavy, 150, seed=3)
+    result = heavy.heavy_computation({"matrix_size": 150, "seed": 3})
+    assert result["method"] == "summary"
+    assert abs(result["sum"] - C.sum()) <= 1e-9 * abs(C.sum())
+    assert abs(result["mean"] - C.mean()) <= 1e-9 * abs(C.mean())
+
+
+def test_tiled_statistics_match_direct_product(monkeypatch):
+    heavy = local_heavy(monkeypatch)
+    C = direct_product(heavy, 150, seed=4)
+    statistics = ["sum", "mean", "min", "max", "std"]
+    # 0.2 MB can't hold B, so B's panels are regenerated for each row block.
+    for budget in (256, 0.2):
+        result = heavy.heavy_computation(
+            {"matrix_size": 150, "seed": 4, "statistics": statistics, "memory_budget_mb": budget}
+        )
+        assert result["method"] == "tiled"
+        for name, expected in (("sum", C.sum()), ("mean", C.mean()), ("min", C.min()),
+                               ("max", C.max()), ("std", C.std())):
+            assert abs(result[name] - expected) <= 1e-9 * abs(expected), name
+    assert result["tiles"] == heavy._panel_count(150)
+
+
+def test_tiled_statistics_float32(monkeypatch):
+    heavy = local_heavy(monkeypatch)
+    C = direct_product(heavy, 100, seed=5, dtype="float32")
+    result = heavy.heavy_computation(
+        {"matrix_size": 100, "seed": 5, "dtype": "float32", "statistics": ["sum", "max", "std"]}
+    )
+    assert abs(result["sum"] - C.sum()) <= 1e-5 * abs(C.sum())
+    assert abs(result["max"] - C.max()) <= 1e-5 * abs(C.max())
+    assert abs(result["std"] - C.std()) <= 1e-4 * C.std()
+
+
+def test_streamed_blocks_form_the_product(monkeypatch):
+    heavy = local_heavy(monkeypatch)
+    C = direct_product(heavy, 130, seed=6)
+    blocks = []
+    heavy.heavy_computation({"matrix_size": 130, "seed": 6, "memory_budget_mb": 0.2}, on_block=blocks.append)
+    assert len(blocks) > 1
+    assert heavy.np.allclose(heavy.np.concatenate(blocks), C)
+
+
+def test_process_batch_reports_each_key(monkeypatch):
+    heavy = local_heavy(monkeypatch)
+    keys = [f"scenario_inputs/batch_{i}.json" for i in range(5)]
+    for i, key in enumerate(keys):
+        upload_input_file({"request_id": str(i), "parameters": {"matrix_size": 20 + i, "seed": i}}, key, verbose=False)
+    s3.put_object(Bucket=INPUT_BUCKET, Key=keys[2], Body=b"{not json")
+    keys.insert(3, "scenario_inputs/missing.json")
+
+    statuses = heavy.process_batch(INPUT_BUCKET, keys, io_workers=2)
+
+    assert [s["key"] for s in statuses] == keys
+    assert [s["status"] for s in statuses] == ["success", "success", "error", "error", "success", "success"]
+    for status in statuses:
+        if status["status"] == "success":
+            result = json.loads(s3.get_object(Bucket=OUTPUT_BUCKET, Key=status["output_key"])["Body"].read())
+            assert result["original_key"] == status["key"]
+            assert result["computation_result"]["seed"] == result["original_data"]["parameters"]["seed"]
+
+
+def test_batch_handler_counts_failures(monkeypatch):
+    heavy = local_heavy(monkeypatch)
+    upload_input_file({"parameters": {"matrix_size": 10}}, "scenario_inputs/ok.json", verbose=False)
+    response = heavy.lambda_handler(
+        {"bucket": INPUT_BUCKET, "keys": ["scenario_inputs/ok.json", "scenario_inputs/gone.json"]}, None
+    )
+    assert response["status"] == "partial_failure"
+    assert (response["processed"], response["failed"]) == (1, 1)
+
+
+def s3_event(*objects):
+    return {"Records": [{"s3": {"bucket": {"name": bucket}, "object": {"key": key}}} for bucket, key in objects]}
+
+
+def test_parse_records_reads_every_record():
+    import l7
+
+    event = s3_event(("in", "scenario_inputs/a+b%2Bc.json"), ("other", "x.json"))
+    assert l7.parse_records(event) == [("in", "scenario_inputs/a b+c.json"), ("other", "x.json")]
+
+
+def test_make_batches_limits():
+    import l7
+
+    objects = [("a", f"k{i}") for i in range(7)] + [("b", "only")] + [("a", "k7")]
+    batches = l7.make_batches(objects, 3)
+    assert batches == [("a", ["k0", "k1", "k2"]), ("a", ["k3", "k4", "k5"]), ("a", ["k6", "k7"]), ("b", ["only"])]
+    assert l7.make_batches(objects[:4], 1) == [("a", [f"k{i}"]) for i in range(4)]
+    assert l7.make_batches(objects[:4], 10) == [("a", ["k0", "k1", "k2", "k3"])]
+    assert l7.make_batches([], 3) == []
+
+
+def test_dispatch_invokes_one_heavy_call_per_batch(monkeypatch):
+    backends.configure("memory")
+    import l7
+
+    received = []
+    backends.register_function("test-heavy", lambda event, context: received.append(event))
+    monkeypatch.setenv("HEAVY_FUNCTION_NAME", "test-heavy")
+    monkeypatch.setattr(l7, "INLINE_MAX_COST", 0)
+    monkeypatch.setattr(l7, "DISPATCH_BATCH_SIZE", 2)
+
+    keys = [f"scenario_inputs/job_{i}.json" for i in range(5)]
+    response = l7.lambda_handler(s3_event(*((INPUT_BUCKET, key) for key in keys), (INPUT_BUCKET, "notes.txt")), None)
+    lambda_client.wait()
+
+    assert (response["status"], response["dispatched"], response["failed"]) == ("triggered", 5, 0)
+    assert [r["status"] for r in response["results"]].count("skipped") == 1
+    assert sorted(len(event.get("keys", [event.get("key")])) for event in received) == [1, 2, 2]
+    assert sorted(k for event in received for k in event.get("keys", [event.get("key")])) == keys
+
+
+def test_incomplete_local_s3_fails_on_construction():
+    import pytest
+
+    class NoScan(backends.LocalS3):
+        _open = backends.MemoryS3._open
+        _store = backends.MemoryS3._store
+        _remove = backends.MemoryS3._remove
+
+    with pytest.raises(TypeError):
+        NoScan()
+
+
+
+def test_percentiles_and_latency_summary():
+    assert metrics.percentile([], 50) is None
+    assert metrics.percentile([3, 1, 2], 50) == 2
+    assert metrics.percentile([1, 2, 3, 4], 50) == 2.5
+    assert metrics.percentile(range(101), 95) == 95
+    assert metrics.percentile([1, 2], 100) == 2 and metrics.percentile([1, 2], 0) == 1
+    assert metrics.summarize_latencies([]) == {"count": 0}
+    import pytest
+    assert metrics.summarize_latencies([4, 1, 3, 2]) == pytest.approx(
+        {"count": 4, "mean": 2.5, "min": 1, "p50": 2.5, "p95": 3.85, "p99": 3.97, "max": 4})
+
+
+def test_load_test_runs_every_job_through_the_pipeline(monkeypatch):
+    local_heavy(monkeypatch)
+    register_local_functions()
+    report = run_load_test(4, concurrency=2, matrix_size=40, timeout=30)
+    assert (report["succeeded"], report["timed_out"], report["failed"]) == (4, 0, 0)
+    assert report["latency_s"]["end_to_end"]["count"] == 4
+    assert set(report["latency_s"]) >= {"upload", "invoke", "wait_for_result", "end_to_end"}
+
+
+def test_rate_mode_latency_includes_queueing(monkeypatch):
+    import sys
+
+    # Each job takes 50 ms but one is scheduled every 10 ms on a single
+    # worker, so later jobs wait in line for longer and longer.
+    this = sys.modules[__name__]
+    monkeypatch.setattr(this, "upload_input_file", lambda *args, **kwargs: None)
+    monkeypatch.setattr(this, "invoke_light_lambda", lambda *args, **kwargs: None)
+    monkeypatch.setattr(this, "poll_for_result", lambda *args, **kwargs: time.sleep(0.05) or {})
+    report = run_load_test(6, concurrency=1, rate=100, timeout=1)
+
+    latency = report["latency_s"]
+    assert report["succeeded"] == 6
+    assert latency["wait_for_result"]["max"] < 0.1
+    assert latency["end_to_end"]["max"] >= 0.2  # the last job waited ~200 ms for the worker
+    assert latency["queued"]["max"] >= 0.15 and latency["queued"]["min"] < 0.01
+
+def test_result_cache_only_serves_seeded_jobs(monkeypatch):
+    heavy = local_heavy(monkeypatch)
+    monkeypatch.setattr(heavy, "RESULT_CACHE_ENABLED", True)
+    monkeypatch.setattr(heavy, "result_cache", heavy.ResultCache(s3, OUTPUT_BUCKET, prefix="test-cache/"))
+
+    first, info = heavy.cached_computation({"matrix_size": 30})
+    second, _ = heavy.cached_computation({"matrix_size": 30})
+    assert info == {"enabled": True, "hit": False, "skipped": "unseeded"}
+    assert first["seed"] != second["seed"]
+
+    seeded, info = heavy.cached_computation({"matrix_size": 30, "seed": 8})
+    assert not info["hit"]
+    again, info = heavy.cached_computation({"statistics": ["mean", "sum"], "seed": 8, "matrix_size": 30})
+    assert info["hit"] and again == json.loads(json.dumps(seeded))
+    _, info = heavy.cached_computation({"matrix_size": 30, "seed": 9})
+    assert not info["hit"]
+
+
+
+class DeniedS3:
+    """An S3 client whose calls all fail like a role without access to the bucket."""
+    exceptions = s3.exceptions
+
+    def __getattr__(self, name):
+        def denied(**kwargs):
+            raise backends.LocalClientError(f"AccessDenied: {name}")
+        return denied
+
+
+def test_result_cache_errors_are_logged_misses(monkeypatch):
+    heavy = local_heavy(monkeypatch)
+    monkeypatch.setattr(heavy, "RESULT_CACHE_ENABLED", True)
+    monkeypatch.setattr(heavy, "result_cache", heavy.ResultCache(DeniedS3(), OUTPUT_BUCKET))
+
+    result, info = heavy.cached_computation({"matrix_size": 30, "seed": 8})
+    assert result["seed"] == 8 and not info["hit"]
+    assert heavy.result_cache.stats()["errors"] == 2  # the read and the write
+    heavy.result_cache.invalidate(info["key"])
+    assert heavy.result_cache.stats()["errors"] == 3
+
+
+def test_result_cache_deletes_expired_remote_entries(monkeypatch):
+    import result_cache
+
+    backends.configure("memory")
+    cache = result_cache.ResultCache(s3, OUTPUT_BUCKET, prefix="test-cache/", ttl_s=60)
+    cache.put("k", {"v": 1})
+    assert result_cache.ResultCache(s3, OUTPUT_BUCKET, prefix="test-cache/", ttl_s=60).get("k") == {"v": 1}
+
+    later = time.time() + 120
+    monkeypatch.setattr(result_cache.time, "time", lambda: later)
+    fresh = result_cache.ResultCache(s3, OUTPUT_BUCKET, prefix="test-cache/", ttl_s=60)
+    assert fresh.get("k") is None and fresh.stats()["expirations"] == 1
+    import pytest
+    with pytest.raises(s3.exceptions.NoSuchKey):
+        s3.get_object(Bucket=OUTPUT_BUCKET, Key="test-cache/k.json")
+
+
+def test_binary_outputs_round_trip_through_load_arrays(monkeypatch, tmp_path):
+    import numpy as np
+    from result_store import load_arrays
+
+    heavy = local_heavy(monkeypatch)
+    C = direct_product(heavy, 120, seed=5)
+    for output_format, compress in (("npy", False), ("npz", False), ("npz", True)):
+        parameters = {"matrix_size": 120, "seed": 5, "output_format": output_format, "compress": compress,
+                      "outputs": ["row_sums", "product"], "statistics": ["sum", "max"]}
+        key = f"scenario_inputs/binary_{output_format}_{compress}.json"
+        entry = heavy.process_input(key, {"request_id": "binary", "parameters": parameters})
+        manifest = json.loads(s3.get_object(Bucket=OUTPUT_BUCKET, Key=entry["output_key"])["Body"].read())
+
+        arrays = load_arrays(s3, OUTPUT_BUCKET, entry["output_key"], str(tmp_path / output_format / str(compress)))
+        np.testing.assert_allclose(arrays["product"], C, rtol=1e-12)
+        np.testing.assert_allclose(arrays["row_sums"], C.sum(axis=1), rtol=1e-9)
+        assert manifest["computation_result"] == json.loads(json.dumps(heavy.heavy_computation(parameters)))
+        if output_format == "npz":
+            assert all("bytes" not in array for array in manifest["arrays"].values())
+            size = s3.head_object(Bucket=OUTPUT_BUCKET, Key=manifest["archive"]["key"])["ContentLength"]
+            assert manifest["archive"]["bytes"] == size
+        else:
+            assert "archive" not in manifest
+            for array in manifest["arrays"].values():
+                assert array["bytes"] == s3.head_object(Bucket=OUTPUT_BUCKET, Key=array["key"])["ContentLength"]
+
+
+class RecordingS3:
+    """Passes calls through to the local S3 client and records their names."""
+
+    def __init__(self):
+        self.calls = []
+
+    def __getattr__(self, name):
+        def call(**kwargs):
+            self.calls.append(name)
+            return getattr(s3, name)(**kwargs)
+        return call
+
+
+def test_multipart_writer_switches_to_multipart_above_part_size():
+    from result_store import MultipartWriter
+
+    backends.configure("memory")
+    data = os.urandom(2500)
+    small, large = RecordingS3(), RecordingS3()
+    with MultipartWriter(small, OUTPUT_BUCKET, "mp/small.bin", part_size=4096) as writer:
+        writer.write(data)
+    with MultipartWriter(large, OUTPUT_BUCKET, "mp/large.bin", part_size=1024) as writer:
+        for i in range(0, len(data), 300):
+            writer.write(data[i:i + 300])
+
+    assert small.calls == ["put_object"]
+    assert large.calls == ["create_multipart_upload"] + ["upload_part"] * 3 + ["complete_multipart_upload"]
+    for key in ("mp/small.bin", "mp/large.bin"):
+        assert s3.get_object(Bucket=OUTPUT_BUCKET, Key=key)["Body"].read() == data
+
+
+def test_failed_writes_abort_the_upload():
+    import pytest
+    from result_store import MultipartWriter, ResultArrays
+
+    backends.configure("memory")
+    recording = RecordingS3()
+    with pytest.raises(RuntimeError):
+        with MultipartWriter(recording, OUTPUT_BUCKET, "mp/aborted.bin", part_size=1024) as writer:
+            writer.write(os.urandom(3000))
+            raise RuntimeError("compute failed")
+    assert recording.calls[-1] == "abort_multipart_upload" and "complete_multipart_upload" not in recording.calls
+
+    with pytest.raises(RuntimeError):
+        with ResultArrays(s3, OUTPUT_BUCKET, "mp/arrays", "npz") as arrays:
+            with arrays.array("row_sums", (4,), "float64") as stream:
+                stream.write([1.0, 2.0])
+                raise RuntimeError("compute failed")
+    for key in ("mp/aborted.bin", "mp/arrays.npz"):
+        with pytest.raises(s3.exceptions.NoSuchKey):
+            s3.head_object(Bucket=OUTPUT_BUCKET, Key=key)
+    assert s3.list_objects_v2(Bucket=".multipart")["KeyCount"] == 0
+
+def test_iter_documents_resumes_after_projected_document():
+    import mongomock
+    import pytest
+    from pymongo import DESCENDING
+
+    import database
+
+    db = mongomock.MongoClient()["test"]
+    db.results.insert_many([{"_id": i, "score": i % 4, "name": f"n{i}"} for i in range(20)])
+    scan = dict(projection={"name": 1}, sort=[("score", DESCENDING)])
+
+    everything = list(database.iter_documents(db, "results", batch_size=3, **scan))
+    first = list(database.iter_documents(db, "results", limit=7, **scan))
+    assert "score" not in first[-1]
+    rest = list(database.iter_documents(db, "results", resume_after=first[-1], batch_size=4, **scan))
+    assert first + rest == everything
+
+    with pytest.raises(ValueError):
+        next(database.iter_documents(db, "results", resume_after={"name": "n3"}, **scan))
+    with pytest.raises(ValueError):
+        next(database.iter_documents(db, "results", resume_after=99, **scan))
+
+
+
+def query_cache(monkeypatch, **kwargs):
+    """A fresh query cache, switched on for this test only."""
+    import database
+
+    cache = database.QueryCache(**kwargs)
+    monkeypatch.setattr(database, "_query_cache", cache)
+    return cache
+
+
+def test_query_cache_serves_copies_until_expiry(monkeypatch):
+    import mongomock
+    import database
+
+    cache = query_cache(monkeypatch, ttl_s=30)
+    now = [1000.0]
+    monkeypatch.setattr(database.time, "monotonic", lambda: now[0])
+    db = mongomock.MongoClient()["test"]
+    db.jobs.insert_many([{"_id": i, "kind": i % 2} for i in range(6)])
+
+    first = database.find_documents(db, "jobs", {"kind": 1})
+    first.append("mutated")
+    assert database.find_documents(db, "jobs", {"kind": 1}) == [{"_id": 1, "kind": 1}, {"_id": 3, "kind": 1},
+                                                                 {"_id": 5, "kind": 1}]
+    db.jobs.insert_one({"_id": 7, "kind": 1})  # not through database: invisible until expiry
+    assert len(database.find_documents(db, "jobs", {"kind": 1})) == 3
+    assert len(database.find_documents(db, "jobs", {"kind": 1}, use_cache=False)) == 4
+    now[0] += 31
+    assert len(database.find_documents(db, "jobs", {"kind": 1})) == 4
+    assert cache.stats() == {"hits": 2, "misses": 2, "evictions": 0, "expirations": 1, "invalidations": 0,
+                             "entries": 1}
+
+
+def test_query_cache_evicts_least_recently_used(monkeypatch):
+    import mongomock
+    import database
+
+    cache = query_cache(monkeypatch, max_entries=2)
+    db = mongomock.MongoClient()["test"]
+    db.jobs.insert_many([{"_id": i} for i in range(4)])
+    for i in (0, 1, 0, 2):  # 1 is the least recently used when 2 comes in
+        database.find_documents(db, "jobs", {"_id": i})
+    assert cache.stats()["evictions"] == 1
+    database.find_documents(db, "jobs", {"_id": 0})
+    database.find_documents(db, "jobs", {"_id": 1})
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["evictions"], stats["entries"]) == (2, 4, 2, 2)
+
+
+def test_query_cache_is_invalidated_by_every_write_helper(monkeypatch):
+    import mongomock
+    import database
+
+    cache = query_cache(monkeypatch)
+    db = mongomock.MongoClient()["test"]
+    writes = [
+        lambda: database.insert_document(db, "jobs", {"n": 1}),
+        lambda: database.insert_documents(db, "jobs", [{"n": 2}, {"n": 3}]),
+        lambda: database.bulk_insert(db, "jobs", ({"n": n} for n in range(4, 9)), chunk_size=2),
+    ]
+    expected = 0
+    for write, added in zip(writes, (1, 2, 5)):
+        assert len(database.find_documents(db, "jobs")) == expected
+        database.find_documents(db, "other")
+        write()
+        expected += added
+        assert len(database.find_documents(db, "jobs")) == expected
+    stats = cache.stats()
+    # Each write dropped the cached "jobs" read, so the read after it missed,
+    # and left "other" cached.
+    assert (stats["invalidations"], stats["hits"], stats["misses"]) == (3, 4, 5)
+
+    # A read that started before a write must not store what it read.
+    key = cache.make_key(db, "jobs", {}, 0)
+    generation = cache.generation(db, "jobs")
+    stale = list(db.jobs.find())
+    database.insert_document(db, "jobs", {"n": 9})
+    cache.put(key, stale, generation)
+    assert cache.get(key) is None
+
+
+def test_query_cache_key_canonicalization():
+    import mongomock
+    import database
+
+    db = mongomock.MongoClient()["test"]
+    key = database.QueryCache.make_key
+    assert key(db, "jobs", {"a": 1, "b": 2}, 0) == key(db, "jobs", {"b": 2, "a": 1}, 0)
+    assert key(db, "jobs", None, 0) == key(db, "jobs", {}, 0)
+    # Embedded-document equality depends on field order, so nested order is kept.
+    assert key(db, "jobs", {"a": {"x": 1, "y": 2}}, 0) != key(db, "jobs", {"a": {"y": 2, "x": 1}}, 0)
+    assert key(db, "jobs", {"a": 1}, 0) != key(db, "jobs", {"a": 1}, 5)
+    assert key(db, "jobs", {"a": 1}, 0) != key(db, "other", {"a": 1}, 0)
+    assert key(db, "jobs", {"a": 1}, 0) != key(db, "jobs", {"a": "1"}, 0)
+
+def test_result_sink_flush_thresholds():
+    from result_sink import ResultSink
+
+    batches = []
+    sink = ResultSink(batches.append, max_records=3, max_bytes=100, max_age_s=3600)
+    sink.add({"i": 0}, size=10)
+    sink.add({"i": 1}, size=10)
+    assert batches == []
+    sink.add({"i": 2}, size=10)
+    assert batches == [[{"i": 0}, {"i": 1}, {"i": 2}]]
+
+    sink.add({"i": 3}, size=150)
+    assert batches[-1] == [{"i": 3}]
+
+    sink.max_age_s = 0
+    sink.add({"i": 4})
+    assert batches[-1] == [{"i": 4}]
+    assert sink.flush() == 0
+    assert sink.stats() == {"buffered": 0, "flushes": 3, "written": 5, "failed": 0}
+
+
+def test_result_sink_failed_flush_is_counted_and_recovers():
+    from result_sink import ResultSink
+
+    calls = []
+
+    def write_batch(records):
+        calls.append(list(records))
+        if len(calls) == 1:
+            raise ConnectionError("mongo down")
+
+    sink = ResultSink(write_batch, max_records=10, max_age_s=3600)
+    sink.add({"i": 0})
+    sink.add({"i": 1})
+    assert sink.flush() == 0  # logged and counted, not raised
+    assert sink.stats() == {"buffered": 0, "flushes": 0, "written": 0, "failed": 2}
+
+    sink.add({"i": 2})
+    assert sink.flush() == 1
+    assert calls[-1] == [{"i": 2}]
+    assert sink.stats() == {"buffered": 0, "flushes": 1, "written": 1, "failed": 2}
+
+
+def test_heavy_handler_flushes_sink_before_returning(monkeypatch):
+    heavy = local_heavy(monkeypatch)
+    from result_sink import ResultSink
+
+    batches = []
+    monkeypatch.setattr(heavy, "result_sink", ResultSink(batches.append, max_records=100, max_age_s=3600))
+    upload_input_file({"request_id": "sink", "parameters": {"matrix_size": 10}}, "scenario_inputs/sink.json",
+                      verbose=False)
+    heavy.lambda_handler({"bucket": INPUT_BUCKET, "key": "scenario_inputs/sink.json"}, None)
+
+    assert len(batches) == 1
+    assert batches[0][0]["output_key"] == "results/sink.json"
+    assert batches[0][0]["original_data"]["request_id"] == "sink"
+
+
+def test_mongo_writer_uses_pooled_client(monkeypatch):
+    import mongomock
+
+    import database
+    from result_sink import mongo_writer
+
+    created = []
+    monkeypatch.setattr(database, "_clients", {})
+    monkeypatch.setattr(database, "MongoClient", lambda uri, **kwargs: created.append(uri) or mongomock.MongoClient())
+    write_batch = mongo_writer("mongodb://sink-test:27017", "pipeline", "results")
+    write_batch([{"i": 0}])
+    write_batch([{"i": 1}, {"i": 2}])
+
+    assert created == ["mongodb://sink-test:27017"]
+    client = database.get_client("mongodb://sink-test:27017")
+    assert client["pipeline"]["results"].count_documents({}) == 3
+
+
+
+def test_get_client_shares_one_client_per_settings(monkeypatch):
+    import database
+
+    created = []
+
+    def factory(kind):
+        return lambda uri, **kwargs: created.append((kind, uri, kwargs)) or object()
+
+    monkeypatch.setattr(database, "_clients", {})
+    monkeypatch.setattr(database, "MongoClient", factory("sync"))
+    monkeypatch.setattr(database, "AsyncMongoClient", factory("async"))
+    uri = "mongodb://pool-test:27017"
+
+    default = database.get_client(uri)
+    assert database.get_client(uri) is default
+    assert database.get_client(uri, max_pool_size=database.MONGO_MAX_POOL_SIZE) is default
+    assert database.get_client(uri, max_pool_size=5) is not default
+    assert database.get_client(uri, asynchronous=True) is not default
+    database.get_client(uri, max_pool_size=0, timeout_ms=0)  # 0 is pymongo's "no limit", not "default"
+
+    assert [(kind, kwargs["maxPoolSize"]) for kind, _, kwargs in created] == [
+        ("sync", database.MONGO_MAX_POOL_SIZE), ("sync", 5), ("async", database.MONGO_MAX_POOL_SIZE), ("sync", 0)]
+    assert created[-1][2]["serverSelectionTimeoutMS"] == 0
+
+
+def test_async_helpers_run_sync_databases_on_the_executor(monkeypatch):
+    import asyncio
+    import threading
+    import mongomock
+    import database
+
+    db = mongomock.MongoClient()["test"]
+    cache = query_cache(monkeypatch)
+    threads = set()
+    insert_document = database.insert_document
+    monkeypatch.setattr(database, "insert_document",
+                        lambda *args: threads.add(threading.current_thread().name) or insert_document(*args))
+
+    async def scenario():
+        ids = await asyncio.gather(*(database.insert_document_async(db, "jobs", {"i": i}) for i in range(20)))
+        more = await database.insert_documents_async(db, "jobs", [{"i": i} for i in range(20, 25)])
+        found = await database.find_documents_async(db, "jobs", {"i": {"$lt": 3}})
+        again = await database.find_documents_async(db, "jobs", {"i": {"$lt": 3}})
+        return ids, more, found, again
+
+    ids, more, found, again = asyncio.run(scenario())
+    assert len(set(ids)) == 20 and len(more) == 5
+    assert sorted(d["i"] for d in found) == [0, 1, 2] and again == found
+    assert threading.main_thread().name not in threads and threads
+    # The async and sync helpers share one query cache.
+    assert database.find_documents(db, "jobs", {"i": {"$lt": 3}}) == found
+    assert cache.stats()["hits"] == 2
+    asyncio.run(database.insert_document_async(db, "jobs", {"i": -1}))
+    assert len(database.find_documents(db, "jobs", {"i": {"$lt": 3}})) == 4
+
+def run_fanout(heavy, monkeypatch, parameters):
+    """Runs one job as a fan-out on the local invoker; returns (handler response, output)."""
+    monkeypatch.setenv("HEAVY_FUNCTION_NAME", "test-heavy-fanout")
+    backends.register_function("test-heavy-fanout", heavy.lambda_handler)
+    key = f"scenario_inputs/fanout_{uuid.uuid4().hex[:8]}.json"
+    upload_input_file({"request_id": "fanout", "parameters": parameters}, key, verbose=False)
+    response = heavy.lambda_handler({"bucket": INPUT_BUCKET, "key": key}, None)
+    lambda_client.wait()
+    assert not lambda_client.errors
+    output = json.loads(s3.get_object(Bucket=OUTPUT_BUCKET, Key=response["output_key"])["Body"].read())
+    return response, output
+
+
+def test_fanout_summary_matches_single_invocation(monkeypatch):
+    heavy = local_heavy(monkeypatch)
+    b_row_sums = heavy._b_row_sums
+    builds = []
+    monkeypatch.setattr(heavy, "_b_row_sums", lambda params: builds.append(1) or b_row_sums(params))
+
+    parameters = {"matrix_size": 300, "seed": 11, "tiles": 3}
+    response, output = run_fanout(heavy, monkeypatch, parameters)
+    assert (response["status"], response["tiles"]) == ("fanned_out", 3)
+    assert len(builds) == 1  # by the coordinator, not once per tile
+
+    result = output["computation_result"]
+    single = heavy.heavy_computation({"matrix_size": 300, "seed": 11})
+    assert (result["method"], result["tiles"]) == ("fanout", 3)
+    for name in ("sum", "mean"):
+        assert abs(result[name] - single[name]) <= 1e-9 * abs(single[name])
+
+
+def test_fanout_full_statistics_match_single_invocation(monkeypatch):
+    heavy = local_heavy(monkeypatch)
+    statistics = ["sum", "mean", "min", "max", "std"]
+    response, output = run_fanout(heavy, monkeypatch, {"matrix_size": 200, "seed": 12, "tiles": 4,
+                                                       "statistics": statistics})
+    assert (response["status"], response["tiles"]) == ("fanned_out", 4)
+
+    result = output["computation_result"]
+    single = heavy.heavy_computation({"matrix_size": 200, "seed": 12, "statistics": statistics})
+    for name in statistics:
+        assert abs(result[name] - single[name]) <= 1e-9 * abs(single[name]), name
+
+
+
+def tile_objects(heavy):
+    return s3.list_objects_v2(Bucket=OUTPUT_BUCKET, Prefix=heavy.FANOUT_PREFIX)["KeyCount"]
+
+
+def test_fanout_removes_its_tiles_after_the_reduce(monkeypatch):
+    heavy = local_heavy(monkeypatch)
+    run_fanout(heavy, monkeypatch, {"matrix_size": 200, "seed": 13, "tiles": 3})
+    assert tile_objects(heavy) == 0
+
+
+def test_fanout_with_a_failed_tile_writes_an_error_output(monkeypatch):
+    heavy = local_heavy(monkeypatch)
+    tile_partial = heavy.tile_partial
+
+    def flaky(params, first, stop, b_row_sums=None):
+        if first > 0:
+            raise MemoryError("tile too big")
+        return tile_partial(params, first, stop, b_row_sums)
+
+    monkeypatch.setattr(heavy, "tile_partial", flaky)
+    response, output = run_fanout(heavy, monkeypatch, {"matrix_size": 200, "seed": 14, "tiles": 3})
+    assert response["status"] == "fanned_out"
+    assert output["status"] == "error" and output["error"] == "2 of 3 tiles failed"
+    assert sorted(f["tile"] for f in output["failed_tiles"]) == [1, 2]
+    assert "tile too big" in output["failed_tiles"][0]["error"]
+    assert tile_objects(heavy) == 0
+
+
+def test_fanout_is_reduced_once(monkeypatch):
+    heavy = local_heavy(monkeypatch)
+    written = []
+    write_output = heavy.write_output
+    monkeypatch.setattr(heavy, "write_output", lambda *args: written.append(args[0]) or write_output(*args))
+    tiles = []  # run by hand below instead of by the local invoker
+    monkeypatch.setattr(heavy.lambda_client, "invoke",
+                        lambda **kwargs: tiles.append(json.loads(kwargs["Payload"])["tile"]))
+    monkeypatch.setenv("HEAVY_FUNCTION_NAME", "unused")
+    upload_input_file({"parameters": {"matrix_size": 200, "seed": 15, "tiles": 2}}, "scenario_inputs/race.json",
+                      verbose=False)
+    entry = heavy.process_input("scenario_inputs/race.json",
+                                heavy.load_input(INPUT_BUCKET, "scenario_inputs/race.json"))
+    job = entry["job"]
+    assert heavy._claim_reduce(job)  # another invocation is mid-reduce
+    for tile in tiles:
+        heavy.process_tile(tile)
+    assert written == [] and heavy.reduce_tiles(job) is None
+
+    s3.delete_object(Bucket=OUTPUT_BUCKET, Key=heavy._tile_prefix(job) + "reduce.claim")
+    assert heavy.reduce_tiles(job) == entry["output_key"]
+    assert heavy.reduce_tiles(job) is None  # a late racer finds the job finished
+    assert heavy.process_tile(tiles[0])["status"] == "skipped"  # and so does a redelivered tile
+    assert written == ["scenario_inputs/race.json"] and tile_objects(heavy) == 0
+
+def test_light_dispatches_fanout_jobs_instead_of_running_them_inline(monkeypatch):
+    heavy = local_heavy(monkeypatch)
+    import l7
+
+    received = []
+    backends.register_function("test-heavy", lambda event, context: received.append(event))
+    monkeypatch.setenv("HEAVY_FUNCTION_NAME", "test-heavy")
+    monkeypatch.setattr(l7, "INLINE_MAX_COST", 1e9)
+    upload_input_file({"parameters": {"matrix_size": 100, "tiles": 2}}, "scenario_inputs/split.json", verbose=False)
+    upload_input_file({"parameters": {"matrix_size": 100}}, "scenario_inputs/small.json", verbose=False)
+
+    response = l7.lambda_handler(s3_event((INPUT_BUCKET, "scenario_inputs/split.json"),
+                                          (INPUT_BUCKET, "scenario_inputs/small.json")), None)
+    lambda_client.wait()
+
+    statuses = {r["key"]: r["status"] for r in response["results"]}
+    assert statuses == {"scenario_inputs/small.json": "inline", "scenario_inputs/split.json": "triggered"}
+    assert received == [{"bucket": INPUT_BUCKET, "key": "scenario_inputs/split.json"}]
+
+
+
+EAGER_INLINE_SCRIPT = """
+import json
+import backends
+s3 = backends.client("s3")
+s3.put_object(Bucket="eager", Key="scenario_inputs/small.json",
+              Body=json.dumps({"parameters": {"matrix_size": 50, "seed": 1}}))
+import l7
+event = {"Records": [{"s3": {"bucket": {"name": "eager"}, "object": {"key": "scenario_inputs/small.json"}}}]}
+print("RESULT" + json.dumps(l7.lambda_handler(event, None)))
+"""
+
+
+def test_inline_path_runs_in_eager_mode():
+    # Eager init imports numpy from inside the lazy import of Lambda_heavy;
+    # a fresh interpreter is needed so that import really happens.
+    import subprocess
+    import sys
+
+    env = dict(os.environ, COLD_START_MODE="eager", PIPELINE_BACKEND="memory", RESULT_CACHE="off",
+               HEAVY_FUNCTION_NAME="unused")
+    out = subprocess.run([sys.executable, "-c", EAGER_INLINE_SCRIPT], capture_output=True, text=True,
+                         check=True, env=env, timeout=120, cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+    response = json.loads(next(line[6:] for line in out.splitlines() if line.startswith("RESULT")))
+    assert (response["status"], response["inline"]) == ("completed", 1)
+
+
+PATCH_BASE = "".join(f"line {i}\n" for i in range(1, 31))
+
+
+def one_patch(diff):
+    import diffpatch
+
+    patches = list(diffpatch.parse_diff(diffpatch.iter_lines(diff)))
+    assert len(patches) == 1
+    return patches[0]
+
+
+def test_parse_diff_reads_git_and_plain_headers():
+    import diffpatch
+
+    diff = (
+        "From: someone\nSubject: [PATCH] Tweak two files\n\n"
+        "diff --git a/pkg/a.py b/pkg/a.py\nindex 1..2 100644\n--- a/pkg/a.py\n+++ b/pkg/a.py\n"
+        "@@ -1,2 +1,2 @@\n-x = 1\n+x = 2\n y = 3\n"
+        "--- b.py\t2024-01-01\n+++ b.py\t2024-01-02\n@@ -5 +5,2 @@\n z\n+w\n\\ No newline at end of file\n"
+    )
+    first, second = diffpatch.parse_diff(diffpatch.iter_lines(diff))
+    assert (first.path, first.stats(), len(first.hunks)) == ("pkg/a.py", (1, 1), 1)
+    assert (second.path, second.stats()) == ("b.py", (1, 0))
+    hunk = second.hunks[0]
+    assert (hunk.old_start, hunk.old_len, hunk.new_start, hunk.new_len) == (5, 1, 5, 2)
+    assert not hunk.new_eof_newline
+    assert diffpatch.subject(diff) == "Tweak two files"
+
+
+def test_apply_hunk_at_offset():
+    import diffpatch
+
+    patch = one_patch("--- a/f.py\n+++ b/f.py\n@@ -10,3 +10,3 @@\n line 10\n-line 11\n+LINE 11\n line 12\n")
+    shifted = "".join(f"extra {i}\n" for i in range(4)) + PATCH_BASE
+    result = diffpatch.apply_file_patch(patch, shifted)
+    assert result["status"] == "applied"
+    assert (result["offsets"], result["fuzz"]) == ([4], 0)
+    assert result["code"] == shifted.replace("line 11\n", "LINE 11\n")
+
+
+def test_apply_hunk_with_fuzz():
+    import diffpatch
+
+    diff = "--- a/f.py\n+++ b/f.py\n@@ -10,5 +10,5 @@\n line 10\n line 11\n-line 12\n+LINE 12\n line 13\n stale\n"
+    result = diffpatch.apply_file_patch(one_patch(diff), PATCH_BASE)
+    assert (result["status"], result["fuzz"]) == ("applied", 1)
+    assert result["code"] == PATCH_BASE.replace("line 12\n", "LINE 12\n")
+
+    import pytest
+
+    with pytest.raises(diffpatch.PatchError):
+        diffpatch.apply_file_patch(one_patch(diff), PATCH_BASE, fuzz=0)
+
+
+def test_apply_new_and_deleted_files():
+    import diffpatch
+
+    new = one_patch("diff --git a/n.py b/n.py\nnew file mode 100644\n--- /dev/null\n+++ b/n.py\n"
+                    "@@ -0,0 +1,2 @@\n+a = 1\n+b = 2\n")
+    assert diffpatch.apply_file_patch(new) == {"filename": "n.py", "hunks": 1, "status": "new", "code": "a = 1\nb = 2\n"}
+
+    gone = one_patch("diff --git a/d.py b/d.py\ndeleted file mode 100644\n--- a/d.py\n+++ /dev/null\n"
+                     "@@ -1,2 +0,0 @@\n-a = 1\n-b = 2\n")
+    assert gone.is_deleted and gone.path == "d.py"
+    assert diffpatch.apply_file_patch(gone, "a = 1\nb = 2\n")["status"] == "deleted"
+
+
+def test_apply_diff_reports_rejected_hunk():
+    import diffpatch
+
+    diff = ("--- a/ok.py\n+++ b/ok.py\n@@ -1,2 +1,2 @@\n-line 1\n+LINE 1\n line 2\n"
+            "--- a/bad.py\n+++ b/bad.py\n@@ -3,3 +3,3 @@\n nothing\n-like\n+this\n here\n")
+    results = diffpatch.apply_diff(diff, {"ok.py": PATCH_BASE, "bad.py": PATCH_BASE}.get)
+    (_, ok), (_, bad) = results
+    assert ok["status"] == "applied" and ok["code"].startswith("LINE 1\nline 2\n")
+    assert bad["status"] == "failed" and bad["code"] is None and "Hunk #1" in bad["error"]
+    assert "1 failed to apply" in diffpatch.summarize(results)
+
+
+def test_directory_loader_stays_under_root(tmp_path):
+    import diffpatch
+
+    (tmp_path / "base").mkdir()
+    (tmp_path / "base" / "f.py").write_text(PATCH_BASE)
+    (tmp_path / "secret.py").write_text("secret\n")
+    load = diffpatch.directory_loader(str(tmp_path / "base"))
+    assert load("f.py") == PATCH_BASE
+    assert load("missing.py") is None
+    for path in ("../secret.py", str(tmp_path / "secret.py"), "sub/../../secret.py"):
+        diff = f"--- a/{path}\n+++ b/{path}\n@@ -1 +1 @@\n-secret\n+public\n"
+        (_, result), = diffpatch.apply_diff(diff, load)
+        assert result["status"] == "failed" and "escapes" in result["error"], path
+
+
+def test_analyze_pr_only_returns_fully_patched_files(tmp_path, monkeypatch):
+    import l7
+
+    (tmp_path / "f.py").write_text(PATCH_BASE)
+    (tmp_path / "f2.py").write_text("other\n")
+    monkeypatch.setenv("PR_BASE_DIR", str(tmp_path))
+    diff = ("--- a/f.py\n+++ b/f.py\n@@ -1,2 +1,2 @@\n-line 1\n+LINE 1\n line 2\n"
+            "--- a/nobase.py\n+++ b/nobase.py\n@@ -7,2 +7,2 @@\n-x\n+y\n z\n"
+            "--- a/f2.py\n+++ b/f2.py\n@@ -1,1 +1,1 @@\n-nope\n+yes\n"
+            "--- /dev/null\n+++ b/new.py\n@@ -0,0 +1 @@\n+print('hi')\n")
+    report = json.loads(l7.analyze_pr(diff))
+    assert [f["filename"] for f in report["files"]] == ["f.py", "new.py"]
+    assert "1 without a base" in report["summary"] and "1 failed to apply" in report["summary"]
+
+
+def stream_chunks(doc, size):
+    data = doc.encode()
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+def random_json(rng, depth=0):
+    """A random document rich in number runs: ints, floats, huge ints, mixed and nested arrays."""
+    number = rng.choice([
+        lambda: rng.randint(-10 ** 6, 10 ** 6),
+        lambda: round(rng.uniform(-1e3, 1e3), rng.randint(0, 6)),
+        lambda: float(rng.randint(-99, 99)),
+        lambda: rng.choice([2 ** 53 + 1, -2 ** 63, 2 ** 63 - 1, 2 ** 70, 1e300, 5e-324]),
+    ])
+    kind = rng.randrange(6 if depth < 3 else 2)
+    if kind == 0:
+        return number()
+    if kind == 1:
+        return rng.choice([None, True, "s", number()])
+    if kind == 2:  # a run of numbers, sometimes with other elements in or after it
+        items = [number() for _ in range(rng.randint(0, 40))]
+        if items and rng.random() < 0.3:
+            items.insert(rng.randrange(len(items) + 1), rng.choice([None, True, "x", [1, 2]]))
+        return items
+    if kind == 3:  # rows, rectangular or not
+        width = rng.randint(1, 6)
+        return [[number() for _ in range(width + (rng.random() < 0.1))] for _ in range(rng.randint(1, 8))]
+    if kind == 4:
+        return {f"k{i}": random_json(rng, depth + 1) for i in range(rng.randint(0, 4))}
+    return [random_json(rng, depth + 1) for _ in range(rng.randint(0, 4))]
+
+
+def exact_dump(value):
+    """JSON text that tells 7 from 7.0 and keeps a dtype's name next to each ndarray."""
+    import numpy as np
+
+    if isinstance(value, np.ndarray):
+        return f"{value.dtype.name}{json.dumps(value.tolist())}"
+    if isinstance(value, dict):
+        return "{" + ",".join(f"{json.dumps(k)}:{exact_dump(v)}" for k, v in value.items()) + "}"
+    if isinstance(value, list):
+        return "[" + ",".join(map(exact_dump, value)) + "]"
+    return json.dumps(value)
+
+
+def test_json_stream_matches_json_loads_at_any_chunk_size(monkeypatch):
+    import random
+    import json_stream
+
+    monkeypatch.setattr(json_stream, "ARRAY_MIN_ITEMS", 8)
+    rng = random.Random(25)
+    docs = [json.dumps(random_json(rng), indent=rng.choice([None, 1])) for _ in range(300)]
+    docs += ["[7, 8.0, null]", "[" + ", ".join(["-660296"] * 30) + ", 1.5]",
+             json.dumps([1] * 20 + [0.5]), json.dumps(list(range(20)) + [None])]
+    for doc in docs:
+        expected = json.loads(doc)
+        # Arrays become ndarrays by their content alone, never by where chunks split.
+        converted = exact_dump(json_stream._arrays(expected) if isinstance(expected, (dict, list)) else expected)
+        expected = json.loads(doc)
+        for size in (1, 7, 64, 4096):
+            loaded = json_stream.load(stream_chunks(doc, size))
+            assert json_stream.to_builtin(loaded) == expected, (doc, size)
+            assert exact_dump(loaded) == converted, (doc, size)
+
+
+def test_json_stream_keeps_number_types_outside_arrays(monkeypatch):
+    import json_stream
+
+    monkeypatch.setattr(json_stream, "ARRAY_MIN_ITEMS", 8)
+    for offset in range(12):
+        doc = " " * offset + "[7, 8.0, null]"
+        for size in (1, 7, 64):
+            assert repr(json_stream.load(stream_chunks(doc, size))) == "[7, 8.0, None]"
+    ints = json_stream.load(stream_chunks(json.dumps([-660296] * 30), 7))
+    assert ints.dtype.name == "int64"
+    mixed = json_stream.load(stream_chunks(json.dumps([-660296] * 30 + [0.5]), 7))
+    assert mixed.dtype.name == "float64"
+    short = json_stream.load(stream_chunks("[1, 2.5, 3]", 1))
+    assert [type(x) for x in short] == [int, float, int]
+
+
+def test_json_stream_rejects_invalid_numbers_in_long_runs(monkeypatch):
+    import pytest
+    import json_stream
+
+    monkeypatch.setattr(json_stream, "ARRAY_MIN_ITEMS", 8)
+    run = ", ".join(str(i) for i in range(40))
+    for bad in ("+2", "01", "2.", ".5", "1e", "1e+", "--1", "-", "1.e3", "0x1", "1 2", "1,,2"):
+        for doc in (f"[{run}, {bad}]", f"[{bad}, {run}]", f"[{run}, {bad}, {run}]", f"[{run}, {bad}, null]"):
+            with pytest.raises(json.JSONDecodeError):
+                json.loads(doc)
+            for size in (1, 7, 64, 4096):
+                with pytest.raises(json.JSONDecodeError):
+                    json_stream.load(stream_chunks(doc, size))
+    for doc in (f"[{run},]", f"[{run}, ]"):
+        for size in (1, 7, 4096):
+            with pytest.raises(json.JSONDecodeError):
+                json_stream.load(stream_chunks(doc, size))
+
+
+
+
+def test_orbit_ensemble_euler_matches_scalar_orbit():
+    import numpy as np
+    import Lambda_light
+
+    scalar = Lambda_light._drunken_star_positions(8e30, (1.5e11, 0), (0, 29780), 0.0, 60, 3000)
+    ensemble = Lambda_light.simulate_orbit_ensemble(n_stars=4, steps=3000, drunk_noise=0.0, seed=1,
+                                                    return_trajectories=True)
+    for star in range(4):
+        np.testing.assert_allclose(ensemble["trajectories"][:, star], scalar, rtol=1e-9, atol=1.0)
+    np.testing.assert_allclose(ensemble["final_pos"][0], scalar[-1], rtol=1e-9)
+
+
+def test_orbit_ensemble_is_reproducible_from_its_seed():
+    import numpy as np
+    import Lambda_light
+
+    run = dict(n_stars=5, steps=1500, drunk_noise=0.01, return_trajectories=True)
+    for integrator in ("euler", "leapfrog"):
+        first = Lambda_light.simulate_orbit_ensemble(seed=4, integrator=integrator, **run)
+        again = Lambda_light.simulate_orbit_ensemble(seed=4, integrator=integrator, **run)
+        other = Lambda_light.simulate_orbit_ensemble(seed=5, integrator=integrator, **run)
+        assert np.array_equal(first["trajectories"], again["trajectories"])
+        assert not np.array_equal(first["trajectories"], other["trajectories"])
+        # Stars draw independent noise, so they drift apart.
+        assert not np.array_equal(first["final_pos"][0], first["final_pos"][1])
+
+def test_record_orbit_resumes_bit_for_bit(tmp_path, monkeypatch):
+    import numpy as np
+    import pytest
+    import Lambda_light
+
+    run = dict(steps=2500, n_stars=3, seed=21, drunk_noise=0.01, decimate=3)
+    path = str(tmp_path / "orbit.npy")
+    advance = Lambda_light._OrbitEnsemble.advance
+    calls = []
+
+    def interrupted(self, *args, **kwargs):
+        calls.append(1)
+        if len(calls) == 2:
+            raise KeyboardInterrupt
+        return advance(self, *args, **kwargs)
+
+    monkeypatch.setattr(Lambda_light._OrbitEnsemble, "advance", interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        Lambda_light.record_orbit(path, chunk_steps=700, **run)
+    monkeypatch.setattr(Lambda_light._OrbitEnsemble, "advance", advance)
+    assert os.path.exists(path + ".ckpt.npz")
+
+    with pytest.raises(ValueError, match="seed"):
+        Lambda_light.record_orbit(path, chunk_steps=700, **dict(run, seed=22))
+    summary = Lambda_light.record_orbit(path, chunk_steps=700, **run)
+    assert not os.path.exists(path + ".ckpt.npz")
+
+    decimate = run.pop("decimate")
+    expected = Lambda_light.simulate_orbit_ensemble(return_trajectories=True, **run)
+    recorded = np.load(path)
+    assert recorded.shape == (834, 3, 2)
+    assert np.array_equal(recorded, expected["trajectories"][::decimate])
+    for name in ("final_pos", "final_vel", "r_min", "r_max", "r_mean", "energy_drift"):
+        assert np.array_equal(summary[name], expected[name]), name
+
+
+def test_knight_moves_match_the_reference_on_every_square():
+    import Lambda_light
+
+    for square in Lambda_light.SQUARES:
+        assert Lambda_light.knight_moves(square) == Lambda_light._knight_moves_reference(square), square
+    assert Lambda_light.knight_moves("a1") == ["b3", "c2"]
+    assert len(Lambda_light.knight_moves("e4")) == 8
+
+
+def test_knight_moves_batch_validates_every_square():
+    import pytest
+    import Lambda_light
+
+    squares = ["a1", "e4", "h8", "d5"]
+    assert Lambda_light.knight_moves_batch(squares) == [Lambda_light.knight_moves(s) for s in squares]
+    assert Lambda_light.knight_moves_batch([]) == []
+    for bad in ("i1", "a9", "a0", "", "A1", "1a"):
+        with pytest.raises(ValueError):
+            Lambda_light.knight_moves_batch(["a1", bad])
+    # The batch's lists are copies, not the shared table entries.
+    Lambda_light.knight_moves_batch(["a1"])[0].append("zz")
+    assert Lambda_light.knight_moves("a1") == ["b3", "c2"]
+
+
+def test_knight_distance_known_values():
+    import Lambda_light
+
+    assert Lambda_light.knight_distance("a1", "h8") == 6
+    assert Lambda_light.knight_distance("a1", "b2") == 4
+    assert Lambda_light.knight_distance("a1", "a1") == 0
+    assert Lambda_light.knight_distance("a1", "c2") == 1
+    assert Lambda_light.knight_distance("a1", "a2") == 3
+    assert Lambda_light.knight_distance("e4", "e5") == 3
+    table = Lambda_light.knight_distance_table()
+    assert all(table[i][j] == table[j][i] for i in range(64) for j in range(64))
+    assert max(max(row) for row in table) == 6
+
+
+def test_rocket_launch_batch_matches_scalar_loop():
+    import numpy as np
+    import rocketlaunch
+
+    cases = [
+        (2.0e4, 500.0, 12.0),  # ordinary launch
+        (3.0e4, 800.0, 7.35),  # burn time not a whole number of steps
+        (2.0e4, 500.0, 0.05),  # burn shorter than one step: no Euler steps at all
+        (2.0e4, 500.0, 0.0),
+        (3.0e3, 500.0, 10.0),  # thrust below weight: net acceleration is negative
+        (4905.0, 500.0, 10.0),  # thrust exactly equal to weight
+    ]
+    thrust, mass, burn_time = (np.array(column) for column in zip(*cases))
+    for dt in (0.1, 0.25):
+        scalar = np.array([rocketlaunch.simulate_rocket_launch(t, m, b, dt) for t, m, b in cases])
+        step = rocketlaunch.simulate_rocket_launch_batch(thrust, mass, burn_time, dt, method="step")
+        closed = rocketlaunch.simulate_rocket_launch_batch(thrust, mass, burn_time, dt, method="closed")
+        np.testing.assert_allclose(step, scalar, rtol=1e-12, atol=1e-9)
+        np.testing.assert_allclose(closed, scalar, rtol=1e-9, atol=1e-6)
+    assert scalar[2] == scalar[3] == 0.0 and scalar[4] < 0
+
+    # Broadcasting: one thrust against many masses.
+    masses = np.linspace(300, 900, 7)
+    batch = rocketlaunch.simulate_rocket_launch_batch(2.5e4, masses, 9.0)
+    np.testing.assert_allclose(batch, [rocketlaunch.simulate_rocket_launch(2.5e4, m, 9.0) for m in masses], rtol=1e-9)
+
+    import pytest
+    with pytest.raises(ValueError):
+        rocketlaunch.simulate_rocket_launch_batch(thrust, mass, burn_time, method="rk4")
+
+
+def test_rocket_flight_matches_analytic_apogee_without_drag():
+    import rocketlaunch
+
+    thrust, mass, burn_time = 2.0e4, 500.0, 12.0
+    acceleration = thrust / mass - rocketlaunch.G0
+    burnout_velocity = acceleration * burn_time
+    apogee = acceleration * burn_time ** 2 / 2 + burnout_velocity ** 2 / (2 * rocketlaunch.G0)
+    flight = rocketlaunch.simulate_rocket_flight(thrust, mass, 0.0, burn_time, rtol=1e-10, atol=1e-10)
+    assert abs(flight["max_altitude"] - apogee) <= 1e-8 * apogee
+    assert abs(flight["apogee_time"] - (burn_time + burnout_velocity / rocketlaunch.G0)) <= 1e-8
+
+
+def test_rocket_flight_below_weight_stays_on_the_pad():
+    import rocketlaunch
+
+    flight = rocketlaunch.simulate_rocket_flight(3.0e3, 500.0, 100.0, 10.0, record_trajectory=True)
+    assert flight["max_altitude"] == 0.0
+    assert (flight["trajectory"]["altitude"] == 0.0).all() and (flight["trajectory"]["velocity"] == 0.0).all()
+
+
+def test_rocket_flight_tolerance_sets_the_step_count():
+    import pytest
+    import rocketlaunch
+
+    case = dict(thrust=3.0e4, dry_mass=400.0, propellant_mass=600.0, burn_time=25.0, drag_coefficient=0.4, area=0.3)
+    loose = rocketlaunch.simulate_rocket_flight(**case, rtol=1e-3, atol=1e-3)
+    tight = rocketlaunch.simulate_rocket_flight(**case, rtol=1e-10, atol=1e-10)
+    reference = rocketlaunch.simulate_rocket_flight(**case, rtol=1e-12, atol=1e-12)["max_altitude"]
+    assert loose["steps"] < tight["steps"]
+    assert abs(tight["max_altitude"] - reference) < abs(loose["max_altitude"] - reference) + 1e-9
+    assert abs(tight["max_altitude"] - reference) <= 1e-6 * reference
+
+    with pytest.raises(RuntimeError):
+        rocketlaunch.simulate_rocket_flight(**case, max_steps=10)
+    with pytest.raises(ValueError):
+        rocketlaunch.simulate_rocket_flight(3.0e4, 0.0, 600.0, 25.0)
+
+def sample_tree():
+    #        r
+    #      / | \
+    #     a stop b
+    #    / \     \
+    #   c   d     e
+    leaf = lambda name: {"name": name}
+    return {"name": "r", "children": [
+        {"name": "a", "children": [leaf("c"), leaf("d")]},
+        leaf("stop"),
+        {"name": "b", "children": [leaf("e")]},
+    ]}
+
+
+def test_iter_tree_orders_depth_and_paths():
+    import Lambda_light
+
+    names = lambda nodes: [n["name"] for n in nodes]
+    tree = sample_tree()
+    assert names(Lambda_light.iter_tree(tree)) == ["r", "a", "c", "d", "stop", "b", "e"]
+    assert names(Lambda_light.iter_tree(tree, "bfs")) == ["r", "a", "stop", "b", "c", "d", "e"]
+    assert names(Lambda_light.iter_tree(tree, max_depth=1)) == ["r", "a", "stop", "b"]
+    assert names(Lambda_light.iter_tree(tree, prune=lambda n, depth: n["name"] == "a")) == ["r", "a", "stop", "b", "e"]
+    paths = {n["name"]: (depth, path) for n, depth, path in Lambda_light.iter_tree(tree, with_path=True)}
+    assert paths["r"] == (0, ()) and paths["d"] == (2, (0, 1)) and paths["e"] == (2, (2, 0))
+
+    import pytest
+    with pytest.raises(ValueError):
+        next(Lambda_light.iter_tree(tree, "sideways"))
+
+
+def test_traverse_tree_prune_and_stop_signals():
+    import Lambda_light
+
+    def walk(signals, order="dfs"):
+        seen = []
+        Lambda_light.traverse_tree(sample_tree(), lambda n: seen.append(n["name"]) or signals.get(n["name"]), order)
+        return seen
+
+    assert walk({"a": Lambda_light.PRUNE}) == ["r", "a", "stop", "b", "e"]
+    assert walk({"a": Lambda_light.STOP}) == ["r", "a"]
+    assert walk({"stop": Lambda_light.STOP}, "bfs") == ["r", "a", "stop"]
+    # Whatever else a visitor returns is ignored, even the signals' old string values.
+    assert walk({"a": "prune", "stop": "stop"}) == ["r", "a", "c", "d", "stop", "b", "e"]
+    seen = []
+    Lambda_light.traverse_tree(sample_tree(), lambda n: seen.append(n["name"]) or n["name"])
+    assert seen == ["r", "a", "c", "d", "stop", "b", "e"]
+
+
+def test_traverse_tree_handles_very_deep_trees():
+    import Lambda_light
+
+    depth = 100_000
+    tree = node = {"name": 0}
+    for i in range(1, depth):
+        node["children"] = [{"name": i}]
+        node = node["children"][0]
+    seen = []
+    Lambda_light.traverse_tree(tree, lambda n: seen.append(n["name"]))
+    assert seen == list(range(depth))
+    assert sum(1 for _ in Lambda_light.iter_tree(tree, "bfs", max_depth=depth // 2)) == depth // 2 + 1
 
 
 if __name__ == "__main__":